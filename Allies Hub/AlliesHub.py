@@ -1,725 +1,1131 @@
-    import logging
-    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
-    from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, ConversationHandler, MessageHandler, Filters, \
-        CallbackContext
-    import sqlite3
-    from datetime import datetime, timedelta
-
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
-    )
-    logger = logging.getLogger(__name__)
-
-    NICKNAME, GAME, RANK, DESCRIPTION, EDITING = range(5)
-    MAIN_MENU_BUTTON = "🏠 Главное меню"
-
-    # Инициализация базы данных
-    conn = sqlite3.connect('allies.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    # Создание таблиц
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            game TEXT,
-            rank TEXT,
-            description TEXT,
-            is_searching BOOLEAN DEFAULT FALSE,
-            is_banned BOOLEAN DEFAULT FALSE,
-            ban_end DATETIME
+import logging
+import signal
+import threading
+import time
+from telegram import Update
+from telegram.ext import ExtBot, Updater, CommandHandler, CallbackQueryHandler, ConversationHandler, MessageHandler, Filters, \
+    CallbackContext
+from datetime import datetime, timedelta
+
+import metrics
+import storage
+from bans import BanList
+from callbacks import CallbackRegistry, matcher
+from cache import ProfileCache
+from feed import LOADING, CandidateFeed
+from invalidations import Invalidations
+from metrics import MetricsServer, TimedRequest
+from outbox import Outbox
+from persistence import SQLitePersistence
+from ranks import parse_rank
+from seen import SeenProfiles
+from rendering import (
+    MAIN_MENU_BUTTON, MAIN_MENU_MARKUP, MAIN_ACTIONS_MARKUP, CREATE_PROFILE_MARKUP, EDIT_PROFILE_MARKUP,
+    SEARCH_LOADING_MARKUP, profile_markup, invite_markup, invite_history_markup, search_results_markup, profile_card
+)
+from search import SEARCH_START
+from settings import (
+    BOT_TOKEN, HEARTBEAT_FILE, HEARTBEAT_INTERVAL, DRAIN_TIMEOUT,
+    WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE,
+    WORKER_LISTEN, WORKER_PORT, WORKER_SECRET, WORKER_PATH,
+    METRICS_LISTEN, METRICS_PORT, ADMIN_IDS, BOT_CON_POOL_SIZE
+)
+from webhook import WebhookServer
+from writebehind import WriteBehind
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+NICKNAME, GAME, RANK, DESCRIPTION, EDITING = range(5)
+# Как часто снимать истекшие блокировки
+BAN_CHECK_INTERVAL = 60
+# Блокировка: столько жалоб от разных пользователей за скользящее окно
+REPORT_THRESHOLD = 5
+REPORT_WINDOW = 30 * 24 * 3600
+BAN_DURATION = timedelta(days=14)
+
+# Кэш анкет: сколько держать в памяти и сколько секунд доверять записи
+PROFILE_CACHE_SIZE = 10000
+PROFILE_CACHE_TTL = 60
+
+# Поля анкеты, которые можно менять через редактирование
+PROFILE_FIELDS = ('game', 'rank', 'description')
+# Игры бот только ищет в каталоге, новые добавляет администратор (python games.py add)
+UNKNOWN_GAME_TEXT = "🤔 Не нашли такую игру. Проверьте название или напишите его иначе, например: Dota 2, CS2, Valorant"
+
+# История инвайтов: записей на странице и подписи статусов
+INVITE_HISTORY_PAGE = 10
+INVITE_STATUS_TEXT = {
+    'accepted': "✅ Принята ✅",
+    'rejected': "❌ Отклонена ❌",
+    'pending': "⏳ Ожидает ответа ⏳",
+    'expired': "⌛ Истекла ⌛",
+}
+# Курсор первой страницы - новее любой записи
+HISTORY_START = ('9999-12-31 23:59:59', 0)
+# Запрос без ответа истекает через INVITE_TTL (и не мешает отправить новый),
+# отвеченные и истекшие старше INVITE_ARCHIVE_AFTER уходят в invites_archive.
+# Проверка - раз в INVITE_MAINTENANCE_INTERVAL секунд, строк за транзакцию - INVITE_BATCH
+INVITE_TTL = timedelta(days=7)
+INVITE_ARCHIVE_AFTER = timedelta(days=30)
+INVITE_MAINTENANCE_INTERVAL = 600
+INVITE_BATCH = 1000
+
+# Поиск по описаниям: анкет на странице, символов описания в карточке
+# (все карточки - одно сообщение, а оно не длиннее 4096) и подсказка к команде
+SEARCH_PAGE = 5
+SEARCH_SNIPPET = 300
+SEARCH_HINT = "🔎 Напишите /search и слова из описания, например: /search микрофон вечер"
+# Лента еще ищет непросмотренные анкеты (feed.LOADING)
+SEARCH_LOADING_TEXT = "⏳ Ищем анкеты, которые вы еще не видели. Нажмите «Продолжить поиск» через пару секунд."
+
+# Просмотренные анкеты (seen.py): фильтр на SEEN_CAPACITY анкет с долей ложных
+# срабатываний SEEN_ERROR_RATE; поколение сменяется при заполнении или через
+# SEEN_ROTATE_AFTER. Когда лента кончилась, SEEN_RECYCLE начинает ее заново.
+# Изменения пишутся в базу раз в SEEN_FLUSH_INTERVAL секунд по SEEN_FLUSH_BATCH строк
+SEEN_CAPACITY = int(os.environ.get('ALLIES_SEEN_CAPACITY', 1000))
+SEEN_ERROR_RATE = 0.01
+SEEN_ROTATE_AFTER = timedelta(days=int(os.environ.get('ALLIES_SEEN_ROTATE_DAYS', 14)))
+SEEN_RECYCLE = os.environ.get('ALLIES_SEEN_RECYCLE', '1') != '0'
+SEEN_FLUSH_INTERVAL = 30
+SEEN_FLUSH_BATCH = 500
+
+# База: SQLite (allies.db) или PostgreSQL, если задан ALLIES_DATABASE_URL (storage.py).
+# Таблицы и миграции создаются при старте
+store = storage.get_storage()
+store.init_schema()
+
+# Мелкие изменения (поиск вкл/выкл, правки анкеты, ответы на инвайты) коммитятся
+# пачками. Кто читает данные пользователя после его же правки - сначала writes.wait()
+writes = WriteBehind(transaction=store.transaction)
+
+
+def load_profiles(user_ids) -> dict:
+    # Промахи кэша анкет - одним запросом, после отложенных записей этих пользователей
+    writes.wait(*user_ids)
+    return store.get_profiles(user_ids)
+
+
+# Анкеты читаются через кэш; всякая запись в users сбрасывает запись пользователя
+profile_cache = ProfileCache(load_profiles, PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+
+def fetch_candidates(user_id: int, after_user_id: int, limit: int):
+    # Пачка анкет игры смотрящего, ближайшие по рангу первыми
+    writes.wait(user_id)
+    return store.nearest_candidates(user_id, after_user_id, limit)
+
+
+def save_seen(rows) -> None:
+    for start in range(0, len(rows), SEEN_FLUSH_BATCH):
+        with store.transaction() as conn:
+            store.save_seen(conn, rows[start:start + SEEN_FLUSH_BATCH])
+
+
+# Пролистанные анкеты не возвращаются в ленту, в том числе после "Продолжить поиск"
+seen_profiles = SeenProfiles(store.load_seen, save_seen, SEEN_CAPACITY, SEEN_ERROR_RATE,
+                             SEEN_ROTATE_AFTER.total_seconds(), recycle=SEEN_RECYCLE)
+candidate_feed = CandidateFeed(fetch_candidates, seen=seen_profiles)
+
+# Действующие блокировки в памяти, истекшие снимает ban_expiry_job
+ban_list = BanList()
+
+
+def load_bans() -> None:
+    ban_list.load(store.banned_users())
+
+
+load_bans()
+
+
+def apply_invalidation(user_id: int, kind: str, ban_end) -> None:
+    # Изменение анкеты, сделанное другим процессом (воркеры router.py)
+    profile_cache.invalidate(user_id)
+    if kind == 'hidden':
+        candidate_feed.hide(user_id)
+    elif kind == 'shown':
+        candidate_feed.unhide(user_id)
+        candidate_feed.invalidate(user_id)
+    elif kind == 'banned':
+        ban_list.ban(user_id, ban_end)
+        candidate_feed.hide(user_id)
+        candidate_feed.invalidate(user_id)
+    elif kind == 'unbanned':
+        candidate_feed.invalidate(user_id)
+
+
+# С router.py у каждого воркера свои кэши: изменения расходятся через таблицу
+invalidations = Invalidations(apply_invalidation, enabled=WORKER_PORT is not None, store=store)
+
+
+def share_change(user_id: int, kind: str) -> None:
+    # Строка пишется той же отложенной пачкой, что и изменение, или позже
+    if invalidations.enabled:
+        writes.submit((user_id,), lambda conn: invalidations.record(conn, user_id, kind))
+
+
+# Исходящие сообщения отправляются в фоне с учетом лимитов Telegram
+outbox = Outbox(store=store)
+
+metrics.registry.gauge('allies_outbox_pending', 'Сообщений ждет отправки', outbox.pending)
+metrics.registry.gauge('allies_outbox_queued_total', 'Сообщений поставлено в очередь', lambda: outbox.queued,
+                       kind='counter')
+metrics.registry.gauge('allies_writes_pending', 'Записей ждет фиксации', writes.pending)
+metrics.registry.gauge('allies_writes_commits_total', 'Фиксаций отложенной записи', lambda: writes.commits,
+                       kind='counter')
+metrics.registry.gauge('allies_profile_cache_size', 'Анкет в кэше', lambda: profile_cache.stats()['size'])
+metrics.registry.gauge('allies_profile_cache_hits_total', 'Попаданий в кэш анкет', lambda: profile_cache.hits,
+                       kind='counter')
+metrics.registry.gauge('allies_profile_cache_misses_total', 'Промахов кэша анкет', lambda: profile_cache.misses,
+                       kind='counter')
+
+
+def has_profile(user_id: int) -> bool:
+    return get_profile(user_id) is not None
+
+
+# Операции с данными. Общие для синхронных обработчиков и async_bot.py
+
+def get_profile(user_id: int):
+    return profile_cache.get(user_id)
+
+
+def get_profiles(*user_ids: int) -> dict:
+    rows = profile_cache.get_many(user_ids)
+    return {user_id: row for user_id, row in rows.items() if row is not None}
+
+
+def check_ban(user_id: int):
+    # -> (заблокирован ли, до какого времени); без запроса к базе
+    ban_end = ban_list.get(user_id)
+    if ban_end is None:
+        return False, None
+    return True, datetime.fromtimestamp(ban_end).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def lift_expired_bans() -> list:
+    now = int(time.time())
+    with store.transaction() as conn:
+        lifted = store.lift_expired_bans(conn, now)
+        for user_id in lifted:
+            invalidations.record(conn, user_id, 'unbanned')
+        # Заодно перечитываем список: баны могли выдать другие процессы
+        banned = store.banned_users(conn)
+    # Не load: бан, выданный report_user после чтения, не должен пропасть
+    ban_list.merge(banned, now)
+    for user_id in lifted:
+        profile_cache.invalidate(user_id)
+        candidate_feed.invalidate(user_id)
+    return lifted
+
+
+def find_game(text: str):
+    """(game_id, название) игры из каталога по вводу пользователя или None."""
+    with store.reading() as conn:
+        return store.resolve_game(conn, text)
+
+
+def save_profile(user_id: int, username, game_name: str, rank_name: str, description_text: str) -> None:
+    # Отложенные правки старой анкеты не должны лечь поверх новой
+    writes.wait(user_id)
+    with store.transaction() as conn:
+        # Игра приводится к канонической из каталога, подбор идет по game_id
+        found = store.resolve_game(conn, game_name)
+        if found is None:
+            raise ValueError(f"Unknown game: {game_name}")
+        game_id, game_name = found
+        store.save_profile(conn, user_id, username, game_name, game_id, rank_name,
+                           parse_rank(game_name, rank_name), description_text)
+        invalidations.record(conn, user_id, 'shown')
+    profile_cache.invalidate(user_id)
+    candidate_feed.unhide(user_id)
+    candidate_feed.invalidate(user_id, rewind=True)
+
+
+def update_profile(user_id: int, field: str, value: str) -> None:
+    # Имя колонки подставляется в SQL, поэтому только из белого списка
+    if field not in PROFILE_FIELDS:
+        raise ValueError(f"Unknown profile field: {field}")
+    if field == 'game':
+        # Игру проверяем сразу: отложенная запись уже не может не найти ее
+        found = find_game(value)
+        if found is None:
+            raise ValueError(f"Unknown game: {value}")
+        game_id, name = found
+
+        # Тир зависит от игры - пересчитываем по прежнему рангу
+        def change_game(conn):
+            store.set_game(conn, user_id, name, game_id, parse_rank(name, store.get_rank(conn, user_id)))
+        writes.submit((user_id,), change_game)
+        candidate_feed.invalidate(user_id, rewind=True)
+    elif field == 'rank':
+        def change_rank(conn):
+            store.set_rank(conn, user_id, value, parse_rank(store.get_game(conn, user_id), value))
+        writes.submit((user_id,), change_rank)
+        candidate_feed.invalidate(user_id, rewind=True)
+    else:
+        writes.submit((user_id,), lambda conn: store.set_description(conn, user_id, value))
+    # Запись еще может быть в очереди: промах кэша дождется ее через load_profiles
+    profile_cache.invalidate(user_id)
+    share_change(user_id, 'profile')
+
+
+def set_searching(user_id: int, is_searching: bool) -> None:
+    writes.submit((user_id,), lambda conn: store.set_searching(conn, user_id, is_searching))
+    profile_cache.invalidate(user_id)
+    if is_searching:
+        candidate_feed.unhide(user_id)
+    else:
+        candidate_feed.hide(user_id)
+    share_change(user_id, 'shown' if is_searching else 'hidden')
+
+
+def create_invite(from_user_id: int, to_user_id: int) -> bool:
+    # False - запрос этой анкете уже ждет ответа
+    writes.wait(from_user_id, to_user_id)
+    with store.transaction() as conn:
+        return store.create_invite(conn, from_user_id, to_user_id)
+
+
+def set_invite_status(from_user_id: int, to_user_id: int, status: str) -> bool:
+    # Ответ не откладывается: от него зависят уведомления. False - запрос уже
+    # не ждет ответа (истек или на него ответили)
+    writes.wait(from_user_id, to_user_id)
+    with store.transaction() as conn:
+        return store.set_invite_status(conn, from_user_id, to_user_id, status)
+
+
+def maintain_invites() -> tuple:
+    # -> (истекло, перенесено в архив); пачками, чтобы не держать запись долго
+    now = time.time()
+    expire_before = datetime.utcfromtimestamp(now - INVITE_TTL.total_seconds()).strftime("%Y-%m-%d %H:%M:%S")
+    archive_before = datetime.utcfromtimestamp(now - INVITE_ARCHIVE_AFTER.total_seconds()).strftime(
+        "%Y-%m-%d %H:%M:%S")
+    counts = []
+    for step, before in ((store.expire_invites, expire_before), (store.archive_invites, archive_before)):
+        total = 0
+        while True:
+            with store.transaction() as conn:
+                done = step(conn, before, INVITE_BATCH)
+            total += done
+            if done < INVITE_BATCH:
+                break
+        counts.append(total)
+    if counts[1]:
+        store.compact()
+    return tuple(counts)
+
+
+def show_main_menu(update: Update, context: CallbackContext) -> None:
+    user = update.message.from_user if update.message else update.callback_query.from_user
+    chat_id = update.effective_chat.id
+
+    # Проверяем блокировку аккаунта
+    is_banned, ban_end = check_ban(user.id)
+    if is_banned:
+        outbox.send_message(
+            chat_id,
+            f"⛔ Ваш профиль заблокирован до {ban_end}. Причина: получено много жалоб.",
+            reply_markup=MAIN_MENU_MARKUP
         )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS invites (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            from_user_id INTEGER,
-            to_user_id INTEGER,
-            status TEXT DEFAULT 'pending',
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(from_user_id) REFERENCES users(user_id),
-            FOREIGN KEY(to_user_id) REFERENCES users(user_id)
+        return
+
+    # Заголовок с клавиатурой главного меню outbox пропустит, если она уже есть в чате
+    if has_profile(user.id):
+        outbox.send_menu(
+            chat_id,
+            "Главное меню:", MAIN_MENU_MARKUP,
+            "Выберите действие:", MAIN_ACTIONS_MARKUP
         )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            reported_user_id INTEGER,
-            reporter_user_id INTEGER,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(reported_user_id) REFERENCES users(user_id),
-            FOREIGN KEY(reporter_user_id) REFERENCES users(user_id)
+    else:
+        outbox.send_menu(
+            chat_id,
+            "Главное меню будет доступно после создания анкеты!", MAIN_MENU_MARKUP,
+            "Начните с создания анкеты:", CREATE_PROFILE_MARKUP
         )
-    ''')
-    conn.commit()
-
-
-    def main_menu_markup():
-        return ReplyKeyboardMarkup([[MAIN_MENU_BUTTON]], resize_keyboard=True, one_time_keyboard=False)
-
-
-    def has_profile(user_id: int) -> bool:
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        return cursor.fetchone() is not None
-
-
-    def show_main_menu(update: Update, context: CallbackContext) -> None:
-        user = update.message.from_user if update.message else update.callback_query.from_user
-        chat_id = update.effective_chat.id
-
-        # Проверяем разблокировку аккаунта
-        cursor.execute('SELECT is_banned, ban_end FROM users WHERE user_id = ?', (user.id,))
-        user_data = cursor.fetchone()
-        if user_data and user_data[0]:  # Если аккаунт заблокирован
-            ban_end = datetime.strptime(user_data[1], "%Y-%m-%d %H:%M:%S")
-            if datetime.now() > ban_end:
-                # Разблокируем аккаунт
-                cursor.execute('UPDATE users SET is_banned = FALSE, ban_end = NULL WHERE user_id = ?', (user.id,))
-                conn.commit()
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text="✅ Ваш профиль разблокирован! Теперь вы снова можете искать союзников.",
-                    reply_markup=main_menu_markup()
-                )
-            else:
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"⛔ Ваш профиль заблокирован до {user_data[1]}. Причина: получено много жалоб.",
-                    reply_markup=main_menu_markup()
-                )
-                return
-
-        if has_profile(user.id):
-            keyboard = [
-                [InlineKeyboardButton("Продолжить поиск", callback_data='resume_search')],
-                [InlineKeyboardButton("Изменить анкету", callback_data='edit_profile'),
-                 InlineKeyboardButton("Остановить поиск", callback_data='stop_search')],
-                [InlineKeyboardButton("История инвайтов", callback_data='invite_history'),
-                 InlineKeyboardButton("Моя анкета", callback_data='show_my_profile')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="Главное меню:",
-                reply_markup=main_menu_markup()
-            )
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="Выберите действие:",
-                reply_markup=reply_markup
-            )
-        else:
-            keyboard = [[InlineKeyboardButton("Создать анкету", callback_data='create_profile')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="Главное меню будет доступно после создания анкеты!",
-                reply_markup=main_menu_markup()
-            )
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="Начните с создания анкеты:",
-                reply_markup=reply_markup
-            )
-
-
-    def start(update: Update, context: CallbackContext) -> None:
-        user = update.message.from_user
+
+
+def start(update: Update, context: CallbackContext) -> None:
+    user = update.message.from_user
+    show_main_menu(update, context)
+
+
+def main_menu_handler(update: Update, context: CallbackContext):
+    if update.message.text == MAIN_MENU_BUTTON:
+        # Завершаем любые активные диалоги
+        if context.user_data.get('editing'):
+            context.user_data.clear()
+            update.message.reply_text("Редактирование отменено")
+
         show_main_menu(update, context)
+        return ConversationHandler.END
+
+
+def create_profile(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    query.answer()
+    query.message.reply_text(
+        "Введите ваш игровой никнейм:",
+        reply_markup=MAIN_MENU_MARKUP
+    )
+    return NICKNAME
 
 
-    def main_menu_handler(update: Update, context: CallbackContext):
-        if update.message.text == MAIN_MENU_BUTTON:
-            # Завершаем любые активные диалоги
-            if context.user_data.get('editing'):
-                context.user_data.clear()
-                update.message.reply_text("Редактирование отменено")
+def nickname(update: Update, context: CallbackContext) -> int:
+    context.user_data['nickname'] = update.message.text
+    update.message.reply_text(
+        "Введите название игры:",
+        reply_markup=MAIN_MENU_MARKUP
+    )
+    return GAME
 
-            show_main_menu(update, context)
-            return ConversationHandler.END
 
+def game(update: Update, context: CallbackContext) -> int:
+    found = find_game(update.message.text)
+    if found is None:
+        # Остаемся на этом шаге: неизвестные игры в каталог не попадают
+        update.message.reply_text(UNKNOWN_GAME_TEXT, reply_markup=MAIN_MENU_MARKUP)
+        return GAME
 
-    def create_profile(update: Update, context: CallbackContext) -> int:
-        query = update.callback_query
-        query.answer()
-        query.message.reply_text(
-            "Введите ваш игровой никнейм:",
-            reply_markup=main_menu_markup()
-        )
-        return NICKNAME
+    # Если это редактирование профиля
+    if context.user_data.get('editing'):
+        user_id = update.message.from_user.id
 
+        # Обновляем данные в базе
+        update_profile(user_id, 'game', found[1])
 
-    def nickname(update: Update, context: CallbackContext) -> int:
-        context.user_data['nickname'] = update.message.text
         update.message.reply_text(
-            "Введите название игры:",
-            reply_markup=main_menu_markup()
+            "✅ Игра успешно обновлена!",
+            reply_markup=MAIN_MENU_MARKUP
         )
-        return GAME
+        show_main_menu(update, context)
+        context.user_data.clear()
+        return ConversationHandler.END
+    # Если это создание профиля
+    else:
+        context.user_data['game'] = found[1]
+        update.message.reply_text(
+            "Введите ваш ранг в игре:",
+            reply_markup=MAIN_MENU_MARKUP
+        )
+        return RANK
 
 
-    def game(update: Update, context: CallbackContext) -> int:
-        # Если это редактирование профиля
-        if context.user_data.get('editing'):
-            new_game = update.message.text
-            user_id = update.message.from_user.id
-
-            # Обновляем данные в базе
-            cursor.execute('''
-                UPDATE users 
-                SET game = ?
-                WHERE user_id = ?
-            ''', (new_game, user_id))
-            conn.commit()
-
-            update.message.reply_text(
-                "✅ Игра успешно обновлена!",
-                reply_markup=main_menu_markup()
-            )
-            show_main_menu(update, context)
-            context.user_data.clear()
-            return ConversationHandler.END
-        # Если это создание профиля
-        else:
-            context.user_data['game'] = update.message.text
-            update.message.reply_text(
-                "Введите ваш ранг в игре:",
-                reply_markup=main_menu_markup()
-            )
-            return RANK
+def rank(update: Update, context: CallbackContext) -> int:
+    # Если это редактирование профиля
+    if context.user_data.get('editing'):
+        new_rank = update.message.text
+        user_id = update.message.from_user.id
 
+        # Обновляем данные в базе
+        update_profile(user_id, 'rank', new_rank)
 
-    def rank(update: Update, context: CallbackContext) -> int:
-        # Если это редактирование профиля
-        if context.user_data.get('editing'):
-            new_rank = update.message.text
-            user_id = update.message.from_user.id
-
-            # Обновляем данные в базе
-            cursor.execute('''
-                UPDATE users 
-                SET rank = ?
-                WHERE user_id = ?
-            ''', (new_rank, user_id))
-            conn.commit()
-
-            update.message.reply_text(
-                "✅ Ранг успешно обновлен!",
-                reply_markup=main_menu_markup()
-            )
-            show_main_menu(update, context)
-            context.user_data.clear()
-            return ConversationHandler.END
-        # Если это создание профиля
-        else:
-            context.user_data['rank'] = update.message.text
-            update.message.reply_text(
-                "Напишите краткое описание о себе и кого ищете:",
-                reply_markup=main_menu_markup()
-            )
-            return DESCRIPTION
+        update.message.reply_text(
+            "✅ Ранг успешно обновлен!",
+            reply_markup=MAIN_MENU_MARKUP
+        )
+        show_main_menu(update, context)
+        context.user_data.clear()
+        return ConversationHandler.END
+    # Если это создание профиля
+    else:
+        context.user_data['rank'] = update.message.text
+        update.message.reply_text(
+            "Напишите краткое описание о себе и кого ищете:",
+            reply_markup=MAIN_MENU_MARKUP
+        )
+        return DESCRIPTION
 
 
-    def description(update: Update, context: CallbackContext) -> int:
-        user = update.message.from_user
+def description(update: Update, context: CallbackContext) -> int:
+    user = update.message.from_user
+
+    # Если это редактирование профиля
+    if context.user_data.get('editing'):
+        new_description = update.message.text
+
+        # Обновляем данные в базе
+        update_profile(user.id, 'description', new_description)
 
-        # Если это редактирование профиля
-        if context.user_data.get('editing'):
-            new_description = update.message.text
-
-            # Обновляем данные в базе
-            cursor.execute('''
-                UPDATE users 
-                SET description = ?
-                WHERE user_id = ?
-            ''', (new_description, user.id))
-            conn.commit()
-
-            update.message.reply_text(
-                "✅ Описание успешно обновлено!",
-                reply_markup=main_menu_markup()
-            )
-            show_main_menu(update, context)
-            context.user_data.clear()
-            return ConversationHandler.END
-        # Если это создание профиля
-        else:
-            context.user_data['description'] = update.message.text
-
-            cursor.execute('''
-                INSERT OR REPLACE INTO users 
-                (user_id, username, game, rank, description, is_searching)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                user.id,
-                user.username,
-                context.user_data['game'],
-                context.user_data['rank'],
-                context.user_data['description'],
-                True
-            ))
-            conn.commit()
-
-            update.message.reply_text(
-                "Анкета создана! Начинаем поиск...",
-                reply_markup=main_menu_markup()
-            )
-            show_next_profile(update, context, user.id)
-            return ConversationHandler.END
-
-
-    def cancel(update: Update, context: CallbackContext) -> int:
         update.message.reply_text(
-            'Создание анкеты отменено',
-            reply_markup=main_menu_markup()
+            "✅ Описание успешно обновлено!",
+            reply_markup=MAIN_MENU_MARKUP
         )
+        show_main_menu(update, context)
+        context.user_data.clear()
         return ConversationHandler.END
+    # Если это создание профиля
+    else:
+        context.user_data['description'] = update.message.text
+
+        save_profile(
+            user.id,
+            user.username,
+            context.user_data['game'],
+            context.user_data['rank'],
+            context.user_data['description']
+        )
 
+        update.message.reply_text(
+            "Анкета создана! Начинаем поиск...",
+            reply_markup=MAIN_MENU_MARKUP
+        )
+        show_next_profile(update, context, user.id)
+        return ConversationHandler.END
 
-    def show_my_profile(update: Update, context: CallbackContext, user_id: int) -> None:
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        profile = cursor.fetchone()
-
-        if profile:
-            profile_text = f"""
-            Ваша анкета:
-            🎮 Игра: {profile[2]}
-            👤 Никнейм: {profile[1]}
-            🏆 Ранг: {profile[3]}
-            📝 Описание: {profile[4]}
-            """
-            context.bot.send_message(
-                chat_id=user_id,
-                text=profile_text,
-                reply_markup=main_menu_markup()
-            )
-        else:
-            context.bot.send_message(
-                chat_id=user_id,
-                text="У вас еще нет анкеты!",
-                reply_markup=main_menu_markup()
-            )
 
-        # Показываем главное меню после отображения анкеты
-        show_main_menu(update, context)
+def search(update: Update, context: CallbackContext) -> None:
+    user_id = update.message.from_user.id
+    text = ' '.join(context.args)
+    if not text:
+        update.message.reply_text(SEARCH_HINT, reply_markup=MAIN_MENU_MARKUP)
+        return
+    if check_ban(user_id)[0]:
+        update.message.reply_text(
+            "⛔ Ваш профиль заблокирован. Вы не можете искать союзников.",
+            reply_markup=MAIN_MENU_MARKUP
+        )
+        return
 
+    # Запрос нужен для следующих страниц, в кнопку он не помещается
+    context.user_data['search'] = text
+    result_text, reply_markup = show_search_results(user_id, text)
+    update.message.reply_text(result_text, reply_markup=reply_markup)
 
-    def show_next_profile(update: Update, context: CallbackContext, user_id: int, offset: int = 0) -> None:
-        # Проверяем не заблокирован ли пользователь
-        cursor.execute('SELECT is_banned FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        if result and result[0]:
-            context.bot.send_message(
-                chat_id=user_id,
-                text="⛔ Ваш профиль заблокирован. Вы не можете искать союзников.",
-                reply_markup=main_menu_markup()
-            )
-            return
-
-        cursor.execute('''
-            SELECT * FROM users 
-            WHERE game = (SELECT game FROM users WHERE user_id = ?)
-            AND is_searching = TRUE
-            AND is_banned = FALSE
-            AND user_id != ?
-            LIMIT 1 OFFSET ?
-        ''', (user_id, user_id, offset))
-        profile = cursor.fetchone()
-
-        chat_id = update.effective_chat.id
-        message = None
-
-        if isinstance(update, Update) and update.message:
-            message = update.message
-        elif update.callback_query and update.callback_query.message:
-            message = update.callback_query.message
-
-        if profile:
-            profile_text = f"""
-            🎮 Игра: {profile[2]}
-            👤 Никнейм: {profile[1]}
-            🏆 Ранг: {profile[3]}
-            📝 Описание: {profile[4]}
-            """
-            keyboard = [
-                [InlineKeyboardButton("Следующая анкета", callback_data=f'next_{offset + 1}')],
-                [
-                    InlineKeyboardButton("Отправить запрос", callback_data=f'invite_{profile[0]}'),
-                    InlineKeyboardButton("Перестать искать", callback_data='stop_search')
-                ],
-                [
-                    InlineKeyboardButton("Изменить анкету", callback_data='edit_profile'),
-                    InlineKeyboardButton("Пожаловаться на профиль", callback_data=f'report_{profile[0]}')
-                ]
-            ]
 
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            if message:
-                message.reply_text(profile_text, reply_markup=reply_markup)
-            else:
-                context.bot.send_message(chat_id, profile_text, reply_markup=reply_markup)
+def stats_text() -> str:
+    cache = profile_cache.stats()
+    return (
+        f"{metrics.format_stats()}\n\n"
+        f"Очередь отправки: {outbox.pending()}, отложенных записей: {writes.pending()}\n"
+        f"Кэш анкет: {cache['size']} записей, попаданий {cache['hit_rate']:.0%}"
+    )
+
+
+def stats(update: Update, context: CallbackContext) -> None:
+    # Остальным пользователям команда не видна
+    if update.message.from_user.id in ADMIN_IDS:
+        update.message.reply_text(stats_text())
+
+
+def cancel(update: Update, context: CallbackContext) -> int:
+    update.message.reply_text(
+        'Создание анкеты отменено',
+        reply_markup=MAIN_MENU_MARKUP
+    )
+    return ConversationHandler.END
+
+
+def show_my_profile(update: Update, context: CallbackContext, user_id: int) -> None:
+    profile = get_profile(user_id)
+
+    if profile:
+        profile_text = profile_card(profile, "Ваша анкета:")
+        outbox.send_message(
+            user_id,
+            profile_text,
+            reply_markup=MAIN_MENU_MARKUP
+        )
+    else:
+        outbox.send_message(
+            user_id,
+            "У вас еще нет анкеты!",
+            reply_markup=MAIN_MENU_MARKUP
+        )
+
+    # Показываем главное меню после отображения анкеты
+    show_main_menu(update, context)
+
+
+def show_next_profile(update: Update, context: CallbackContext, user_id: int, after_user_id: int = 0) -> None:
+    if check_ban(user_id)[0]:
+        outbox.send_message(
+            user_id,
+            "⛔ Ваш профиль заблокирован. Вы не можете искать союзников.",
+            reply_markup=MAIN_MENU_MARKUP
+        )
+        return
+
+    # Анкеты берутся из очереди в памяти, в базу ходим раз в пачку
+    profile = candidate_feed.next(user_id, after_user_id)
+
+    chat_id = update.effective_chat.id
+    message = None
+
+    if isinstance(update, Update) and update.message:
+        message = update.message
+    elif update.callback_query and update.callback_query.message:
+        message = update.callback_query.message
+
+    if profile and profile is not LOADING:
+        profile_text = profile_card(profile)
+        reply_markup = profile_markup(profile[0])
+        if message:
+            message.reply_text(profile_text, reply_markup=reply_markup)
+        else:
+            outbox.send_message(chat_id, profile_text, reply_markup=reply_markup)
+    else:
+        if profile is LOADING:
+            text, reply_markup = SEARCH_LOADING_TEXT, SEARCH_LOADING_MARKUP
         else:
-            text = "Пока нет подходящих анкет. Попробуйте позже."
-            reply_markup = main_menu_markup()
-            if message:
-                message.reply_text(text, reply_markup=reply_markup)
-            else:
-                context.bot.send_message(chat_id, text, reply_markup=reply_markup)
-
-
-    def show_invite_history(user_id: int) -> str:
-        # Получаем историю отправленных инвайтов
-        cursor.execute('''
-            SELECT u.username, i.status 
-            FROM invites i
-            JOIN users u ON i.to_user_id = u.user_id
-            WHERE i.from_user_id = ?
-        ''', (user_id,))
-        sent_invites = cursor.fetchall()
-
-        # Получаем историю полученных инвайтов
-        cursor.execute('''
-            SELECT u.username, i.status 
-            FROM invites i
-            JOIN users u ON i.from_user_id = u.user_id
-            WHERE i.to_user_id = ?
-        ''', (user_id,))
-        received_invites = cursor.fetchall()
-
-        history_text = "📝 Ваша история инвайтов 🎮:\n\n"
-
-        # Добавляем отправленные инвайты
-        for username, status in sent_invites:
-            status_text = "✅ Принята ✅" if status == 'accepted' else "❌ Отклонена ❌"
-            history_text += f"Вы --> {username} ({status_text})\n"
-
-        # Добавляем полученные инвайты
-        for username, status in received_invites:
-            status_text = "✅ Принята ✅" if status == 'accepted' else "❌ Отклонена ❌"
-            history_text += f"{username} --> Вы ({status_text})\n"
-
-        if not sent_invites and not received_invites:
-            history_text += "У вас пока нет истории инвайтов."
-
-        return history_text
-
-
-    def report_user(reported_user_id: int, reporter_user_id: int):
-        # Добавляем жалобу в базу
-        cursor.execute('''
-            INSERT INTO reports (reported_user_id, reporter_user_id)
-            VALUES (?, ?)
-        ''', (reported_user_id, reporter_user_id))
-        conn.commit()
-
-        # Проверяем количество жалоб
-        cursor.execute('SELECT COUNT(*) FROM reports WHERE reported_user_id = ?', (reported_user_id,))
-        report_count = cursor.fetchone()[0]
-
-        if report_count >= 5:
-            # Блокируем пользователя на 2 недели
-            ban_end = datetime.now() + timedelta(days=14)
-            cursor.execute('''
-                UPDATE users 
-                SET is_banned = TRUE, ban_end = ?, is_searching = FALSE
-                WHERE user_id = ?
-            ''', (ban_end.strftime("%Y-%m-%d %H:%M:%S"), reported_user_id))
-            conn.commit()
-
-            # Уведомляем пользователя о блокировке
-            return True, ban_end
+            text, reply_markup = "Пока нет подходящих анкет. Попробуйте позже.", MAIN_MENU_MARKUP
+        if message:
+            message.reply_text(text, reply_markup=reply_markup)
+        else:
+            outbox.send_message(chat_id, text, reply_markup=reply_markup)
+
+
+def iter_invite_history(user_id: int, cursor=HISTORY_START, newer: bool = False, limit: int = INVITE_HISTORY_PAGE):
+    # Отправленные и полученные инвайты одним запросом, от курсора (timestamp, id)
+    # к более старым или (newer) к более новым
+    writes.wait(user_id)
+    yield from store.invite_history(user_id, cursor, newer, limit)
+
+
+def show_invite_history(user_id: int, cursor=None, newer: bool = False):
+    # -> (текст страницы, кнопки); страница не длиннее INVITE_HISTORY_PAGE записей
+    rows = list(iter_invite_history(user_id, cursor or HISTORY_START, newer, INVITE_HISTORY_PAGE + 1))
+    has_more = len(rows) > INVITE_HISTORY_PAGE
+    rows = rows[:INVITE_HISTORY_PAGE]
+    if newer:
+        rows.reverse()
+    has_newer = has_more if newer else cursor is not None
+    has_older = cursor is not None if newer else has_more
+
+    lines = ["📝 Ваша история инвайтов 🎮:", ""]
+    for _, _, status, outgoing, username in rows:
+        status_text = INVITE_STATUS_TEXT.get(status, status)
+        lines.append(f"Вы --> {username} ({status_text})" if outgoing else f"{username} --> Вы ({status_text})")
+    if not rows:
+        lines.append("Больше инвайтов нет." if cursor else "У вас пока нет истории инвайтов.")
+
+    return '\n'.join(lines), invite_history_markup(rows, has_newer, has_older)
+
+
+def show_search_results(user_id: int, text: str, cursor=None):
+    # -> (текст страницы, кнопки); анкеты игры user_id по релевантности описания
+    writes.wait(user_id)
+    rows = store.search_profiles(user_id, text, cursor or SEARCH_START, SEARCH_PAGE + 1)
+    has_more = len(rows) > SEARCH_PAGE
+    rows = rows[:SEARCH_PAGE]
+    if not rows:
+        return ("Больше ничего не нашлось." if cursor else "Ничего не нашлось."), MAIN_MENU_MARKUP
+    cards = '\n\n'.join(profile_card((*row[1:5], (row[5] or '')[:SEARCH_SNIPPET])) for row in rows)
+    return f"🔎 Найдено по запросу «{text}»:\n\n{cards}", search_results_markup(rows, has_more)
+
+
+def search_page(user_id: int, text: str, cursor):
+    # Следующая страница от курсора (score, user_id); text - запрос, сохраненный в user_data
+    if not text:
+        return SEARCH_HINT, MAIN_MENU_MARKUP
+    return show_search_results(user_id, text, cursor)
+
+
+def bump_report_count(conn, reported_user_id: int, now: int) -> float:
+    # Скользящее окно из двух интервалов по REPORT_WINDOW: жалобы текущего
+    # интервала плюс доля предыдущего, пропорциональная перекрытию с окном
+    window_start, current, previous = store.report_window(conn, reported_user_id) or (now, 0, 0)
+    passed = (now - window_start) // REPORT_WINDOW
+    if passed:
+        previous = current if passed == 1 else 0
+        current = 0
+        window_start += passed * REPORT_WINDOW
+    current += 1
+    store.save_report_window(conn, reported_user_id, window_start, current, previous)
+    return current + previous * (REPORT_WINDOW - (now - window_start)) / REPORT_WINDOW
+
+
+def report_user(reported_user_id: int, reporter_user_id: int):
+    # Жалоба, счетчик и блокировка - одна транзакция
+    now = int(time.time())
+    banned = False
+    # Отложенное "продолжить поиск" не должно лечь поверх блокировки
+    writes.wait(reported_user_id)
+    with store.transaction() as conn:
+        # Жалобы на одного пользователя - по очереди: счетчик читается и пишется целиком
+        store.lock_user(conn, reported_user_id)
+        # Одна жалоба на пользователя от каждого за окно, повторная не считается
+        repeat_before = datetime.utcfromtimestamp(now - REPORT_WINDOW).strftime("%Y-%m-%d %H:%M:%S")
+        added = store.add_report(conn, reported_user_id, reporter_user_id, repeat_before)
+
+        if added and bump_report_count(conn, reported_user_id, now) >= REPORT_THRESHOLD:
+            # Блокируем пользователя на 2 недели, уже заблокированного не трогаем
+            ban_end = datetime.fromtimestamp(now) + BAN_DURATION
+            banned = store.ban(conn, reported_user_id, int(ban_end.timestamp()))
+            if banned:
+                # После блокировки жалобы считаются заново
+                store.reset_report_window(conn, reported_user_id)
+                invalidations.record(conn, reported_user_id, 'banned', int(ban_end.timestamp()))
+
+    if banned:
+        ban_list.ban(reported_user_id, int(ban_end.timestamp()))
+        profile_cache.invalidate(reported_user_id)
+        candidate_feed.hide(reported_user_id)
+        candidate_feed.invalidate(reported_user_id)
+
+        # Уведомляем пользователя о блокировке
+        return True, ban_end
+
+    return False, None
+
+
+# Кнопки: callback_data - callbacks.encode(действие, аргументы), обработчик
+# выбирается по действию; вызывается как handler(update, context, user_id, *аргументы)
+buttons = CallbackRegistry()
+
+
+def button_handler(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    query.answer()
+    # Кнопку неизвестного формата только закрываем
+    buttons.dispatch(query.data, update, context, query.from_user.id)
+
+
+@buttons.register('main_menu')
+def main_menu_button(update: Update, context: CallbackContext, user_id: int) -> None:
+    show_main_menu(update, context)
+
+
+@buttons.register('next')
+def next_button(update: Update, context: CallbackContext, user_id: int, after_user_id: int) -> None:
+    # Курсор - user_id последней показанной анкеты
+    show_next_profile(update, context, user_id, after_user_id)
+
+
+@buttons.register('stop_search')
+def stop_search_button(update: Update, context: CallbackContext, user_id: int) -> None:
+    set_searching(user_id, False)
+    # Убираем клавиатуру из текущего сообщения
+    update.callback_query.edit_message_text(
+        "Поиск остановлен.",
+        reply_markup=None  # Важно: убираем инлайн-клавиатуру
+    )
+    # Отправляем главное меню как новое сообщение
+    show_main_menu(update, context)
 
-        return False, None
 
+@buttons.register('resume_search')
+def resume_search_button(update: Update, context: CallbackContext, user_id: int) -> None:
+    set_searching(user_id, True)
+    show_next_profile(update, context, user_id, 0)
 
-    def button_handler(update: Update, context: CallbackContext) -> None:
-        query = update.callback_query
-        query.answer()
-        user_id = query.from_user.id
-        data = query.data
-
-        if data == 'main_menu':
-            show_main_menu(update, context)
-            return
-
-        if data.startswith('next_'):
-            offset = int(data.split('_')[1])
-            show_next_profile(update, context, user_id, offset)
-
-        elif data == 'stop_search':
-            cursor.execute('UPDATE users SET is_searching = FALSE WHERE user_id = ?', (user_id,))
-            conn.commit()
-            # Убираем клавиатуру из текущего сообщения
-            query.edit_message_text(
-                "Поиск остановлен.",
-                reply_markup=None  # Важно: убираем инлайн-клавиатуру
-            )
-            # Отправляем главное меню как новое сообщение
-            show_main_menu(update, context)
-
-        elif data == 'resume_search':
-            cursor.execute('UPDATE users SET is_searching = TRUE WHERE user_id = ?', (user_id,))
-            conn.commit()
-            show_next_profile(update, context, user_id, 0)
-
-        elif data == 'edit_profile':
-            keyboard = [
-                [InlineKeyboardButton("Поменять игру", callback_data='change_game')],
-                [InlineKeyboardButton("Поменять описание", callback_data='change_description')],
-                [InlineKeyboardButton("Изменить ранг", callback_data='change_rank')],
-                [InlineKeyboardButton("Заполнить заново", callback_data='create_profile')]
-            ]
-            # Используем reply_text вместо edit_message_text
-            context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text="Что вы хотите изменить?",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-
-        elif data == 'show_my_profile':
-            query.edit_message_text(
-                "Ваша анкета:",
-                reply_markup=None
-            )
-            show_my_profile(update, context, user_id)
-
-        elif data.startswith('report_'):
-            reported_user_id = int(data.split('_')[1])
-            is_banned, ban_end = report_user(reported_user_id, user_id)
-
-            if is_banned:
-                # Уведомляем о блокировке пользователя
-                context.bot.send_message(
-                    chat_id=reported_user_id,
-                    text=f"⛔ Ваш профиль заблокирован до {ban_end.strftime('%Y-%m-%d %H:%M:%S')} "
-                         "из-за большого количества жалоб."
-                )
-                query.edit_message_text(
-                    "✅ Жалоба отправлена! Профиль заблокирован из-за большого количества жалоб.",
-                    reply_markup=None
-                )
-            else:
-                query.edit_message_text(
-                    "✅ Жалоба отправлена! Спасибо за вашу бдительность.",
-                    reply_markup=None
-                )
-
-            # Отправляем главное меню как новое сообщение
-            show_main_menu(update, context)
-
-        elif data.startswith('invite_'):
-            to_user_id = int(data.split('_')[1])
-            cursor.execute('''
-                SELECT * FROM invites 
-                WHERE from_user_id = ? AND to_user_id = ? 
-                AND status = 'pending'
-            ''', (user_id, to_user_id))
-            if cursor.fetchone():
-                # Убираем клавиатуру из текущего сообщения
-                query.edit_message_text(
-                    "Вы уже отправили запрос этому пользователю!",
-                    reply_markup=None  # Важно: убираем инлайн-клавиатуру
-                )
-                # Отправляем главное меню как новое сообщение
-                show_main_menu(update, context)
-                return
-
-            cursor.execute('''
-                INSERT INTO invites (from_user_id, to_user_id)
-                VALUES (?, ?)
-            ''', (user_id, to_user_id))
-            conn.commit()
-
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            inviter = cursor.fetchone()
-
-            invite_text = f"""
-            🎉 Тебе пришло приглашение!
-            🎮 Игра: {inviter[2]}
-            👤 Никнейм: {inviter[1]}
-            🏆 Ранг: {inviter[3]}
-            📝 Описание: {inviter[4]}
-            """
-            keyboard = [
-                [
-                    InlineKeyboardButton("Принять", callback_data=f'accept_{user_id}'),
-                    InlineKeyboardButton("Отклонить", callback_data=f'decline_{user_id}')
-                ],
-                [InlineKeyboardButton("Главное меню", callback_data='main_menu')]
-            ]
 
-            context.bot.send_message(
-                chat_id=to_user_id,
-                text=invite_text,
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-
-            # Убираем клавиатуру из текущего сообщения
-            query.edit_message_text(
-                "✅ Запрос отправлен!",
-                reply_markup=None  # Важно: убираем инлайн-клавиатуру
-            )
-            # Отправляем главное меню как новое сообщение
-            show_main_menu(update, context)
-
-        elif data.startswith('accept_'):
-            from_user_id = int(data.split('_')[1])
-            cursor.execute('''
-                UPDATE invites SET status = 'accepted'
-                WHERE from_user_id = ? AND to_user_id = ?
-            ''', (from_user_id, user_id))
-            conn.commit()
-
-            cursor.execute('SELECT * FROM users WHERE user_id IN (?, ?)', (from_user_id, user_id))
-            users = {row[0]: row for row in cursor.fetchall()}
-
-            for u_id in [from_user_id, user_id]:
-                partner_id = user_id if u_id == from_user_id else from_user_id
-                partner_username = users[partner_id][1]
-                if partner_username:
-                    link = f"https://t.me/{partner_username}"
-                    text = f"🎉 Взаимный инвайт! Свяжись с партнером: {link}"
-                else:
-                    text = f"🎉 Взаимный инвайт! Партнер не имеет username. ID для связи: {partner_id}"
-
-                context.bot.send_message(
-                    chat_id=u_id,
-                    text=text,
-                    reply_markup=main_menu_markup()
-                )
-
-            # Убираем клавиатуру из текущего сообщения
-            query.edit_message_text(
-                "✅ Вы приняли запрос!",
-                reply_markup=None  # Важно: убираем инлайн-клавиатуру
-            )
-            # Отправляем главное меню как новое сообщение
-            show_main_menu(update, context)
-
-        elif data.startswith('decline_'):
-            from_user_id = int(data.split('_')[1])
-            cursor.execute('''
-                UPDATE invites SET status = 'rejected'
-                WHERE from_user_id = ? AND to_user_id = ?
-            ''', (from_user_id, user_id))
-            conn.commit()
-            # Убираем клавиатуру из текущего сообщения
-            query.edit_message_text(
-                "❌ Вы отклонили запрос.",
-                reply_markup=None  # Важно: убираем инлайн-клавиатуру
-            )
-            # Отправляем главное меню как новое сообщение
-            show_main_menu(update, context)
-
-        query.answer()
-
-
-    def edit_game(update: Update, context: CallbackContext) -> int:
-        query = update.callback_query
-        query.answer()
-        context.user_data['editing'] = True
-        query.message.reply_text(
-            "Введите новую игру:",
-            reply_markup=main_menu_markup()
+@buttons.register('edit_profile')
+def edit_profile_button(update: Update, context: CallbackContext, user_id: int) -> None:
+    # Используем reply_text вместо edit_message_text
+    outbox.send_message(
+        update.callback_query.message.chat_id,
+        "Что вы хотите изменить?",
+        reply_markup=EDIT_PROFILE_MARKUP
+    )
+
+
+@buttons.register('show_my_profile')
+def show_my_profile_button(update: Update, context: CallbackContext, user_id: int) -> None:
+    update.callback_query.edit_message_text(
+        "Ваша анкета:",
+        reply_markup=None
+    )
+    show_my_profile(update, context, user_id)
+
+
+@buttons.register('report')
+def report_button(update: Update, context: CallbackContext, user_id: int, reported_user_id: int) -> None:
+    query = update.callback_query
+    is_banned, ban_end = report_user(reported_user_id, user_id)
+
+    if is_banned:
+        # Уведомляем о блокировке пользователя
+        outbox.send_message(
+            reported_user_id,
+            f"⛔ Ваш профиль заблокирован до {ban_end.strftime('%Y-%m-%d %H:%M:%S')} "
+            "из-за большого количества жалоб."
         )
-        return GAME
+        query.edit_message_text(
+            "✅ Жалоба отправлена! Профиль заблокирован из-за большого количества жалоб.",
+            reply_markup=None
+        )
+    else:
+        query.edit_message_text(
+            "✅ Жалоба отправлена! Спасибо за вашу бдительность.",
+            reply_markup=None
+        )
+
+    # Отправляем главное меню как новое сообщение
+    show_main_menu(update, context)
+
 
+@buttons.register('invite_history')
+def invite_history_button(update: Update, context: CallbackContext, user_id: int) -> None:
+    text, reply_markup = show_invite_history(user_id)
+    update.callback_query.edit_message_text(text, reply_markup=reply_markup)
 
-    def edit_rank(update: Update, context: CallbackContext) -> int:
-        query = update.callback_query
-        query.answer()
-        context.user_data['editing'] = True
-        query.message.reply_text(
-            "Введите новый ранг:",
-            reply_markup=main_menu_markup()
+
+@buttons.register('history_new')
+def history_newer_button(update: Update, context: CallbackContext, user_id: int, ts: str, invite_id: int) -> None:
+    text, reply_markup = show_invite_history(user_id, (ts, invite_id), newer=True)
+    update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@buttons.register('history_old')
+def history_older_button(update: Update, context: CallbackContext, user_id: int, ts: str, invite_id: int) -> None:
+    text, reply_markup = show_invite_history(user_id, (ts, invite_id))
+    update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@buttons.register('description_search')
+def description_search_button(update: Update, context: CallbackContext, user_id: int) -> None:
+    outbox.send_message(update.callback_query.message.chat_id, SEARCH_HINT, reply_markup=MAIN_MENU_MARKUP)
+
+
+@buttons.register('search')
+def search_button(update: Update, context: CallbackContext, user_id: int, score: float, after: int) -> None:
+    text, reply_markup = search_page(user_id, context.user_data.get('search'), (score, after))
+    update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@buttons.register('invite')
+def invite_button(update: Update, context: CallbackContext, user_id: int, to_user_id: int) -> None:
+    query = update.callback_query
+    if not create_invite(user_id, to_user_id):
+        # Убираем клавиатуру из текущего сообщения
+        query.edit_message_text(
+            "Вы уже отправили запрос этому пользователю!",
+            reply_markup=None  # Важно: убираем инлайн-клавиатуру
         )
-        return RANK
+        # Отправляем главное меню как новое сообщение
+        show_main_menu(update, context)
+        return
+
+    inviter = get_profile(user_id)
+
+    invite_text = profile_card(inviter, "🎉 Тебе пришло приглашение!")
+
+    outbox.send_message(
+        to_user_id,
+        invite_text,
+        reply_markup=invite_markup(user_id)
+    )
+
+    # Убираем клавиатуру из текущего сообщения
+    query.edit_message_text(
+        "✅ Запрос отправлен!",
+        reply_markup=None  # Важно: убираем инлайн-клавиатуру
+    )
+    # Отправляем главное меню как новое сообщение
+    show_main_menu(update, context)
+
+
+def invite_gone(update: Update, context: CallbackContext) -> None:
+    # Ответ на истекший или уже отвеченный запрос
+    update.callback_query.edit_message_text(
+        "⌛ Этот запрос больше не действует.",
+        reply_markup=None
+    )
+    show_main_menu(update, context)
 
 
-    def edit_description(update: Update, context: CallbackContext) -> int:
-        query = update.callback_query
-        query.answer()
-        context.user_data['editing'] = True
-        query.message.reply_text(
-            "Введите новое описание:",
-            reply_markup=main_menu_markup()
+@buttons.register('accept')
+def accept_button(update: Update, context: CallbackContext, user_id: int, from_user_id: int) -> None:
+    if not set_invite_status(from_user_id, user_id, 'accepted'):
+        invite_gone(update, context)
+        return
+
+    users = get_profiles(from_user_id, user_id)
+
+    for u_id in [from_user_id, user_id]:
+        partner_id = user_id if u_id == from_user_id else from_user_id
+        partner_username = users[partner_id][1]
+        if partner_username:
+            link = f"https://t.me/{partner_username}"
+            text = f"🎉 Взаимный инвайт! Свяжись с партнером: {link}"
+        else:
+            text = f"🎉 Взаимный инвайт! Партнер не имеет username. ID для связи: {partner_id}"
+
+        outbox.send_message(
+            u_id,
+            text,
+            reply_markup=MAIN_MENU_MARKUP
         )
-        return DESCRIPTION
 
+    # Убираем клавиатуру из текущего сообщения
+    update.callback_query.edit_message_text(
+        "✅ Вы приняли запрос!",
+        reply_markup=None  # Важно: убираем инлайн-клавиатуру
+    )
+    # Отправляем главное меню как новое сообщение
+    show_main_menu(update, context)
+
+
+@buttons.register('decline')
+def decline_button(update: Update, context: CallbackContext, user_id: int, from_user_id: int) -> None:
+    if not set_invite_status(from_user_id, user_id, 'rejected'):
+        invite_gone(update, context)
+        return
+    # Убираем клавиатуру из текущего сообщения
+    update.callback_query.edit_message_text(
+        "❌ Вы отклонили запрос.",
+        reply_markup=None  # Важно: убираем инлайн-клавиатуру
+    )
+    # Отправляем главное меню как новое сообщение
+    show_main_menu(update, context)
 
-    def main() -> None:
-        updater = Updater("*******************")
-        dispatcher = updater.dispatcher
-
-        # Обработчик главного меню должен быть первым
-        dispatcher.add_handler(MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler))
-        dispatcher.add_handler(CommandHandler('start', start))
-
-        # ConversationHandler для создания профиля
-        create_profile_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(create_profile, pattern='^create_profile$')],
-            states={
-                NICKNAME: [
-                    MessageHandler(Filters.text & ~Filters.command, nickname),
-                    MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
-                ],
-                GAME: [
-                    MessageHandler(Filters.text & ~Filters.command, game),
-                    MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
-                ],
-                RANK: [
-                    MessageHandler(Filters.text & ~Filters.command, rank),
-                    MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
-                ],
-                DESCRIPTION: [
-                    MessageHandler(Filters.text & ~Filters.command, description),
-                    MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
-                ]
-            },
-            fallbacks=[
-                CommandHandler('cancel', cancel),
-                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler),
-                CommandHandler('start', start)
-            ]
+
+def edit_game(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    query.answer()
+    context.user_data['editing'] = True
+    query.message.reply_text(
+        "Введите новую игру:",
+        reply_markup=MAIN_MENU_MARKUP
+    )
+    return GAME
+
+
+def edit_rank(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    query.answer()
+    context.user_data['editing'] = True
+    query.message.reply_text(
+        "Введите новый ранг:",
+        reply_markup=MAIN_MENU_MARKUP
+    )
+    return RANK
+
+
+def edit_description(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    query.answer()
+    context.user_data['editing'] = True
+    query.message.reply_text(
+        "Введите новое описание:",
+        reply_markup=MAIN_MENU_MARKUP
+    )
+    return DESCRIPTION
+
+
+def ban_expiry_job(context: CallbackContext) -> None:
+    for user_id in lift_expired_bans():
+        outbox.send_message(
+            user_id,
+            "✅ Ваш профиль разблокирован! Теперь вы снова можете искать союзников.",
+            reply_markup=MAIN_MENU_MARKUP
         )
 
-        # ConversationHandler для редактирования профиля
-        edit_profile_handler = ConversationHandler(
-            entry_points=[
-                CallbackQueryHandler(edit_game, pattern='^change_game$'),
-                CallbackQueryHandler(edit_rank, pattern='^change_rank$'),
-                CallbackQueryHandler(edit_description, pattern='^change_description$')
+
+def invite_maintenance_job(context: CallbackContext) -> None:
+    expired, archived = maintain_invites()
+    if expired or archived:
+        logger.info("Инвайты: истекло %s, перенесено в архив %s", expired, archived)
+
+
+def seen_flush_job(context: CallbackContext) -> None:
+    seen_profiles.flush()
+
+
+def write_heartbeat(context: CallbackContext) -> None:
+    # Пишем только пока прием обновлений жив, иначе супервизор перезапустит бота
+    is_alive = context.job.context
+    if is_alive():
+        with open(HEARTBEAT_FILE, 'w') as f:
+            f.write(str(time.time()))
+
+
+def drain_and_stop(updater: Updater, timeout: float = DRAIN_TIMEOUT) -> None:
+    # Сначала перестаем забирать новые обновления, затем дорабатываем полученные
+    logger.info("Остановка: дорабатываем полученные обновления...")
+    updater.running = False
+    deadline = time.monotonic() + timeout
+    while not updater.dispatcher.update_queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    updater.stop()
+    writes.stop()
+    seen_profiles.flush()
+    outbox.stop()
+    if updater.persistence:
+        updater.dispatcher.update_persistence()
+        updater.persistence.flush()
+    store.close()
+    logger.info("Бот остановлен")
+
+
+def wait_for_stop_signal() -> None:
+    stop = threading.Event()
+    stop_signals = [signal.SIGINT, signal.SIGTERM]
+    if hasattr(signal, 'SIGBREAK'):  # Windows: CTRL_BREAK_EVENT от супервизора
+        stop_signals.append(signal.SIGBREAK)
+    for sig in stop_signals:
+        signal.signal(sig, lambda *_: stop.set())
+    while not stop.wait(1):
+        pass
+
+
+def add_handlers(dispatcher) -> None:
+    # Обработчик главного меню должен быть первым
+    dispatcher.add_handler(MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler))
+    dispatcher.add_handler(CommandHandler('start', start))
+    dispatcher.add_handler(CommandHandler('search', search))
+    dispatcher.add_handler(CommandHandler('stats', stats))
+
+    # ConversationHandler для создания профиля
+    create_profile_handler = ConversationHandler(
+        name='create_profile',
+        persistent=True,
+        entry_points=[CallbackQueryHandler(create_profile, pattern=matcher('create_profile'))],
+        states={
+            NICKNAME: [
+                MessageHandler(Filters.text & ~Filters.command, nickname),
+                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
+            ],
+            GAME: [
+                MessageHandler(Filters.text & ~Filters.command, game),
+                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
             ],
-            states={
-                GAME: [
-                    MessageHandler(Filters.text & ~Filters.command, game),
-                    MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
-                ],
-                RANK: [
-                    MessageHandler(Filters.text & ~Filters.command, rank),
-                    MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
-                ],
-                DESCRIPTION: [
-                    MessageHandler(Filters.text & ~Filters.command, description),
-                    MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
-                ]
-            },
-            fallbacks=[
-                CommandHandler('cancel', cancel),
-                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler),
-                CommandHandler('start', start)
+            RANK: [
+                MessageHandler(Filters.text & ~Filters.command, rank),
+                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
+            ],
+            DESCRIPTION: [
+                MessageHandler(Filters.text & ~Filters.command, description),
+                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
             ]
-        )
-
-        dispatcher.add_handler(create_profile_handler)
-        dispatcher.add_handler(edit_profile_handler)
-        dispatcher.add_handler(CallbackQueryHandler(button_handler))
+        },
+        fallbacks=[
+            CommandHandler('cancel', cancel),
+            MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler),
+            CommandHandler('start', start)
+        ]
+    )
 
-        updater.start_polling()
-        updater.idle()
+    # ConversationHandler для редактирования профиля
+    edit_profile_handler = ConversationHandler(
+        name='edit_profile',
+        persistent=True,
+        entry_points=[
+            CallbackQueryHandler(edit_game, pattern=matcher('change_game')),
+            CallbackQueryHandler(edit_rank, pattern=matcher('change_rank')),
+            CallbackQueryHandler(edit_description, pattern=matcher('change_description'))
+        ],
+        states={
+            GAME: [
+                MessageHandler(Filters.text & ~Filters.command, game),
+                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
+            ],
+            RANK: [
+                MessageHandler(Filters.text & ~Filters.command, rank),
+                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
+            ],
+            DESCRIPTION: [
+                MessageHandler(Filters.text & ~Filters.command, description),
+                MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler)
+            ]
+        },
+        fallbacks=[
+            CommandHandler('cancel', cancel),
+            MessageHandler(Filters.regex(f'^{MAIN_MENU_BUTTON}$'), main_menu_handler),
+            CommandHandler('start', start)
+        ]
+    )
 
+    dispatcher.add_handler(create_profile_handler)
+    dispatcher.add_handler(edit_profile_handler)
+    dispatcher.add_handler(CallbackQueryHandler(button_handler))
+
+    metrics.instrument_handlers(dispatcher)
+
+
+def start_metrics():
+    # Время запросов к базе пишется всегда, HTTP-эндпоинт - если задан порт
+    store.set_observer(metrics.observe_query)
+    if METRICS_PORT is None:
+        return None
+    server = MetricsServer(host=METRICS_LISTEN, port=METRICS_PORT)
+    server.start()
+    return server
+
+
+def main() -> None:
+    bot = ExtBot(BOT_TOKEN, request=TimedRequest(con_pool_size=BOT_CON_POOL_SIZE))
+    updater = Updater(bot=bot, persistence=SQLitePersistence())
+    dispatcher = updater.dispatcher
+    add_handlers(dispatcher)
+    metrics_server = start_metrics()
+
+    updater.job_queue.run_repeating(ban_expiry_job, interval=BAN_CHECK_INTERVAL, first=0)
+    updater.job_queue.run_repeating(invite_maintenance_job, interval=INVITE_MAINTENANCE_INTERVAL, first=0)
+    updater.job_queue.run_repeating(seen_flush_job, interval=SEEN_FLUSH_INTERVAL, first=SEEN_FLUSH_INTERVAL)
+
+    if WORKER_PORT:
+        run_webhook(updater, worker=True)
+    elif WEBHOOK_URL:
+        run_webhook(updater)
+    else:
+        run_polling(updater)
+    if metrics_server is not None:
+        metrics_server.stop()
+
+
+def run_polling(updater: Updater) -> None:
+    dispatcher = updater.dispatcher
+    outbox.start(updater.bot)
+    writes.start()
+    if HEARTBEAT_FILE:
+        updater.job_queue.run_repeating(write_heartbeat, interval=HEARTBEAT_INTERVAL, first=0,
+                                        context=lambda: updater.running and dispatcher.running
+                                        and outbox.is_alive() and writes.is_alive())
+
+    updater.start_polling()
+    wait_for_stop_signal()
+    drain_and_stop(updater)
+
+
+def run_webhook(updater: Updater, worker: bool = False) -> None:
+    # worker - процесс за router.py: обновления от фронта, сообщения только пишутся в outbox
+    dispatcher = updater.dispatcher
+    server = WebhookServer(
+        lambda data: dispatcher.process_update(Update.de_json(data, updater.bot)),
+        host=WORKER_LISTEN if worker else WEBHOOK_LISTEN,
+        port=WORKER_PORT if worker else WEBHOOK_PORT,
+        path=WORKER_PATH if worker else WEBHOOK_PATH,
+        secret_token=WORKER_SECRET if worker else WEBHOOK_SECRET,
+        workers=WEBHOOK_WORKERS,
+        queue_size=WEBHOOK_QUEUE_SIZE
+    )
+    server.start()
+    if worker:
+        invalidations.start()
+    else:
+        outbox.start(updater.bot)
+    writes.start()
+
+    if HEARTBEAT_FILE:
+        updater.job_queue.run_repeating(write_heartbeat, interval=HEARTBEAT_INTERVAL, first=0,
+                                        context=lambda: server.is_alive() and writes.is_alive()
+                                        and (invalidations.is_alive() if worker else outbox.is_alive()))
+    updater.job_queue.start()
+    if not worker:
+        updater.bot.set_webhook(
+            WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_WORKERS * 10,
+            allowed_updates=['message', 'callback_query']
+        )
 
-    if __name__ == '__main__':
-        main()
+    wait_for_stop_signal()
+    logger.info("Остановка: дорабатываем полученные обновления...")
+    server.stop()
+    updater.job_queue.stop()
+    writes.stop()
+    seen_profiles.flush()
+    outbox.stop()
+    invalidations.stop()
+    dispatcher.update_persistence()
+    updater.persistence.flush()
+    store.close()
+    logger.info("Бот остановлен")
+
+
+if __name__ == '__main__':
+    main()
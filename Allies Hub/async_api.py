@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import ssl
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramAPIError(Exception):
+    def __init__(self, description, error_code=None, retry_after=None):
+        super().__init__(description)
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+
+class AsyncBotAPI:
+    """Неблокирующий клиент Bot API поверх asyncio-потоков (HTTP/1.1 keep-alive).
+
+    Разметка (reply_markup) принимается объектами python-telegram-bot
+    и сериализуется через to_dict().
+
+    Каждый запрос ограничен request_timeout секундами (getUpdates - еще и
+    временем long polling); по истечении поднимается asyncio.TimeoutError,
+    а соединение закрывается.
+    """
+
+    def __init__(self, token: str, host: str = 'api.telegram.org', port: int = 443,
+                 use_ssl: bool = True, pool_size: int = 64, request_timeout: float = 15.0):
+        self._token = token
+        self._host = host
+        self._port = port
+        self._ssl = ssl.create_default_context() if use_ssl else None
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+        self.request_timeout = request_timeout
+
+    async def call(self, method: str, read_timeout: float = None, **params):
+        params = {k: v for k, v in params.items() if v is not None}
+        if 'reply_markup' in params and hasattr(params['reply_markup'], 'to_dict'):
+            params['reply_markup'] = params['reply_markup'].to_dict()
+        body = json.dumps(params, ensure_ascii=False).encode()
+
+        started = time.perf_counter()
+        async with self._slots:
+            status, payload = await self._request(f'/bot{self._token}/{method}', body,
+                                                  read_timeout or self.request_timeout)
+        metrics.telegram_seconds.observe(method, time.perf_counter() - started)
+
+        try:
+            data = json.loads(payload)
+        except ValueError as exc:
+            # Прокси или балансировщик ответил HTML-страницей
+            raise TelegramAPIError(f'malformed response: HTTP {status}', status) from exc
+        if not isinstance(data, dict):
+            raise TelegramAPIError(f'malformed response: HTTP {status}', status)
+        if not data.get('ok'):
+            parameters = data.get('parameters') or {}
+            raise TelegramAPIError(data.get('description', f'HTTP {status}'),
+                                   data.get('error_code', status), parameters.get('retry_after'))
+        return data['result']
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        return await self.call('sendMessage', chat_id=chat_id, text=text, reply_markup=reply_markup)
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        return await self.call('editMessageText', chat_id=chat_id, message_id=message_id,
+                               text=text, reply_markup=reply_markup)
+
+    async def answer_callback_query(self, callback_query_id):
+        return await self.call('answerCallbackQuery', callback_query_id=callback_query_id)
+
+    async def get_updates(self, offset=None, timeout=30):
+        # Сервер держит запрос до timeout секунд, ждем ответа чуть дольше
+        return await self.call('getUpdates', read_timeout=timeout + self.request_timeout,
+                               offset=offset, timeout=timeout,
+                               allowed_updates=['message', 'callback_query'])
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+    async def _request(self, path: str, body: bytes, timeout: float):
+        # Одна повторная попытка: сервер мог закрыть простаивавшее соединение
+        for attempt in range(2):
+            reader, writer = await asyncio.wait_for(self._acquire(), timeout)
+            try:
+                writer.write(
+                    f'POST {path} HTTP/1.1\r\n'
+                    f'Host: {self._host}\r\n'
+                    'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(body)}\r\n'
+                    'Connection: keep-alive\r\n\r\n'.encode() + body
+                )
+                status, headers, payload = await asyncio.wait_for(self._exchange(writer, reader), timeout)
+            except asyncio.TimeoutError:
+                # Ответ мог прийти позже и перемешаться со следующим запросом
+                writer.close()
+                raise
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if attempt:
+                    raise
+                continue
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self._idle.append((reader, writer))
+            return status, payload
+
+    async def _acquire(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return await asyncio.open_connection(self._host, self._port, ssl=self._ssl)
+
+    async def _exchange(self, writer, reader):
+        await writer.drain()
+        return await self._read_response(reader)
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            raise ConnectionError(f'malformed status line: {status_line[:80]!r}') from None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            payload = b''.join(chunks)
+        else:
+            payload = await reader.readexactly(int(headers.get('content-length', 0)))
+        return status, headers, payload
@@ -0,0 +1,531 @@
+"""Асинхронный рантайм бота: long polling, обработчики и доступ к базе на asyncio.
+
+    python async_bot.py
+
+Обновления разных пользователей обрабатываются конкурентно, обновления
+одного пользователя - строго по очереди (как в ConversationHandler).
+Запросы к базе (storage.py) выполняются в пуле потоков через AsyncDB,
+прием обновлений, ответы на кнопки и правки сообщений - неблокирующим
+клиентом AsyncBotAPI. Сообщения, как и в AlliesHub.py, уходят через
+hub.outbox: лимиты Telegram и порядок в чате общие для обоих рантаймов.
+"""
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import Bot, Update
+
+import AlliesHub as hub
+import metrics
+import rendering
+from async_api import AsyncBotAPI, TelegramAPIError
+from callbacks import CallbackRegistry
+from persistence import SQLitePersistence
+
+logger = logging.getLogger(__name__)
+
+NICKNAME, GAME, RANK, DESCRIPTION = hub.NICKNAME, hub.GAME, hub.RANK, hub.DESCRIPTION
+MAX_IN_FLIGHT = 2000
+CONVERSATION_NAME = 'async_profile'
+
+
+class AsyncDB:
+    """Блокирующие вызовы хранилища уходят в пул потоков: у каждого
+    потока свое соединение SQLite или соединение из пула PostgreSQL."""
+
+    def __init__(self, max_workers: int = 8):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='async-db')
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class AsyncContext:
+    """Аналог CallbackContext для одного обновления."""
+
+    def __init__(self, bot: AsyncBotAPI, adb: AsyncDB, update: Update, user_data: dict):
+        self.bot = bot
+        self.db = adb
+        self.update = update
+        self.user_data = user_data
+        self.user_id = update.effective_user.id
+        self.chat_id = update.effective_chat.id
+
+    async def send(self, text, reply_markup=None, chat_id=None):
+        # Только запись в outbox, отправят его потоки
+        await self.db.run(hub.outbox.send_message, chat_id or self.chat_id, text, reply_markup)
+
+    async def send_menu(self, header, keyboard, text, reply_markup):
+        await self.db.run(hub.outbox.send_menu, self.chat_id, header, keyboard, text, reply_markup)
+
+    async def edit(self, text, reply_markup=None):
+        message = self.update.callback_query.message
+        return await self.bot.edit_message_text(message.chat_id, message.message_id, text, reply_markup=reply_markup)
+
+
+# Обработчики
+
+async def show_main_menu(ctx: AsyncContext) -> None:
+    # Блокировки в памяти, база не нужна
+    is_banned, ban_end = hub.check_ban(ctx.user_id)
+    if is_banned:
+        await ctx.send(f"⛔ Ваш профиль заблокирован до {ban_end}. Причина: получено много жалоб.",
+                       rendering.MAIN_MENU_MARKUP)
+        return
+
+    if await ctx.db.run(hub.has_profile, ctx.user_id):
+        await ctx.send_menu("Главное меню:", rendering.MAIN_MENU_MARKUP,
+                            "Выберите действие:", rendering.MAIN_ACTIONS_MARKUP)
+    else:
+        await ctx.send_menu("Главное меню будет доступно после создания анкеты!", rendering.MAIN_MENU_MARKUP,
+                            "Начните с создания анкеты:", rendering.CREATE_PROFILE_MARKUP)
+
+
+async def show_my_profile(ctx: AsyncContext) -> None:
+    profile = await ctx.db.run(hub.get_profile, ctx.user_id)
+    if profile:
+        await ctx.send(rendering.profile_card(profile, "Ваша анкета:"), rendering.MAIN_MENU_MARKUP)
+    else:
+        await ctx.send("У вас еще нет анкеты!", rendering.MAIN_MENU_MARKUP)
+    await show_main_menu(ctx)
+
+
+async def show_next_profile(ctx: AsyncContext, after_user_id: int = 0) -> None:
+    if hub.check_ban(ctx.user_id)[0]:
+        await ctx.send("⛔ Ваш профиль заблокирован. Вы не можете искать союзников.", rendering.MAIN_MENU_MARKUP)
+        return
+    profile = await ctx.db.run(hub.candidate_feed.next, ctx.user_id, after_user_id)
+    if profile is hub.LOADING:
+        await ctx.send(hub.SEARCH_LOADING_TEXT, rendering.SEARCH_LOADING_MARKUP)
+    elif profile:
+        await ctx.send(rendering.profile_card(profile), rendering.profile_markup(profile[0]))
+    else:
+        await ctx.send("Пока нет подходящих анкет. Попробуйте позже.", rendering.MAIN_MENU_MARKUP)
+
+
+async def on_profile_text(ctx: AsyncContext, state: int, text: str):
+    """Шаги создания и редактирования анкеты. Возвращает следующее состояние или None."""
+    editing = ctx.user_data.get('editing')
+    field = {GAME: 'game', RANK: 'rank', DESCRIPTION: 'description'}.get(state)
+    if state == GAME:
+        found = await ctx.db.run(hub.find_game, text)
+        if found is None:
+            await ctx.send(hub.UNKNOWN_GAME_TEXT, rendering.MAIN_MENU_MARKUP)
+            return GAME
+        text = found[1]
+
+    if editing and field:
+        await ctx.db.run(hub.update_profile, ctx.user_id, field, text)
+        done = {
+            'game': "✅ Игра успешно обновлена!",
+            'rank': "✅ Ранг успешно обновлен!",
+            'description': "✅ Описание успешно обновлено!",
+        }[field]
+        await ctx.send(done, rendering.MAIN_MENU_MARKUP)
+        await show_main_menu(ctx)
+        ctx.user_data.clear()
+        return None
+
+    if state == NICKNAME:
+        ctx.user_data['nickname'] = text
+        await ctx.send("Введите название игры:", rendering.MAIN_MENU_MARKUP)
+        return GAME
+    if state == GAME:
+        ctx.user_data['game'] = text
+        await ctx.send("Введите ваш ранг в игре:", rendering.MAIN_MENU_MARKUP)
+        return RANK
+    if state == RANK:
+        ctx.user_data['rank'] = text
+        await ctx.send("Напишите краткое описание о себе и кого ищете:", rendering.MAIN_MENU_MARKUP)
+        return DESCRIPTION
+
+    ctx.user_data['description'] = text
+    user = ctx.update.effective_user
+    await ctx.db.run(hub.save_profile, user.id, user.username, ctx.user_data['game'],
+                     ctx.user_data['rank'], ctx.user_data['description'])
+    await ctx.send("Анкета создана! Начинаем поиск...", rendering.MAIN_MENU_MARKUP)
+    await show_next_profile(ctx)
+    return None
+
+
+async def search(ctx: AsyncContext, text: str) -> None:
+    if not text:
+        await ctx.send(hub.SEARCH_HINT, rendering.MAIN_MENU_MARKUP)
+        return
+    if hub.check_ban(ctx.user_id)[0]:
+        await ctx.send("⛔ Ваш профиль заблокирован. Вы не можете искать союзников.", rendering.MAIN_MENU_MARKUP)
+        return
+    ctx.user_data['search'] = text
+    result_text, reply_markup = await ctx.db.run(hub.show_search_results, ctx.user_id, text)
+    await ctx.send(result_text, reply_markup)
+
+
+# Кнопки: обработчик по действию из callback_data, handler(ctx, *аргументы).
+# Точки входа в диалоги возвращают новое состояние диалога.
+buttons = CallbackRegistry()
+
+
+@buttons.register('create_profile')
+async def create_profile(ctx: AsyncContext) -> int:
+    await ctx.send("Введите ваш игровой никнейм:", rendering.MAIN_MENU_MARKUP)
+    return NICKNAME
+
+
+async def start_editing(ctx: AsyncContext, state: int, prompt: str) -> int:
+    ctx.user_data['editing'] = True
+    await ctx.send(prompt, rendering.MAIN_MENU_MARKUP)
+    return state
+
+
+buttons.register('change_game')(functools.partial(start_editing, state=GAME, prompt="Введите новую игру:"))
+buttons.register('change_rank')(functools.partial(start_editing, state=RANK, prompt="Введите новый ранг:"))
+buttons.register('change_description')(functools.partial(start_editing, state=DESCRIPTION,
+                                                         prompt="Введите новое описание:"))
+
+
+@buttons.register('main_menu')
+async def main_menu_button(ctx: AsyncContext) -> None:
+    await show_main_menu(ctx)
+
+
+@buttons.register('next')
+async def next_button(ctx: AsyncContext, after_user_id: int) -> None:
+    await show_next_profile(ctx, after_user_id)
+
+
+@buttons.register('stop_search')
+async def stop_search_button(ctx: AsyncContext) -> None:
+    await ctx.db.run(hub.set_searching, ctx.user_id, False)
+    await ctx.edit("Поиск остановлен.")
+    await show_main_menu(ctx)
+
+
+@buttons.register('resume_search')
+async def resume_search_button(ctx: AsyncContext) -> None:
+    await ctx.db.run(hub.set_searching, ctx.user_id, True)
+    await show_next_profile(ctx, 0)
+
+
+@buttons.register('edit_profile')
+async def edit_profile_button(ctx: AsyncContext) -> None:
+    await ctx.send("Что вы хотите изменить?", rendering.EDIT_PROFILE_MARKUP)
+
+
+@buttons.register('show_my_profile')
+async def show_my_profile_button(ctx: AsyncContext) -> None:
+    await ctx.edit("Ваша анкета:")
+    await show_my_profile(ctx)
+
+
+@buttons.register('report')
+async def report_button(ctx: AsyncContext, reported_user_id: int) -> None:
+    is_banned, ban_end = await ctx.db.run(hub.report_user, reported_user_id, ctx.user_id)
+    if is_banned:
+        await ctx.send(f"⛔ Ваш профиль заблокирован до {ban_end.strftime('%Y-%m-%d %H:%M:%S')} "
+                       "из-за большого количества жалоб.", chat_id=reported_user_id)
+        await ctx.edit("✅ Жалоба отправлена! Профиль заблокирован из-за большого количества жалоб.")
+    else:
+        await ctx.edit("✅ Жалоба отправлена! Спасибо за вашу бдительность.")
+    await show_main_menu(ctx)
+
+
+@buttons.register('invite_history')
+async def invite_history_button(ctx: AsyncContext) -> None:
+    text, reply_markup = await ctx.db.run(hub.show_invite_history, ctx.user_id)
+    await ctx.edit(text, reply_markup)
+
+
+@buttons.register('history_new')
+async def history_newer_button(ctx: AsyncContext, ts: str, invite_id: int) -> None:
+    text, reply_markup = await ctx.db.run(hub.show_invite_history, ctx.user_id, (ts, invite_id), True)
+    await ctx.edit(text, reply_markup)
+
+
+@buttons.register('history_old')
+async def history_older_button(ctx: AsyncContext, ts: str, invite_id: int) -> None:
+    text, reply_markup = await ctx.db.run(hub.show_invite_history, ctx.user_id, (ts, invite_id))
+    await ctx.edit(text, reply_markup)
+
+
+@buttons.register('description_search')
+async def description_search_button(ctx: AsyncContext) -> None:
+    await ctx.send(hub.SEARCH_HINT, rendering.MAIN_MENU_MARKUP)
+
+
+@buttons.register('search')
+async def search_button(ctx: AsyncContext, score: float, after: int) -> None:
+    text, reply_markup = await ctx.db.run(hub.search_page, ctx.user_id, ctx.user_data.get('search'), (score, after))
+    await ctx.edit(text, reply_markup)
+
+
+@buttons.register('invite')
+async def invite_button(ctx: AsyncContext, to_user_id: int) -> None:
+    user_id = ctx.user_id
+    if not await ctx.db.run(hub.create_invite, user_id, to_user_id):
+        await ctx.edit("Вы уже отправили запрос этому пользователю!")
+        await show_main_menu(ctx)
+        return
+
+    inviter = await ctx.db.run(hub.get_profile, user_id)
+    await ctx.send(rendering.profile_card(inviter, "🎉 Тебе пришло приглашение!"),
+                   rendering.invite_markup(user_id), chat_id=to_user_id)
+    await ctx.edit("✅ Запрос отправлен!")
+    await show_main_menu(ctx)
+
+
+async def invite_gone(ctx: AsyncContext) -> None:
+    await ctx.edit("⌛ Этот запрос больше не действует.")
+    await show_main_menu(ctx)
+
+
+@buttons.register('accept')
+async def accept_button(ctx: AsyncContext, from_user_id: int) -> None:
+    user_id = ctx.user_id
+    if not await ctx.db.run(hub.set_invite_status, from_user_id, user_id, 'accepted'):
+        await invite_gone(ctx)
+        return
+    users = await ctx.db.run(hub.get_profiles, from_user_id, user_id)
+
+    notices = []
+    for u_id in [from_user_id, user_id]:
+        partner_id = user_id if u_id == from_user_id else from_user_id
+        partner_username = users[partner_id][1]
+        if partner_username:
+            text = f"🎉 Взаимный инвайт! Свяжись с партнером: https://t.me/{partner_username}"
+        else:
+            text = f"🎉 Взаимный инвайт! Партнер не имеет username. ID для связи: {partner_id}"
+        notices.append(ctx.send(text, rendering.MAIN_MENU_MARKUP, chat_id=u_id))
+    # Уведомления разным чатам можно отправить параллельно
+    await asyncio.gather(*notices)
+
+    await ctx.edit("✅ Вы приняли запрос!")
+    await show_main_menu(ctx)
+
+
+@buttons.register('decline')
+async def decline_button(ctx: AsyncContext, from_user_id: int) -> None:
+    if not await ctx.db.run(hub.set_invite_status, from_user_id, ctx.user_id, 'rejected'):
+        await invite_gone(ctx)
+        return
+    await ctx.edit("❌ Вы отклонили запрос.")
+    await show_main_menu(ctx)
+
+
+class AsyncBot:
+    """Получение обновлений и маршрутизация по обработчикам."""
+
+    def __init__(self, bot: AsyncBotAPI, adb: AsyncDB, max_in_flight: int = MAX_IN_FLIGHT,
+                 persistence: SQLitePersistence = None):
+        self.bot = bot
+        self.db = adb
+        self.persistence = persistence
+        self._states = {}      # user_id -> состояние диалога
+        self._user_data = {}   # user_id -> dict
+        self._tails = {}       # user_id -> future последнего обновления пользователя
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._tasks = set()
+
+    async def restore(self) -> None:
+        """Поднимает состояния диалогов и user_data, сохраненные до перезапуска."""
+        if self.persistence is None:
+            return
+        conversations = await self.db.run(self.persistence.get_conversations, CONVERSATION_NAME)
+        self._states = {user_id: state for (_, user_id), state in conversations.items()}
+        user_data = await self.db.run(self.persistence.get_user_data)
+        self._user_data = {user_id: data for user_id, data in user_data.items() if data}
+
+    async def run_polling(self, timeout: int = 30) -> None:
+        offset = None
+        backoff = 1
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset, timeout=timeout)
+                backoff = 1
+            except (TelegramAPIError, OSError, asyncio.TimeoutError) as exc:
+                logger.warning("getUpdates не удался: %s, повтор через %s c", exc, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            for raw in updates:
+                offset = raw['update_id'] + 1
+                await self.submit(raw)
+
+    async def expire_bans(self) -> None:
+        # Аналог ban_expiry_job из AlliesHub.py
+        while True:
+            try:
+                lifted = await self.db.run(hub.lift_expired_bans)
+                for user_id in lifted:
+                    await self.db.run(
+                        hub.outbox.send_message, user_id,
+                        "✅ Ваш профиль разблокирован! Теперь вы снова можете искать союзников.",
+                        rendering.MAIN_MENU_MARKUP)
+            except Exception:
+                logger.exception("Не удалось снять истекшие блокировки")
+            await asyncio.sleep(hub.BAN_CHECK_INTERVAL)
+
+    async def maintain_invites(self) -> None:
+        # Аналог invite_maintenance_job из AlliesHub.py
+        while True:
+            try:
+                expired, archived = await self.db.run(hub.maintain_invites)
+                if expired or archived:
+                    logger.info("Инвайты: истекло %s, перенесено в архив %s", expired, archived)
+            except Exception:
+                logger.exception("Не удалось обработать старые инвайты")
+            await asyncio.sleep(hub.INVITE_MAINTENANCE_INTERVAL)
+
+    async def flush_seen(self) -> None:
+        # Аналог seen_flush_job из AlliesHub.py
+        while True:
+            await asyncio.sleep(hub.SEEN_FLUSH_INTERVAL)
+            try:
+                await self.db.run(hub.seen_profiles.flush)
+            except Exception:
+                logger.exception("Не удалось сохранить просмотренные анкеты")
+
+    async def submit(self, raw: dict) -> None:
+        """Ставит обновление в обработку; ждет, если в работе уже max_in_flight."""
+        await self._in_flight.acquire()
+        task = asyncio.create_task(self._process(Update.de_json(raw, None)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self) -> None:
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _process(self, update: Update) -> None:
+        user = update.effective_user
+        if user is None:
+            self._in_flight.release()
+            return
+
+        # Очередь на пользователя: следующее обновление ждет предыдущее
+        loop = asyncio.get_running_loop()
+        previous = self._tails.get(user.id)
+        done = loop.create_future()
+        self._tails[user.id] = done
+        try:
+            if previous is not None:
+                await previous
+            await self.handle(update)
+        except Exception:
+            logger.exception("Ошибка обработки обновления %s", update.update_id)
+        finally:
+            done.set_result(None)
+            if self._tails.get(user.id) is done:
+                del self._tails[user.id]
+            self._in_flight.release()
+
+    async def handle(self, update: Update) -> None:
+        user_id = update.effective_user.id
+        ctx = AsyncContext(self.bot, self.db, update, self._user_data.setdefault(user_id, {}))
+        state_before = self._states.get(user_id)
+        data_before = dict(ctx.user_data)
+
+        started = time.perf_counter()
+        if update.callback_query:
+            query = update.callback_query
+            await self.bot.answer_callback_query(query.id)
+            await self._on_callback(ctx, query.data)
+            elapsed = time.perf_counter() - started
+            metrics.handler_seconds.observe('on_callback', elapsed)
+            metrics.callback_seconds.observe(metrics.callback_action(query.data), elapsed)
+        elif update.message and update.message.text:
+            await self._on_message(ctx, update.message.text)
+            metrics.handler_seconds.observe('on_message', time.perf_counter() - started)
+
+        if not ctx.user_data:
+            self._user_data.pop(user_id, None)
+
+        if self.persistence is not None:
+            state = self._states.get(user_id)
+            if state != state_before:
+                await self.db.run(self.persistence.update_conversation, CONVERSATION_NAME,
+                                  (ctx.chat_id, user_id), state)
+            if ctx.user_data != data_before:
+                await self.db.run(self.persistence.update_user_data, user_id, dict(ctx.user_data))
+
+    async def _on_callback(self, ctx: AsyncContext, data: str) -> None:
+        found = buttons.lookup(data)
+        if found is None:
+            return
+        handler, args = found
+        # Точки входа в диалоги создания и редактирования анкеты возвращают состояние
+        state = await handler(ctx, *args)
+        if state is not None:
+            self._states[ctx.user_id] = state
+
+    async def _on_message(self, ctx: AsyncContext, text: str) -> None:
+        state = self._states.get(ctx.user_id)
+
+        if text == hub.MAIN_MENU_BUTTON:
+            if ctx.user_data.get('editing'):
+                ctx.user_data.clear()
+                await ctx.send("Редактирование отменено")
+            self._states.pop(ctx.user_id, None)
+            await show_main_menu(ctx)
+        elif text.startswith('/start'):
+            self._states.pop(ctx.user_id, None)
+            await show_main_menu(ctx)
+        elif text.startswith('/search'):
+            await search(ctx, text.partition(' ')[2].strip())
+        elif text.startswith('/stats'):
+            if ctx.user_id in hub.ADMIN_IDS:
+                await ctx.send(hub.stats_text())
+        elif text.startswith('/cancel') and state is not None:
+            self._states.pop(ctx.user_id, None)
+            await ctx.send('Создание анкеты отменено', rendering.MAIN_MENU_MARKUP)
+        elif state is not None and not text.startswith('/'):
+            next_state = await on_profile_text(ctx, state, text)
+            if next_state is None:
+                self._states.pop(ctx.user_id, None)
+            else:
+                self._states[ctx.user_id] = next_state
+
+
+async def run(token: str = hub.BOT_TOKEN) -> None:
+    bot = AsyncBotAPI(token)
+    adb = AsyncDB()
+    app = AsyncBot(bot, adb, persistence=SQLitePersistence())
+    metrics_server = hub.start_metrics()
+    await app.restore()
+    # Отправитель outbox - синхронный бот в своих потоках, как в AlliesHub.main
+    hub.outbox.start(Bot(token))
+    hub.writes.start()
+    bans = asyncio.create_task(app.expire_bans())
+    invites = asyncio.create_task(app.maintain_invites())
+    seen = asyncio.create_task(app.flush_seen())
+    try:
+        await app.run_polling()
+    finally:
+        bans.cancel()
+        invites.cancel()
+        seen.cancel()
+        await app.drain()
+        await adb.run(hub.writes.stop)
+        await adb.run(hub.seen_profiles.flush)
+        await adb.run(hub.outbox.stop)
+        await adb.run(hub.store.close)
+        await bot.close()
+        adb.shutdown()
+        if metrics_server is not None:
+            metrics_server.stop()
+
+
+def main() -> None:
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import threading
+import time
+
+
+class BanList:
+    """Действующие блокировки в памяти: user_id -> окончание бана (epoch).
+
+    Заблокированных мало, поэтому держим их всех и проверяем бан без запроса
+    к базе. Список перечитывается фоновой задачей снятия блокировок, так что
+    изменения из других процессов тоже подхватываются.
+    """
+
+    def __init__(self):
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows) -> None:
+        """Заменяет список строками (user_id, ban_end)."""
+        until = {user_id: ban_end for user_id, ban_end in rows if ban_end is not None}
+        with self._lock:
+            self._until = until
+
+    def merge(self, rows, now: float = None) -> None:
+        """Добавляет строки (user_id, ban_end) из базы и убирает истекшие баны.
+
+        В отличие от load, не теряет ban(), выданный, пока строки читались:
+        снятыми считаются только истекшие блокировки, которых нет в rows.
+        """
+        now = time.time() if now is None else now
+        fresh = {user_id: ban_end for user_id, ban_end in rows if ban_end is not None}
+        with self._lock:
+            for user_id, ban_end in list(self._until.items()):
+                if ban_end <= now and user_id not in fresh:
+                    del self._until[user_id]
+            for user_id, ban_end in fresh.items():
+                self._until[user_id] = max(ban_end, self._until.get(user_id, ban_end))
+
+    def ban(self, user_id: int, ban_end: int) -> None:
+        with self._lock:
+            self._until[user_id] = ban_end
+
+    def lift(self, user_ids) -> None:
+        with self._lock:
+            for user_id in user_ids:
+                self._until.pop(user_id, None)
+
+    def get(self, user_id: int, now: float = None):
+        """Окончание бана или None, если пользователь не заблокирован."""
+        ban_end = self._until.get(user_id)
+        if ban_end is None:
+            return None
+        # Истекший бан, который задача еще не сняла, уже не действует
+        if ban_end <= (time.time() if now is None else now):
+            return None
+        return ban_end
+
+    def __len__(self) -> int:
+        return len(self._until)
@@ -0,0 +1,111 @@
+"""Разбор и выбор обработчика кнопки: цепочка startswith/split против callbacks.py.
+
+    python bench_callbacks.py --iterations 200000
+
+Для каждого действия - время от callback_data до вызова обработчика (пустого)
+с разобранными аргументами: как в button_handler до callbacks.py (цепочка
+if/elif, аргументы через split) и через CallbackRegistry (decode + словарь).
+Кнопки старого формата разбираются и новым кодом - для них отдельная колонка.
+"""
+import argparse
+import time
+
+from callbacks import ACTIONS, CallbackRegistry, encode
+
+USER_ID = 123456789
+# Действие -> аргументы, как в настоящих кнопках
+SAMPLES = {
+    'main_menu': (),
+    'next': (USER_ID,),
+    'stop_search': (),
+    'resume_search': (),
+    'edit_profile': (),
+    'show_my_profile': (),
+    'report': (USER_ID,),
+    'invite_history': (),
+    'history_new': ('2024-05-01 12:30:00', 1234567),
+    'history_old': ('2024-05-01 12:30:00', 1234567),
+    'description_search': (),
+    'search': (-3.2145678901234, USER_ID),
+    'invite': (USER_ID,),
+    'accept': (USER_ID,),
+    'decline': (USER_ID,),
+}
+
+
+def legacy_data(action: str, args) -> str:
+    return '_'.join([action] + [repr(arg) if isinstance(arg, float) else str(arg) for arg in args])
+
+
+def handle(*args):
+    pass
+
+
+# Как было до callbacks.py: цепочка проверок из button_handler
+
+def old_dispatch(data: str):
+    if data == 'main_menu':
+        return handle()
+    if data.startswith('next_'):
+        handle(int(data.split('_')[1]))
+    elif data == 'stop_search':
+        handle()
+    elif data == 'resume_search':
+        handle()
+    elif data == 'edit_profile':
+        handle()
+    elif data == 'show_my_profile':
+        handle()
+    elif data.startswith('report_'):
+        handle(int(data.split('_')[1]))
+    elif data == 'invite_history' or data.startswith('history_'):
+        if data == 'invite_history':
+            handle()
+        else:
+            _, direction, ts, invite_id = data.split('_', 3)
+            handle((ts, int(invite_id)), direction == 'new')
+    elif data == 'description_search':
+        handle()
+    elif data.startswith('search_'):
+        _, score, after = data.split('_', 2)
+        handle(float(score), int(after))
+    elif data.startswith('invite_'):
+        handle(int(data.split('_')[1]))
+    elif data.startswith('accept_'):
+        handle(int(data.split('_')[1]))
+    elif data.startswith('decline_'):
+        handle(int(data.split('_')[1]))
+
+
+def measure(dispatch, data: str, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        dispatch(data)
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    registry = CallbackRegistry()
+    for action in ACTIONS:
+        registry.register(action)(handle)
+
+    print(f'{"действие":>20} {"байт было":>10} {"стало":>6} {"цепочка, нс":>12} {"registry, нс":>13} {"старая кнопка, нс":>18}')
+    totals = [0.0, 0.0, 0.0]
+    for action, sample in SAMPLES.items():
+        old, new = legacy_data(action, sample), encode(action, *sample)
+        assert registry.lookup(new)[1] == registry.lookup(old)[1], action
+        row = [measure(old_dispatch, old, args.iterations), measure(registry.dispatch, new, args.iterations),
+               measure(registry.dispatch, old, args.iterations)]
+        totals = [total + ns for total, ns in zip(totals, row)]
+        print(f'{action:>20} {len(old):>10} {len(new):>6} {row[0]:>12.0f} {row[1]:>13.0f} {row[2]:>18.0f}')
+    count = len(SAMPLES)
+    print(f'{"в среднем":>20} {"":>10} {"":>6} {totals[0] / count:>12.0f} {totals[1] / count:>13.0f} '
+          f'{totals[2] / count:>18.0f}')
+
+
+if __name__ == '__main__':
+    main()
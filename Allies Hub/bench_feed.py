@@ -0,0 +1,75 @@
+"""Сравнение LIMIT/OFFSET и keyset-пагинации ленты анкет.
+
+    python bench_feed.py --users 200000 --pages 1,10,100,1000,10000
+
+Все анкеты в одной игре, замеряется время получения страницы N
+(медиана по --repeat запускам).
+"""
+import argparse
+import sqlite3
+import statistics
+import time
+
+from explain_queries import create_schema
+from migrations import migrate
+
+OFFSET_SQL = '''
+    SELECT * FROM users
+    WHERE game_id = (SELECT game_id FROM users WHERE user_id = ?)
+    AND is_searching = TRUE
+    AND is_banned = FALSE
+    AND user_id != ?
+    LIMIT 1 OFFSET ?
+'''
+
+KEYSET_SQL = '''
+    SELECT * FROM users
+    WHERE game_id = (SELECT game_id FROM users WHERE user_id = ?)
+    AND is_searching = TRUE
+    AND is_banned = FALSE
+    AND user_id != ?
+    AND user_id > ?
+    ORDER BY user_id
+    LIMIT 1
+'''
+
+
+def median_us(conn, sql, params, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchone()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--pages', default='1,10,100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(':memory:')
+    create_schema(conn)
+    conn.executemany(
+        'INSERT INTO users (user_id, username, game, rank, description, is_searching) VALUES (?, ?, ?, ?, ?, ?)',
+        ((uid, f'user{uid}', 'Dota 2', '1000', '', True) for uid in range(1, args.users + 1))
+    )
+    conn.commit()
+    migrate(conn)
+
+    me = 1
+    print(f'{"page":>8} {"offset, us":>12} {"keyset, us":>12}')
+    for page in (int(p) for p in args.pages.split(',')):
+        offset = page - 1
+        # Для keyset курсор - user_id последней показанной анкеты
+        cursor_row = conn.execute(OFFSET_SQL, (me, me, max(offset - 1, 0))).fetchone()
+        after = cursor_row[0] if offset else 0
+        offset_us = median_us(conn, OFFSET_SQL, (me, me, offset), args.repeat)
+        keyset_us = median_us(conn, KEYSET_SQL, (me, me, after), args.repeat)
+        print(f'{page:>8} {offset_us:>12.1f} {keyset_us:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
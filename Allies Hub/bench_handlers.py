@@ -0,0 +1,175 @@
+"""Прогон обработчиков бота без Telegram: сценарии сессий на временной базе.
+
+    python bench_handlers.py --users 500 --sessions 10 --browse 100
+    python bench_handlers.py --json handlers.json   # сохранить результат для сравнения
+    python bench_handlers.py --pg postgresql://localhost/allies_bench   # то же на PostgreSQL
+
+Обработчики те же, что в main() (AlliesHub.add_handlers), бот - FakeBot.
+Сессия: /start, создание анкеты, просмотр --browse анкет, инвайт,
+принятие инвайта второй стороной, жалоба. По каждому шагу печатает
+p50/p99 времени обработки и в среднем на обновление операторов SQL
+(в потоке обработчика) и вызовов Telegram API (напрямую и через outbox).
+Фоновые операторы (отложенная запись, дозагрузка ленты) считаются отдельно.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from telegram.ext import Dispatcher
+
+import db
+import storage
+from callbacks import encode
+from fakebot import FakeBot, UpdateFactory, button_arg
+
+FIRST_SESSION_USER = 1000000
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class Recorder:
+    """Время, операторы SQL и вызовы API на каждое обновление, по шагам сценария."""
+
+    def __init__(self, hub, dispatcher, bot):
+        self.hub = hub
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.steps = defaultdict(lambda: {'latency': [], 'sql': [], 'api': []})
+        self.background_sql = 0
+        self._sql = 0
+        self._handler_thread = threading.get_ident()
+        hub.store.set_trace(self._on_sql)
+
+    def _on_sql(self, sql: str) -> None:
+        if sql.startswith('PRAGMA'):
+            return
+        if threading.get_ident() == self._handler_thread:
+            self._sql += 1
+        else:
+            self.background_sql += 1
+
+    def run(self, step: str, update) -> list:
+        """Обрабатывает обновление, возвращает вызовы API, сделанные напрямую."""
+        self._sql = 0
+        queued = self.hub.outbox.queued
+        self.bot.take_calls()
+        started = time.perf_counter()
+        self.dispatcher.process_update(update)
+        elapsed = time.perf_counter() - started
+        calls = self.bot.take_calls()
+
+        stats = self.steps[step]
+        stats['latency'].append(elapsed)
+        stats['sql'].append(self._sql)
+        stats['api'].append(len(calls) + self.hub.outbox.queued - queued)
+        return calls
+
+    def report(self) -> dict:
+        return {
+            step: {
+                'updates': len(stats['latency']),
+                'p50_ms': statistics.median(stats['latency']) * 1000,
+                'p99_ms': percentile(stats['latency'], 0.99) * 1000,
+                'sql_per_update': statistics.mean(stats['sql']),
+                'api_per_update': statistics.mean(stats['api']),
+            }
+            for step, stats in self.steps.items()
+        }
+
+
+def shown_profile(calls):
+    # user_id показанной анкеты - из кнопки "Следующая анкета"
+    for _, data in calls:
+        shown = button_arg(data, 'next')
+        if shown is not None:
+            return shown
+    return None
+
+
+def run_session(rec: Recorder, updates: UpdateFactory, user_id: int, browse: int, rnd: random.Random) -> None:
+    rec.run('/start', updates.message(user_id, '/start'))
+    rec.run('create_profile', updates.callback(user_id, encode('create_profile')))
+    rec.run('nickname', updates.message(user_id, f'player{user_id}'))
+    rec.run('game', updates.message(user_id, rnd.choice(['Dota 2', 'дота', 'dota2'])))
+    rec.run('rank', updates.message(user_id, str(rnd.randint(1000, 5000))))
+    calls = rec.run('description', updates.message(user_id, 'ищу тиммейта на вечер, микрофон обязателен'))
+
+    shown = target = shown_profile(calls)
+    for _ in range(browse):
+        if shown is None:
+            break
+        target = shown
+        shown = shown_profile(rec.run('next_', updates.callback(user_id, encode('next', shown))))
+    if target is None:
+        return
+
+    rec.run('invite_', updates.callback(user_id, encode('invite', target)))
+    rec.run('accept_', updates.callback(target, encode('accept', user_id)))
+    rec.run('invite_history', updates.callback(user_id, encode('invite_history')))
+    rec.run('report_', updates.callback(user_id, encode('report', target)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500, help='анкет в базе до начала сессий')
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--browse', type=int, default=100, help='анкет просмотреть за сессию')
+    parser.add_argument('--db', help='файл базы (по умолчанию временный)')
+    parser.add_argument('--pg', help='URL базы PostgreSQL вместо SQLite (ее данные будут удалены)')
+    parser.add_argument('--json', help='записать результат в файл')
+    args = parser.parse_args()
+
+    if args.pg:
+        storage.configure(args.pg)
+    else:
+        db.configure(args.db or os.path.join(tempfile.mkdtemp(), 'bench_handlers.db'))
+    import AlliesHub as hub  # создает схему в настроенной базе
+    from persistence import SQLitePersistence
+
+    if args.pg:
+        hub.store.clear()
+
+    rnd = random.Random(1)
+    for user_id in range(1, args.users + 1):
+        hub.save_profile(user_id, f'user{user_id}', 'Dota 2', str(rnd.randint(0, 6000)), 'ищу пати')
+
+    bot = FakeBot()
+    dispatcher = Dispatcher(bot, queue.Queue(), persistence=SQLitePersistence())
+    hub.add_handlers(dispatcher)
+    updates = UpdateFactory(bot)
+    rec = Recorder(hub, dispatcher, bot)
+
+    # Как в боте: мелкие записи пачками, исходящие копятся в outbox (без отправки)
+    hub.writes.start()
+    started = time.perf_counter()
+    for i in range(args.sessions):
+        run_session(rec, updates, FIRST_SESSION_USER + i, args.browse, rnd)
+    elapsed = time.perf_counter() - started
+    hub.writes.stop()
+
+    report = rec.report()
+    print(f'{"шаг":>16} {"обновл.":>8} {"p50, мс":>8} {"p99, мс":>8} {"SQL/обн":>8} {"API/обн":>8}')
+    for step, row in report.items():
+        print(f'{step:>16} {row["updates"]:>8} {row["p50_ms"]:>8.2f} {row["p99_ms"]:>8.2f} '
+              f'{row["sql_per_update"]:>8.1f} {row["api_per_update"]:>8.1f}')
+    total = sum(row['updates'] for row in report.values())
+    print(f'{hub.store.name}: всего {total} обновлений за {elapsed:.2f} c, фоновых операторов SQL: {rec.background_sql}, '
+          f'кэш анкет: {hub.profile_cache.stats()}')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'steps': report, 'background_sql': rec.background_sql}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Подбор по близости тира: два встречных обхода индекса против ORDER BY ABS().
+
+    python bench_matchmaking.py --users 1000000 --pages 1,10,100,1000
+
+Все анкеты в одной игре (Dota 2, рейтинг случайный), смотрящий - в середине
+лестницы. Замеряется время получения страницы N (p50/p99 по --repeat запускам).
+Наивный запрос сортирует всю игру на каждой странице.
+"""
+import argparse
+import random
+import sqlite3
+import statistics
+import time
+
+from explain_queries import create_schema
+from matchmaking import nearest_candidates
+from migrations import migrate
+
+NAIVE_SQL = '''
+    SELECT * FROM users
+    WHERE game_id = ?
+    AND is_searching = TRUE
+    AND is_banned = FALSE
+    AND user_id != ?
+    ORDER BY tier IS NULL, ABS(tier - ?), user_id
+    LIMIT ? OFFSET ?
+'''
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def timed_us(call, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples), percentile(samples, 0.99)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--pages', default='1,10,100,1000')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    conn = sqlite3.connect(':memory:')
+    create_schema(conn)
+    conn.executemany(
+        'INSERT INTO users (user_id, username, game, rank, description, is_searching) VALUES (?, ?, ?, ?, ?, ?)',
+        ((uid, f'user{uid}', 'Dota 2', str(rnd.randint(0, 6000)) if uid > 1 else '3000', '', True)
+         for uid in range(1, args.users + 1))
+    )
+    conn.commit()
+    started = time.perf_counter()
+    migrate(conn)
+    print(f'миграция (тиры для {args.users} анкет): {time.perf_counter() - started:.1f} c')
+
+    me = 1
+    game_id, tier = conn.execute('SELECT game_id, tier FROM users WHERE user_id = ?', (me,)).fetchone()
+    pages = sorted(int(p) for p in args.pages.split(','))
+
+    # Курсоры страниц: проходим выдачу подряд до последней нужной страницы
+    cursors, after = {}, 0
+    for page in range(1, pages[-1] + 1):
+        cursors[page] = after
+        batch = nearest_candidates(conn, me, after, args.limit)
+        if not batch:
+            break
+        after = batch[-1][0]
+
+    print(f'{"page":>8} {"index p50":>10} {"index p99":>10} {"naive p50":>10} {"naive p99":>10}  (us)')
+    for page in pages:
+        if page not in cursors:
+            break
+        index = timed_us(lambda: nearest_candidates(conn, me, cursors[page], args.limit), args.repeat)
+        offset = (page - 1) * args.limit
+        naive = timed_us(lambda: conn.execute(NAIVE_SQL, (game_id, me, tier, args.limit, offset)).fetchall(),
+                         max(args.repeat // 10, 1))
+        print(f'{page:>8} {index[0]:>10.0f} {index[1]:>10.0f} {naive[0]:>10.0f} {naive[1]:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Стоимость клавиатур и карточки анкеты на одно обновление: сборка на каждый вызов против rendering.py.
+
+    python bench_render.py --iterations 20000
+
+Типичное обновление "следующая анкета": карточка, клавиатура анкеты с id
+и главное меню, все сериализуется в JSON (как при отправке). Печатает время
+на обновление и пик памяти под временные объекты одного обновления (tracemalloc).
+"""
+import argparse
+import time
+import tracemalloc
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+import rendering
+
+PROFILE = (123456789, 'nickname', 'Dota 2', 'Legend 3', 'ищу тиммейта на вечер, микрофон обязателен')
+
+
+# Как было до rendering.py: объекты собираются на каждый вызов
+
+def old_main_menu_markup():
+    return ReplyKeyboardMarkup([[rendering.MAIN_MENU_BUTTON]], resize_keyboard=True, one_time_keyboard=False)
+
+
+def old_profile_markup(profile_user_id: int):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Следующая анкета", callback_data=f'next_{profile_user_id}')],
+        [
+            InlineKeyboardButton("Отправить запрос", callback_data=f'invite_{profile_user_id}'),
+            InlineKeyboardButton("Перестать искать", callback_data='stop_search')
+        ],
+        [
+            InlineKeyboardButton("Изменить анкету", callback_data='edit_profile'),
+            InlineKeyboardButton("Пожаловаться на профиль", callback_data=f'report_{profile_user_id}')
+        ]
+    ])
+
+
+def old_profile_card(profile, title: str = None) -> str:
+    header = f"\n            {title}" if title else ""
+    return f"""{header}
+            🎮 Игра: {profile[2]}
+            👤 Никнейм: {profile[1]}
+            🏆 Ранг: {profile[3]}
+            📝 Описание: {profile[4]}
+            """
+
+
+def old_update():
+    return (old_profile_card(PROFILE), old_profile_markup(PROFILE[0]).to_json(), old_main_menu_markup().to_json())
+
+
+def new_update():
+    return (rendering.profile_card(PROFILE), rendering.profile_markup(PROFILE[0]).to_json(),
+            rendering.MAIN_MENU_MARKUP.to_json())
+
+
+def measure(update, iterations: int):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        update()
+    per_update_us = (time.perf_counter() - started) / iterations * 1e6
+
+    tracemalloc.start()
+    peaks = 0
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        update()
+        peaks += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return per_update_us, peaks / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    old_text, new_text = old_update()[0], new_update()[0]
+    print(f'карточка: {len(old_text)} символов было, {len(new_text)} стало')
+    for name, update in (('сборка на вызов', old_update), ('rendering.py', new_update)):
+        us, size = measure(update, args.iterations)
+        print(f'{name:>16}: {us:7.2f} мкс на обновление, пик {size:6.0f} байт')
+
+
+if __name__ == '__main__':
+    main()
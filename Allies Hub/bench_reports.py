@@ -0,0 +1,78 @@
+"""Нагрузочный тест жалоб: много потоков жалуются на одного пользователя.
+
+    python bench_reports.py --reporters 2000 --threads 16 --repeat 3
+
+Каждый жалующийся отправляет --repeat жалоб на одну цель (повторы должны
+отбрасываться). Печатает жалобы в секунду, p50/p99 времени report_user
+и проверяет, что учтено ровно по одной жалобе от каждого, а блокировка
+выдана ровно один раз.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import db
+
+TARGET = 1
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run_reporter_thread(hub, reporters, repeat, latencies, bans):
+    for _ in range(repeat):
+        for reporter in reporters:
+            started = time.perf_counter()
+            banned, _ = hub.report_user(TARGET, reporter)
+            latencies.append(time.perf_counter() - started)
+            if banned:
+                bans.append(reporter)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reporters', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3, help='жалоб от каждого (повторы не считаются)')
+    parser.add_argument('--db', help='файл базы (по умолчанию временный)')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench_reports.db')
+    db.configure(path)
+    import AlliesHub as hub  # создает схему в настроенной базе
+
+    with db.transaction() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO users (user_id, username, game, rank, description, is_searching) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ((uid, f'user{uid}', 'Dota 2', '1000', '', True) for uid in range(1, args.reporters + 2))
+        )
+
+    reporters = list(range(2, args.reporters + 2))
+    latencies, bans, threads = [], [], []
+    started = time.perf_counter()
+    for i in range(args.threads):
+        thread = threading.Thread(target=run_reporter_thread,
+                                  args=(hub, reporters[i::args.threads], args.repeat, latencies, bans))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stored = db.fetchone('SELECT COUNT(*) FROM reports WHERE reported_user_id = ?', (TARGET,))[0]
+    is_banned = db.fetchone('SELECT is_banned FROM users WHERE user_id = ?', (TARGET,))[0]
+    print(f'вызовов: {len(latencies)}, {len(latencies) / elapsed:.0f} в секунду, '
+          f'p50 {statistics.median(latencies) * 1000:.2f} мс, p99 {percentile(latencies, 0.99) * 1000:.2f} мс')
+    print(f'жалоб в базе: {stored} (ожидается {args.reporters}), блокировок: {len(bans)}, is_banned={is_banned}')
+    ok = stored == args.reporters and len(bans) == (1 if args.reporters >= hub.REPORT_THRESHOLD else 0)
+    print('OK' if ok else 'FAIL')
+
+
+if __name__ == '__main__':
+    main()
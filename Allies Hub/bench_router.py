@@ -0,0 +1,184 @@
+"""Масштабирование по процессам: обновлений в секунду через router.py при 1..N воркерах.
+
+    python bench_router.py --workers 1,2,4,8 --updates 40000
+    python bench_router.py --workers 1,2,4,8 --pg postgresql://localhost/allies
+
+База - populate.py (--users анкет), для каждого числа воркеров - свежая копия
+(с --pg - копия в PostgreSQL, ее данные заменяются).
+Воркеры - отдельные процессы с обработчиками бота (AlliesHub.add_handlers)
+за WebhookServer, как AlliesHub.py с ALLIES_WORKER_PORT, но с FakeBot вместо
+Telegram. Фронт - Router в этом процессе. Обновления (следующая анкета,
+иногда инвайт) заранее сгенерированы для --actors пользователей; время -
+от первой пересылки до обработки последнего обновления последним воркером.
+Ускорение ограничено числом ядер: оно печатается рядом с результатом.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import db
+import storage
+from callbacks import encode
+from router import Router
+
+SECRET = 'bench-secret'
+
+
+def make_updates(user_ids, count: int, seed: int):
+    rnd = random.Random(seed)
+    for update_id in range(1, count + 1):
+        user_id = rnd.choice(user_ids)
+        data = encode('invite' if rnd.random() < 0.1 else 'next', rnd.choice(user_ids))
+        sender = {'id': user_id, 'is_bot': False, 'first_name': 'bench', 'username': f'user{user_id}'}
+        yield {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'chat_instance': str(user_id), 'from': sender, 'data': data,
+            'message': {'message_id': update_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'},
+                        'text': 'profile'}}}
+
+
+def serve(path: str, port: int, expect: int, pg: str = None) -> None:
+    # Воркер: как AlliesHub.run_webhook(worker=True), но бот - FakeBot
+    from telegram import Update
+    from telegram.ext import Dispatcher
+
+    if pg:
+        storage.configure(pg)
+    else:
+        db.configure(path)
+    import AlliesHub as hub
+    from fakebot import FakeBot
+    from persistence import SQLitePersistence
+    from webhook import WebhookServer
+
+    bot = FakeBot(record_calls=False)
+    dispatcher = Dispatcher(bot, queue.Queue(), persistence=SQLitePersistence())
+    hub.add_handlers(dispatcher)
+    hub.writes.start()
+    # Как у настоящего воркера: изменения анкет расходятся по другим воркерам
+    hub.invalidations.enabled = True
+    hub.invalidations.start()
+
+    done = threading.Event()
+    lock = threading.Lock()
+    processed = [0]
+
+    def process(data):
+        try:
+            dispatcher.process_update(Update.de_json(data, bot))
+        finally:
+            with lock:
+                processed[0] += 1
+                if processed[0] == expect:
+                    done.set()
+
+    server = WebhookServer(process, port=port, path=hub.WORKER_PATH, secret_token=SECRET,
+                           workers=hub.WEBHOOK_WORKERS, queue_size=hub.WEBHOOK_QUEUE_SIZE)
+    server.start()
+    print('ready', flush=True)
+    done.wait()
+    print(time.time(), flush=True)
+    hub.writes.stop()
+    hub.invalidations.stop()
+    hub.store.close()
+
+
+def run(path: str, workers: int, updates: list, base_port: int, pg: str = None) -> float:
+    router = Router([f'http://127.0.0.1:{base_port + i}/updates' for i in range(workers)], SECRET)
+    expect = [0] * workers
+    for data in updates:
+        expect[router.shard(data)] += 1
+
+    processes = []
+    for i in range(workers):
+        command = [sys.executable, os.path.abspath(__file__), '--serve', str(base_port + i),
+                   '--db', path, '--expect', str(expect[i])]
+        if pg:
+            command += ['--pg', pg]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        processes.append(process)
+    for process in processes:
+        if process.stdout.readline().strip() != 'ready':
+            raise SystemExit('воркер не запустился')
+
+    router.start()
+    started = time.time()
+    for data in updates:
+        router.route(data)
+    router.stop()
+    finished = max(float(process.stdout.readline()) for process in processes)
+    for process in processes:
+        process.wait()
+    return finished - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--updates', type=int, default=40000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--actors', type=int, default=5000)
+    parser.add_argument('--base-port', type=int, default=18601)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='записать результат в файл')
+    parser.add_argument('--pg', help='воркеры на PostgreSQL по этому URL')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--expect', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.db, args.serve, args.expect, args.pg)
+        return
+
+    import populate
+
+    workdir = tempfile.mkdtemp(prefix='allies-router-')
+    template = os.path.join(workdir, 'template.db')
+    populate.create(template, args.users, seed=args.seed)
+    conn = db.connect(template)
+    user_ids = [row[0] for row in conn.execute(
+        'SELECT user_id FROM users WHERE is_searching = TRUE AND is_banned = FALSE ORDER BY random() LIMIT ?',
+        (args.actors,)
+    )]
+    conn.close()
+    updates = list(make_updates(user_ids, args.updates, args.seed))
+    store = None
+    if args.pg:
+        from storage_pg import PostgresStorage, copy_from_sqlite
+
+        store = PostgresStorage(args.pg)
+        store.init_schema()
+
+    print(f'ядер: {os.cpu_count()}, анкет: {args.users}, обновлений: {args.updates}')
+    print(f'{"воркеров":>9} {"обн/с":>8} {"ускорение":>10}')
+    results, base = [], None
+    for workers in (int(n) for n in args.workers.split(',')):
+        path = os.path.join(workdir, f'run{workers}.db')
+        if store is not None:
+            copy_from_sqlite(template, store, replace=True)
+        else:
+            shutil.copy(template, path)
+        elapsed = run(path, workers, updates, args.base_port, args.pg)
+        rate = args.updates / elapsed
+        base = base or rate
+        results.append({'workers': workers, 'updates_per_s': rate, 'speedup': rate / base})
+        print(f'{workers:>9} {rate:>8.0f} {rate / base:>10.2f}')
+    shutil.rmtree(workdir, ignore_errors=True)
+    if store is not None:
+        store.close()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'cpu_count': os.cpu_count(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
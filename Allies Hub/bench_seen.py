@@ -0,0 +1,194 @@
+"""Просмотренные анкеты (seen.py): память на пользователя и цена ленты при 1M анкет.
+
+    python bench_seen.py --users 1000000 --seen 0,100,500,1000,2000
+
+База - populate.py (--users анкет; --db - копия готовой базы). Смотрящий - в
+самой большой игре и уже пролистал первые N анкет своей ленты (--seen).
+Замеряется первая анкета после "Продолжить поиск" (CandidateFeed.next с
+пустой очередью): без фильтра (повторы, как раньше), с Bloom-фильтром - с
+сохраненного курсора и с начала ленты (не больше --max-scan строк за раз),
+и с точным множеством user_id, p50/p99 по --repeat запускам. Затем память:
+байт на пользователя в процессе (tracemalloc, --resident пользователей
+с заполненными обоими поколениями) и в базе, доля ложных срабатываний и flush().
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import db
+import storage
+from feed import LOADING, CandidateFeed
+from seen import SeenProfiles
+
+
+class ExactSeen:
+    """Точное множество просмотренных - для сравнения с фильтром."""
+
+    recycle = False
+
+    def __init__(self):
+        self.ids = {}
+        self.cursors = {}
+
+    def add(self, user_id, profile_id):
+        self.ids.setdefault(user_id, set()).add(profile_id)
+
+    def unseen(self, user_id, rows):
+        ids = self.ids.get(user_id, ())
+        return [row for row in rows if row[0] not in ids]
+
+    def cursor(self, user_id):
+        return self.cursors.get(user_id, 0)
+
+    def set_cursor(self, user_id, cursor):
+        self.cursors[user_id] = cursor
+
+    def reset(self, user_id):
+        self.ids.pop(user_id, None)
+        self.cursors.pop(user_id, None)
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def timed_us(call, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples), percentile(samples, 0.99)
+
+
+def first_profile(feed, user_id, cursor=0):
+    # Курсор - как сохранил прошлый сеанс; next() может его сдвинуть
+    feed.invalidate(user_id)
+    if feed._seen is not None:
+        feed._seen.set_cursor(user_id, cursor)
+    return feed.next(user_id, 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--db', help='готовая база populate.py вместо новой')
+    parser.add_argument('--seen', default='0,100,500,1000,2000')
+    parser.add_argument('--capacity', type=int, default=1000)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--max-scan', type=int, default=500)
+    parser.add_argument('--resident', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='allies-seen-')
+    path = os.path.join(workdir, 'bench.db')
+    if args.db:
+        shutil.copy(args.db, path)
+    else:
+        import populate
+
+        populate.create(path, args.users, seed=args.seed)
+    db.configure(path)
+    store = storage.open_storage()
+    store.init_schema()
+
+    def save(rows):
+        with store.transaction() as conn:
+            store.save_seen(conn, rows)
+
+    with store.reading() as conn:
+        total = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        game_id, players = conn.execute('''
+            SELECT game_id, COUNT(*) FROM users WHERE is_searching = TRUE AND is_banned = FALSE
+            GROUP BY game_id ORDER BY 2 DESC LIMIT 1
+        ''').fetchone()
+        me = conn.execute('''
+            SELECT user_id FROM users WHERE game_id = ? AND is_searching = TRUE AND is_banned = FALSE
+            AND tier IS NOT NULL ORDER BY tier, user_id LIMIT 1 OFFSET ?
+        ''', (game_id, players // 2)).fetchone()[0]
+        population = [row[0] for row in conn.execute('SELECT user_id FROM users')]
+    print(f'анкет: {total}, в игре смотрящего ищут: {players}')
+
+    # Лента смотрящего по порядку - столько, сколько он мог пролистать
+    counts = sorted(int(n) for n in args.seen.split(','))
+    order, after = [], 0
+    while len(order) < counts[-1] + 1:
+        batch = store.nearest_candidates(me, after, 500)
+        if not batch:
+            break
+        order.extend(row[0] for row in batch)
+        after = batch[-1][0]
+
+    print(f'{"пролистано":>10} {"без фильтра":>16} {"Bloom с курсора":>16} {"Bloom с начала":>16} '
+          f'{"множество":>16}  p50/p99, мкс')
+    for count in counts:
+        bloom = SeenProfiles(store.load_seen, save, args.capacity, args.error_rate)
+        exact = ExactSeen()
+        for profile_id in order[:count]:
+            bloom.add(me, profile_id)
+            exact.add(me, profile_id)
+        cursor = order[count - 1] if count else 0
+        # Без дозагрузки в фоне (low_watermark=-1): меряем только чтение первой пачки
+        feeds = [CandidateFeed(store.nearest_candidates, low_watermark=-1, seen=seen, max_scan=args.max_scan)
+                 for seen in (None, bloom, exact)]
+        first = first_profile(feeds[1], me, cursor)
+        assert first in (None, LOADING) or first[0] not in order[:count], 'фильтр пропустил просмотренную анкету'
+        row = [timed_us(lambda: first_profile(feeds[0], me), args.repeat),
+               timed_us(lambda: first_profile(feeds[1], me, cursor), args.repeat),
+               timed_us(lambda: first_profile(feeds[1], me), args.repeat),
+               timed_us(lambda: first_profile(feeds[2], me, cursor), args.repeat)]
+        print(f'{count:>10} ' + ' '.join(f'{p50:>8.0f}/{p99:<7.0f}' for p50, p99 in row))
+
+    # Память: --resident пользователей, у каждого по 2 * capacity просмотренных
+    rnd = random.Random(args.seed)
+    viewers = rnd.sample(population, args.resident)
+    samples = [rnd.sample(population, 2 * args.capacity) for _ in range(args.resident)]
+    results = {}
+    for name, make in (('Bloom', lambda: SeenProfiles(lambda user_id: None, save, args.capacity, args.error_rate,
+                                                      max_users=args.resident)),
+                       ('множество', ExactSeen)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        seen = make()
+        for viewer, profiles in zip(viewers, samples):
+            for profile_id in profiles:
+                seen.add(viewer, profile_id)
+        results[name] = seen, (tracemalloc.get_traced_memory()[0] - before) / args.resident
+        tracemalloc.stop()
+    bloom = results['Bloom'][0]
+    print(f'фильтр: {bloom.size} байт x 2 поколения, хешей: {bloom.hashes}')
+    print(f'память на пользователя ({2 * args.capacity} просмотренных): Bloom {results["Bloom"][1]:.0f} байт, '
+          f'множество {results["множество"][1]:.0f} байт')
+
+    # Ложные срабатывания: непросмотренные анкеты, которые фильтр считает просмотренными
+    tried = false = 0
+    for viewer, profiles in zip(viewers[:100], samples[:100]):
+        taken = set(profiles)
+        fresh = [(user_id,) for user_id in rnd.sample(population, 1000) if user_id not in taken]
+        tried += len(fresh)
+        false += len(fresh) - len(bloom.unseen(viewer, fresh))
+    print(f'ложных срабатываний: {false / tried:.2%} (на поколение {args.error_rate:.2%}, проверяются оба)')
+
+    started = time.perf_counter()
+    written = bloom.flush()
+    elapsed = time.perf_counter() - started
+    with store.reading() as conn:
+        stored = conn.execute('SELECT AVG(length(bits) + COALESCE(length(previous), 0)) FROM seen_profiles'
+                              ).fetchone()[0]
+    print(f'flush: {written} фильтров за {elapsed * 1000:.0f} мс ({elapsed / written * 1e6:.0f} мкс на фильтр), '
+          f'в базе {stored:.0f} байт на пользователя')
+
+    store.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
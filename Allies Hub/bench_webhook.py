@@ -0,0 +1,106 @@
+"""Нагрузочный стенд вебхука без Telegram.
+
+    python bench_webhook.py --requests 20000 --clients 16
+    python bench_webhook.py --updates recorded.json --handler-ms 2
+
+Поднимает WebhookServer на локальном порту и шлет в него обновления
+(из JSON-файла со списком записанных Update или синтетические) с нескольких
+клиентов по keep-alive соединениям. Печатает запросы в секунду, p50/p99
+времени ответа и время до полной обработки очереди.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import statistics
+import threading
+import time
+
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'bench-secret'
+
+
+def synthetic_updates(users: int = 1000):
+    for n in itertools.count(1):
+        user_id = n % users + 1
+        sender = {'id': user_id, 'is_bot': False, 'first_name': 'bench', 'username': f'user{user_id}'}
+        chat = {'id': user_id, 'type': 'private'}
+        if n % 2:
+            yield {'update_id': n, 'callback_query': {
+                'id': str(n), 'chat_instance': 'bench', 'from': sender, 'data': f'next_{n}',
+                'message': {'message_id': n, 'date': 0, 'chat': chat, 'text': 'profile'}}}
+        else:
+            yield {'update_id': n, 'message': {
+                'message_id': n, 'date': 0, 'chat': chat, 'from': sender, 'text': 'hello'}}
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run_client(address, path, bodies, latencies, statuses):
+    conn = http.client.HTTPConnection(*address)
+    headers = {'Content-Type': 'application/json', SECRET_HEADER: SECRET}
+    for body in bodies:
+        started = time.perf_counter()
+        conn.request('POST', path, body, headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', help='JSON-файл со списком записанных обновлений')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--handler-ms', type=float, default=0.0, help='имитация времени обработчика')
+    args = parser.parse_args()
+
+    if args.updates:
+        with open(args.updates, encoding='utf-8') as f:
+            recorded = json.load(f)
+        source = itertools.cycle(recorded)
+    else:
+        source = synthetic_updates()
+    bodies = [json.dumps(next(source)).encode() for _ in range(args.requests)]
+
+    processed = itertools.count()
+
+    def process_update(data):
+        if args.handler_ms:
+            time.sleep(args.handler_ms / 1000)
+        next(processed)
+
+    server = WebhookServer(process_update, port=0, secret_token=SECRET,
+                           workers=args.workers, queue_size=args.queue_size)
+    server.start()
+
+    latencies, statuses, threads = [], {}, []
+    chunk = (len(bodies) + args.clients - 1) // args.clients
+    started = time.perf_counter()
+    for i in range(args.clients):
+        thread = threading.Thread(target=run_client, args=(server.address, server.path,
+                                                           bodies[i * chunk:(i + 1) * chunk], latencies, statuses))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    accepted = time.perf_counter() - started
+    server.stop(drain=True)
+    drained = time.perf_counter() - started
+
+    print(f'запросов: {len(latencies)}, ответы: {dict(sorted(statuses.items()))}')
+    print(f'прием: {len(latencies) / accepted:.0f} req/s, '
+          f'p50 {statistics.median(latencies) * 1000:.2f} мс, p99 {percentile(latencies, 0.99) * 1000:.2f} мс')
+    print(f'обработано {next(processed)} обновлений за {drained:.2f} с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Коммит на каждую запись против отложенной записи пачками (writebehind.py).
+
+    python bench_writes.py --users 2000 --threads 16 --ops 20000
+
+Потоки-"обработчики" делают то же, что кнопки бота: включают и выключают
+поиск, меняют описание, отклоняют инвайты. Каждый десятый вызов читает
+свою анкету и проверяет, что видит собственную последнюю правку.
+Печатает записей и коммитов в секунду и p50/p99 времени вызова для обоих режимов.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+import db
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run_handler_thread(hub, user_ids, ops, seed, latencies, stale):
+    rnd = random.Random(seed)
+    searching = {}
+    for i in range(ops):
+        user_id = rnd.choice(user_ids)
+        kind = rnd.random()
+        started = time.perf_counter()
+        if kind < 0.5:
+            searching[user_id] = rnd.random() < 0.5
+            hub.set_searching(user_id, searching[user_id])
+        elif kind < 0.8:
+            hub.update_profile(user_id, 'description', f'ищу тиммейта #{i}')
+        else:
+            hub.set_invite_status(rnd.choice(user_ids), user_id, 'rejected')
+        latencies.append(time.perf_counter() - started)
+
+        if i % 10 == 0 and user_id in searching:
+            if bool(hub.get_profile(user_id)[5]) != searching[user_id]:
+                stale.append(user_id)
+
+
+def run(hub, args, batched: bool):
+    if batched:
+        hub.writes.start()
+    commits_before = hub.writes.commits
+    latencies, stale, threads = [], [], []
+    # У каждого потока свои пользователи, как у обработчиков разных чатов
+    users = list(range(1, args.users + 1))
+    started = time.perf_counter()
+    for i in range(args.threads):
+        thread = threading.Thread(target=run_handler_thread,
+                                  args=(hub, users[i::args.threads], args.ops // args.threads, i, latencies, stale))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if batched:
+        hub.writes.stop()
+    elapsed = time.perf_counter() - started
+    commits = hub.writes.commits - commits_before
+
+    name = 'пачками' if batched else 'коммит на запись'
+    print(f'{name:>17}: {len(latencies) / elapsed:8.0f} записей/с, {commits / elapsed:8.0f} коммитов/с, '
+          f'p50 {statistics.median(latencies) * 1000:.3f} мс, p99 {percentile(latencies, 0.99) * 1000:.3f} мс, '
+          f'устаревших чтений своей анкеты: {len(stale)}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--db', help='файл базы (по умолчанию временный)')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench_writes.db')
+    db.configure(path)
+    import AlliesHub as hub  # создает схему в настроенной базе
+
+    with db.transaction() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO users (user_id, username, game, rank, description, is_searching) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ((uid, f'user{uid}', 'Dota 2', '1000', '', True) for uid in range(1, args.users + 1))
+        )
+        conn.executemany(
+            'INSERT INTO invites (from_user_id, to_user_id) VALUES (?, ?)',
+            ((uid, uid % args.users + 1) for uid in range(1, args.users + 1))
+        )
+
+    run(hub, args, batched=False)
+    run(hub, args, batched=True)
+
+
+if __name__ == '__main__':
+    main()
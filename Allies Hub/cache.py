@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Fill:
+    # Загрузка промахов: что успели сбросить, пока она читала базу
+    __slots__ = ('dropped', 'cleared')
+
+    def __init__(self):
+        self.dropped = set()
+        self.cleared = False
+
+
+class ProfileCache:
+    """Строки анкет в памяти: user_id -> строка users (или None - анкеты нет).
+
+    Ограничен по размеру (вытесняется давно не читанная запись) и по времени
+    жизни записи: ttl страхует от изменений, сделанных в обход invalidate
+    (другим процессом). Все записи анкеты должны вызывать invalidate(user_id).
+
+    load(user_ids) -> {user_id: строка} - чтение промахов из базы одним запросом.
+    """
+
+    def __init__(self, load, max_size: int = 10000, ttl: float = 60.0):
+        self._load = load
+        self.max_size = max_size
+        self.ttl = ttl
+        self._rows = OrderedDict()  # user_id -> (строка, когда истекает)
+        self._lock = threading.Lock()
+        # Идущие загрузки: строку, сброшенную во время загрузки, та могла
+        # прочитать старой и в кэш ее не кладет; остальные строки кладет
+        self._fills = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int):
+        return self.get_many((user_id,))[user_id]
+
+    def get_many(self, user_ids) -> dict:
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._rows.get(user_id)
+                if entry is not None and entry[1] > now:
+                    self._rows.move_to_end(user_id)
+                    found[user_id] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.append(user_id)
+                    self.misses += 1
+            if not missing:
+                return found
+            fill = _Fill()
+            self._fills.add(fill)
+
+        try:
+            loaded = self._load(missing)
+        finally:
+            with self._lock:
+                self._fills.discard(fill)
+        with self._lock:
+            for user_id in missing:
+                row = found[user_id] = loaded.get(user_id)
+                if not fill.cleared and user_id not in fill.dropped:
+                    self._rows[user_id] = (row, now + self.ttl)
+                    self._rows.move_to_end(user_id)
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+                self.evictions += 1
+        return found
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            for fill in self._fills:
+                fill.dropped.add(user_id)
+            self._rows.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            for fill in self._fills:
+                fill.cleared = True
+            self._rows.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._rows),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,240 @@
+import calendar
+import struct
+import time
+from datetime import datetime
+
+# callback_data кнопок: версия, код действия и аргументы-целые в base36
+# через точку: '1n.2n9c' - версия 1, следующая анкета после user_id 123456.
+# Telegram принимает не больше 64 байт, самая длинная кнопка (страница
+# поиска) - около 25. Кнопки старого формата ('next_123456') остаются в уже
+# отправленных сообщениях, decode разбирает и их. Обработчик кнопки
+# выбирается поиском в словаре по голове до первой точки ('1n'), а не
+# перебором префиксов; аргументы разбирает готовая для кода функция.
+
+VERSION = '1'
+SEP = '.'
+MAX_LENGTH = 64
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Действие -> (код, типы аргументов): i - целое, f - float (score поиска),
+# t - время UTC в TIME_FORMAT (курсор истории инвайтов). Код не меняется,
+# пока живы кнопки с ним; новое действие - новый код.
+ACTIONS = {
+    'main_menu': ('m', ''),
+    'next': ('n', 'i'),
+    'stop_search': ('s', ''),
+    'resume_search': ('r', ''),
+    'edit_profile': ('e', ''),
+    'show_my_profile': ('p', ''),
+    'report': ('x', 'i'),
+    'invite_history': ('h', ''),
+    'history_new': ('hn', 'ti'),
+    'history_old': ('ho', 'ti'),
+    'description_search': ('d', ''),
+    'search': ('f', 'fi'),
+    'invite': ('i', 'i'),
+    'accept': ('a', 'i'),
+    'decline': ('j', 'i'),
+    'create_profile': ('c', ''),
+    'change_game': ('cg', ''),
+    'change_rank': ('cr', ''),
+    'change_description': ('cd', ''),
+}
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def pack_int(value: int) -> str:
+    value = int(value)
+    if value < 0:
+        return '-' + pack_int(-value)
+    digits = ''
+    while True:
+        value, rest = divmod(value, 36)
+        digits = _DIGITS[rest] + digits
+        if not value:
+            return digits
+
+
+_DOUBLE = struct.Struct('<d')
+_INT64 = struct.Struct('<q')
+
+
+def _pack_float(value: float) -> int:
+    # Биты double как целое: курсор поиска сравнивается точно
+    return _INT64.unpack(_DOUBLE.pack(value))[0]
+
+
+def _unpack_float(value: int) -> float:
+    return _DOUBLE.unpack(_INT64.pack(value))[0]
+
+
+def _pack_time(value) -> int:
+    # Время из базы: строка (SQLite) или datetime (PostgreSQL), UTC
+    if isinstance(value, datetime):
+        return calendar.timegm(value.timetuple())
+    return calendar.timegm(datetime.strptime(value, TIME_FORMAT).timetuple())
+
+
+def _unpack_time(value: int) -> str:
+    return time.strftime(TIME_FORMAT, time.gmtime(value))
+
+
+_PACK = {'i': int, 'f': _pack_float, 't': _pack_time}
+_UNPACK = {'f': _unpack_float, 't': _unpack_time}
+# Старый формат: аргументы - текст через '_'
+_LEGACY = {'i': int, 'f': float, 't': str}
+
+# Ошибки разбора чужой или испорченной кнопки
+_ERRORS = (KeyError, ValueError, TypeError, OverflowError, struct.error)
+
+
+def _one_int(rest: str) -> tuple:
+    # Лишняя точка в rest не проходит int()
+    return (int(rest, 36),)
+
+
+def _parser(kinds: str):
+    # Аргументы после первой точки -> кортеж; на каждый набор типов - своя
+    # функция. Без аргументов - None: после головы ничего быть не должно
+    if not kinds:
+        return None
+    if kinds == 'i':
+        return _one_int
+    unpack = tuple(_UNPACK.get(kind) for kind in kinds)
+    if len(unpack) == 2 and unpack[1] is None:
+        # Курсоры истории и поиска: (время или score, id)
+        first = unpack[0] or int
+
+        def parse_pair(rest: str) -> tuple:
+            value, after = rest.split(SEP)
+            return first(int(value, 36)), int(after, 36)
+        return parse_pair
+
+    def parse(rest: str) -> tuple:
+        parts = rest.split(SEP)
+        if len(parts) != len(unpack):
+            raise ValueError(rest)
+        return tuple([int(part, 36) if f is None else f(int(part, 36)) for f, part in zip(unpack, parts)])
+    return parse
+
+
+def _heads(action: str) -> list:
+    # Головы callback_data действия: версия и код, у кнопок без аргументов
+    # еще и старое имя ('main_menu') - оно не содержит точки
+    code, kinds = ACTIONS[action]
+    return [VERSION + code] if kinds else [VERSION + code, action]
+
+
+# Голова -> (действие, разборщик)
+_ROUTES = {head: (action, _parser(ACTIONS[action][1])) for action in ACTIONS for head in _heads(action)}
+
+
+def encode(action: str, *args) -> str:
+    code, kinds = ACTIONS[action]
+    if len(args) != len(kinds):
+        raise ValueError(f"{action}: нужно аргументов {len(kinds)}, передано {len(args)}")
+    data = SEP.join([VERSION + code] + [pack_int(_PACK[kind](arg)) for kind, arg in zip(kinds, args)])
+    if len(data) > MAX_LENGTH:
+        raise ValueError(f"callback_data длиннее {MAX_LENGTH} байт: {data}")
+    return data
+
+
+def template(action: str) -> str:
+    """callback_data для KeyboardTemplate: единственный целый аргумент - '{id}'."""
+    code, kinds = ACTIONS[action]
+    if kinds != 'i':
+        raise ValueError(f"{action}: шаблон только для одного целого аргумента")
+    return f'{VERSION}{code}{SEP}{{id}}'
+
+
+def _decode_legacy(data: str):
+    # 'main_menu', 'next_123', 'history_old_2024-01-01 10:00:00_5', 'search_-1.5_42'
+    spec = ACTIONS.get(data)
+    if spec is not None:
+        return (data, ()) if not spec[1] else None
+    action, _, rest = data.partition('_')
+    if action == 'history':
+        direction, _, rest = rest.partition('_')
+        action = f'history_{direction}'
+    spec = ACTIONS.get(action)
+    if spec is None or not spec[1]:
+        return None
+    parts = rest.split('_', len(spec[1]) - 1)
+    if len(parts) != len(spec[1]):
+        return None
+    return action, tuple(_LEGACY[kind](part) for kind, part in zip(spec[1], parts))
+
+
+def decode(data: str):
+    """-> (действие, аргументы) или None, если кнопка не разбирается (другая версия, мусор)."""
+    head, sep, rest = data.partition(SEP)
+    route = _ROUTES.get(head)
+    try:
+        if route is None:
+            return _decode_legacy(data)
+        if route[1] is None:
+            return (route[0], ()) if not sep else None
+        return route[0], route[1](rest)
+    except _ERRORS:
+        return None
+
+
+def action_name(data: str):
+    decoded = decode(data)
+    return decoded[0] if decoded else None
+
+
+def matcher(action: str):
+    """pattern для CallbackQueryHandler: кнопка действия action в любом формате."""
+    if action not in ACTIONS:
+        raise ValueError(f"Неизвестное действие {action}")
+    return lambda data: action_name(data) == action
+
+
+class CallbackRegistry:
+    """Обработчики кнопок по действию.
+
+    dispatch(data, *context) разбирает callback_data и вызывает
+    handler(*context, *args); для неизвестной кнопки возвращает None.
+    Кнопки нового формата находятся одним поиском по голове ('1n'),
+    старого - через decode.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._routes = {}  # голова -> (обработчик, разборщик)
+
+    def register(self, action: str):
+        if action not in ACTIONS:
+            raise ValueError(f"Неизвестное действие {action}")
+
+        def decorator(handler):
+            self._handlers[action] = handler
+            for head in _heads(action):
+                self._routes[head] = (handler, _ROUTES[head][1])
+            return handler
+        return decorator
+
+    def lookup(self, data: str):
+        """-> (обработчик, аргументы) или None."""
+        decoded = decode(data)
+        if decoded is None:
+            return None
+        handler = self._handlers.get(decoded[0])
+        return (handler, decoded[1]) if handler is not None else None
+
+    def dispatch(self, data: str, *context):
+        head, sep, rest = data.partition(SEP)
+        route = self._routes.get(head)
+        if route is None:
+            found = self.lookup(data)
+            return found[0](*context, *found[1]) if found is not None else None
+        handler, parse = route
+        if parse is None:
+            return handler(*context) if not sep else None
+        try:
+            args = parse(rest)
+        except _ERRORS:
+            return None
+        return handler(*context, *args)
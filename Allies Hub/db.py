@@ -0,0 +1,119 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Соединение на поток: воркеры диспетчера не делят курсор и не мешают
+# друг другу, в режиме WAL читатели работают параллельно с писателем.
+DB_PATH = 'allies.db'
+BUSY_TIMEOUT_MS = 5000
+
+_local = threading.local()
+_path = DB_PATH
+_generation = 0
+_trace = None
+_observer = None
+
+
+def configure(path: str) -> None:
+    """Переключает все потоки на другую базу (для скриптов и бенчмарков)."""
+    global _path, _generation
+    _path = path
+    _generation += 1
+
+
+def set_trace(callback) -> None:
+    """callback(sql) на каждый оператор во всех потоках (для бенчмарков); None - выключить."""
+    global _trace, _generation
+    _trace = callback
+    _generation += 1
+
+
+def set_observer(callback) -> None:
+    """callback(sql, seconds) после каждого оператора и COMMIT во всех потоках; None - выключить."""
+    global _observer, _generation
+    _observer = callback
+    _generation += 1
+
+
+class _TimedConnection(sqlite3.Connection):
+    # Для SELECT время execute - до первой строки, остальное читает fetch*
+    def execute(self, sql, params=()):
+        observer, started = _observer, time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            if observer is not None:
+                observer(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, params):
+        observer, started = _observer, time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            if observer is not None:
+                observer(sql, time.perf_counter() - started)
+
+    def commit(self):
+        observer, started = _observer, time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            if observer is not None:
+                observer('COMMIT', time.perf_counter() - started)
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    factory = _TimedConnection if _observer is not None else sqlite3.Connection
+    conn = sqlite3.connect(path or _path, timeout=BUSY_TIMEOUT_MS / 1000, factory=factory)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    if _trace is not None:
+        conn.set_trace_callback(_trace)
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.generation != _generation:
+        if conn is not None:
+            conn.close()
+        conn = _local.conn = connect()
+        _local.generation = _generation
+    return conn
+
+
+def close() -> None:
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def fetchone(sql: str, params=()):
+    return get_connection().execute(sql, params).fetchone()
+
+
+def fetchall(sql: str, params=()):
+    return get_connection().execute(sql, params).fetchall()
+
+
+def execute(sql: str, params=()) -> int:
+    """Одиночная запись в своей транзакции, возвращает rowcount."""
+    with transaction() as conn:
+        return conn.execute(sql, params).rowcount
+
+
+@contextmanager
+def transaction():
+    # BEGIN IMMEDIATE сразу берет блокировку записи и не упирается
+    # в SQLITE_BUSY при попытке повысить читающую транзакцию
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
@@ -0,0 +1,182 @@
+"""Печатает EXPLAIN QUERY PLAN для горячих запросов бота.
+
+    python explain_queries.py allies.db
+    python explain_queries.py --users 1000000 /tmp/big.db
+
+С --users база заполняется синтетическими анкетами (только если она пустая).
+Код возврата 1, если хотя бы один запрос делает полный скан таблицы.
+На базе из пары строк планировщик законно выбирает скан - смотреть
+нужно на заполненной базе.
+"""
+import argparse
+import random
+import sqlite3
+import sys
+import time
+
+from matchmaking import DOWN_SQL, UNRANKED_SQL, UP_SQL
+from migrations import migrate
+from search import SEARCH_SQL
+from storage import INVITE_HISTORY_OLDER_SQL
+
+# (название, SQL, параметры) - запросы из AlliesHub.py
+HOT_QUERIES = [
+    ('profile cache miss', 'SELECT * FROM users WHERE user_id IN (?, ?)', (1, 2)),
+    ('ban list load', 'SELECT user_id, ban_end FROM users WHERE is_banned = TRUE', ()),
+    ('ban expiry', '''
+        UPDATE users SET is_banned = FALSE, ban_end = NULL
+        WHERE is_banned = TRUE AND ban_end <= ?
+    ''', (0,)),
+    ('matchmaking down', DOWN_SQL,
+     {'game_id': 1, 'me': 1, 'from_tier': 10, 'from_user': 2 ** 63 - 1, 'limit': 20}),
+    ('matchmaking up', UP_SQL, {'game_id': 1, 'me': 1, 'from_tier': 10, 'from_user': 0, 'limit': 20}),
+    ('matchmaking unranked', UNRANKED_SQL, {'game_id': 1, 'me': 1, 'after': 0, 'limit': 20}),
+    ('description search', SEARCH_SQL,
+     {'query': '"микрофон"*', 'me': 1, 'score': float('-inf'), 'after': 0, 'limit': 6}),
+    ('game alias lookup', '''
+        SELECT g.id, g.name FROM game_aliases a JOIN games g ON g.id = a.game_id
+        WHERE a.alias = ?
+    ''', ('dota2',)),
+    ('game trigram lookup', '''
+        SELECT t.alias, a.game_id, COUNT(*) AS shared
+        FROM game_alias_trigrams t JOIN game_aliases a ON a.alias = t.alias
+        WHERE t.trigram IN (?, ?, ?)
+        GROUP BY t.alias
+        ORDER BY shared DESC
+        LIMIT 10
+    ''', ('  d', ' do', 'dot')),
+    ('invite_ pending check', '''
+        SELECT * FROM invites
+        WHERE from_user_id = ? AND to_user_id = ?
+        AND status = 'pending'
+    ''', (1, 2)),
+    ('accept_/decline_ update', '''
+        UPDATE invites SET status = 'accepted'
+        WHERE from_user_id = ? AND to_user_id = ?
+        AND status = 'pending'
+    ''', (1, 2)),
+    ('invite history page', INVITE_HISTORY_OLDER_SQL,
+     {'user_id': 1, 'ts': '9999-12-31 23:59:59', 'id': 0, 'limit': 11}),
+    ('invite expiry', '''
+        UPDATE invites SET status = 'expired'
+        WHERE id IN (
+            SELECT id FROM invites
+            WHERE status = 'pending' AND timestamp < ?
+            LIMIT ?
+        )
+    ''', ('2000-01-01 00:00:00', 1000)),
+    ('invite archive', '''
+        SELECT id FROM invites
+        WHERE status != 'pending' AND timestamp < ?
+        LIMIT ?
+    ''', ('2000-01-01 00:00:00', 1000)),
+    ('seen profiles', '''
+        SELECT started_at, count, bits, previous FROM seen_profiles WHERE user_id = ?
+    ''', (1,)),
+    ('report counter', '''
+        SELECT window_start, current, previous FROM report_counts WHERE reported_user_id = ?
+    ''', (1,)),
+    ('report dedup', '''
+        UPDATE reports SET timestamp = CURRENT_TIMESTAMP
+        WHERE reporter_user_id = ? AND reported_user_id = ?
+    ''', (1, 2)),
+]
+
+# Частичные индексы с заведомо маленьким набором строк: проход по ним целиком - не полный скан
+SMALL_PARTIAL_INDEXES = ('idx_users_ban_end',)
+
+GAMES = ['Dota 2', 'CS2', 'Valorant', 'League of Legends', 'Kenshi', 'Apex Legends', 'PUBG', 'Overwatch 2']
+
+
+def create_schema(conn: sqlite3.Connection) -> None:
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            game TEXT,
+            rank TEXT,
+            description TEXT,
+            is_searching BOOLEAN DEFAULT FALSE,
+            is_banned BOOLEAN DEFAULT FALSE,
+            ban_end DATETIME
+        );
+        CREATE TABLE IF NOT EXISTS invites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER,
+            to_user_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reported_user_id INTEGER,
+            reporter_user_id INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+
+
+def populate(conn: sqlite3.Connection, users: int, seed: int = 1) -> None:
+    if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]:
+        return
+    rnd = random.Random(seed)
+    started = time.perf_counter()
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO users (user_id, username, game, rank, description, is_searching, is_banned) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        ((uid, f'user{uid}', rnd.choice(GAMES), str(rnd.randint(1, 5000)), 'ищу тиммейта',
+          rnd.random() < 0.6, rnd.random() < 0.01) for uid in range(1, users + 1))
+    )
+    conn.executemany(
+        'INSERT INTO invites (from_user_id, to_user_id, status) VALUES (?, ?, ?)',
+        ((rnd.randint(1, users), rnd.randint(1, users), rnd.choice(('pending', 'accepted', 'rejected')))
+         for _ in range(users))
+    )
+    conn.executemany(
+        'INSERT INTO reports (reported_user_id, reporter_user_id) VALUES (?, ?)',
+        ((rnd.randint(1, users), rnd.randint(1, users)) for _ in range(users // 10))
+    )
+    conn.commit()
+    print(f'Сгенерировано {users} анкет за {time.perf_counter() - started:.1f} c')
+
+
+def explain(conn: sqlite3.Connection) -> bool:
+    ok = True
+    for name, sql, params in HOT_QUERIES:
+        plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        print(f'== {name}')
+        subqueries = {detail.split()[1] for _, _, _, detail in plan if detail.startswith('CO-ROUTINE')}
+        for _, _, _, detail in plan:
+            # "SCAN" без индекса (и "SCAN ... USING COVERING INDEX") - полный проход
+            # Проход по результату подзапроса с LIMIT (части UNION, в том числе с
+            # псевдонимом) тоже не скан таблицы, как и обход FTS5 по MATCH ("VIRTUAL TABLE INDEX 0:M...")
+            scan = (detail.startswith('SCAN') and 'CONSTANT ROW' not in detail
+                    and not detail.startswith('SCAN (subquery')
+                    and detail.split()[1] not in subqueries
+                    and 'VIRTUAL TABLE INDEX 0:M' not in detail
+                    and not any(f'INDEX {index}' in detail for index in SMALL_PARTIAL_INDEXES))
+            ok = ok and not scan
+            print(('  !! ' if scan else '     ') + detail)
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db', nargs='?', default='allies.db')
+    parser.add_argument('--users', type=int, default=0, help='заполнить пустую базу синтетическими анкетами')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.users:
+        create_schema(conn)
+        populate(conn, args.users)
+    migrate(conn)
+
+    ok = explain(conn)
+    print('OK: полных сканов нет' if ok else 'FAIL: есть полные сканы')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
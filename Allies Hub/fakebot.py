@@ -0,0 +1,109 @@
+import itertools
+import json
+import threading
+import time
+
+from telegram import Bot, Update
+
+from callbacks import decode
+
+# Бот без сети для бенчмарков и локальных прогонов: настоящий telegram.Bot,
+# у которого вызовы API не уходят в Telegram, а записываются в calls
+# и получают правдоподобный ответ. UpdateFactory собирает входящие обновления.
+
+
+class FakeBot(Bot):
+    """Записывает вызовы Bot API: calls - список (метод, параметры),
+    replies - последнее отправленное или измененное сообщение по chat_id.
+
+    record_calls=False - только replies и счетчик count (для долгих прогонов).
+    """
+
+    def __init__(self, token: str = '123456:fake', record_calls: bool = True):
+        super().__init__(token)
+        object.__setattr__(self, 'calls', [])
+        object.__setattr__(self, 'replies', {})
+        object.__setattr__(self, 'count', 0)
+        object.__setattr__(self, 'record_calls', record_calls)
+        object.__setattr__(self, '_calls_lock', threading.Lock())
+        object.__setattr__(self, '_message_ids', itertools.count(1))
+
+    def _post(self, endpoint: str, data=None, timeout=None, api_kwargs=None):
+        data = dict(data or {})
+        with self._calls_lock:
+            self.count += 1
+            if self.record_calls:
+                self.calls.append((endpoint, data))
+            if endpoint in ('sendMessage', 'editMessageText'):
+                self.replies[data.get('chat_id')] = data
+        if endpoint == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'Allies Hub', 'username': 'allies_hub_bot'}
+        if endpoint in ('sendMessage', 'editMessageText'):
+            return {
+                'message_id': data.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': data.get('chat_id'), 'type': 'private'},
+                'text': data.get('text'),
+            }
+        return True
+
+    def take_calls(self) -> list:
+        with self._calls_lock:
+            calls = list(self.calls)
+            self.calls.clear()
+        return calls
+
+
+def button_arg(reply: dict, action: str):
+    """Аргумент кнопки action в отправленном сообщении (replies/calls) или None."""
+    markup = (reply or {}).get('reply_markup')
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    for row in (markup or {}).get('inline_keyboard', ()):
+        for button in row:
+            decoded = decode(button.get('callback_data') or '')
+            if decoded and decoded[0] == action and decoded[1]:
+                return decoded[1][0]
+    return None
+
+
+class UpdateFactory:
+    """Входящие обновления от имени пользователей (личный чат, chat_id = user_id)."""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'}
+
+    def message(self, user_id: int, text: str) -> Update:
+        update_id = next(self._ids)
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': update_id, 'message': message}, self.bot)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = next(self._ids)
+        return Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'from': self._user(user_id),
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': '...',
+                },
+            },
+        }, self.bot)
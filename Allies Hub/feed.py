@@ -0,0 +1,199 @@
+import logging
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# next() вместо анкеты: прочитано max_scan подряд, все просмотрено, а лента
+# не кончилась - дозагрузка читает дальше в фоне, ответ "ищем" вместо "нет анкет"
+LOADING = 'loading'
+
+
+class _UserFeed:
+    __slots__ = ('queue', 'cursor', 'last_shown', 'exhausted', 'expires', 'generation', 'refilling')
+
+    def __init__(self):
+        self.queue = deque()
+        self.cursor = 0        # user_id последней загруженной анкеты
+        self.last_shown = 0    # user_id последней выданной анкеты
+        self.exhausted = False
+        self.expires = 0.0
+        self.generation = 0
+        self.refilling = False
+
+
+class CandidateFeed:
+    """Очередь кандидатов на пользователя, заполняемая пачками.
+
+    fetch(user_id, after_user_id, limit) -> [profile, ...] - анкеты для
+    user_id, идущие в порядке подбора после анкеты after_user_id (0 - с
+    начала). Блокировку смотрящего проверяет вызывающий код.
+
+    seen - SeenProfiles (seen.py): анкета, после которой нажали "следующая",
+    считается просмотренной и больше не выдается. Просмотренные отсеиваются
+    после чтения; пачки при этом растут, но за одну загрузку читается не
+    больше max_scan строк. Если все они просмотрены, next() возвращает
+    LOADING, а дозагрузка читает дальше, пока не найдет анкету или не
+    выйдет scan_budget секунд. Лента с начала (after_user_id = 0)
+    продолжается с курсора seen, а дойдя до конца, возвращается к началу.
+    """
+
+    def __init__(self, fetch, batch_size=20, low_watermark=5, ttl=120.0, max_users=10000, seen=None,
+                 max_scan=500, scan_budget=0.5):
+        self._fetch = fetch
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.ttl = ttl
+        self.max_users = max_users
+        self.max_scan = max_scan
+        self.scan_budget = scan_budget
+        self._seen = seen
+        self._feeds = OrderedDict()
+        self._hidden = {}  # user_id -> время, когда анкету убрали из выдачи
+        self._lock = threading.Lock()
+        self._generations = itertools.count(1)
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='feed-refill')
+
+    def next(self, user_id: int, after_user_id: int = 0):
+        """Возвращает следующую анкету после after_user_id, LOADING или None - анкет нет."""
+        now = time.monotonic()
+        seen = self._seen
+        if seen is not None and after_user_id:
+            seen.add(user_id, after_user_id)
+            seen.set_cursor(user_id, after_user_id)
+        with self._lock:
+            feed = self._feeds.get(user_id)
+            # Курсор из кнопки не совпал (старое сообщение, рестарт) - читаем заново
+            if feed is None or feed.expires < now or feed.last_shown != after_user_id:
+                feed = None
+            else:
+                self._feeds.move_to_end(user_id)
+                profile = self._pop(feed)
+                if profile is not None:
+                    self._schedule_refill(user_id, feed)
+                    return profile
+
+        start = after_user_id
+        if seen is not None and not after_user_id:
+            # "Продолжить поиск": с места, где остановились, а не с первой анкеты
+            start = seen.cursor(user_id)
+        rows, cursor, exhausted = self._load(user_id, start)
+        if seen is not None and not rows and exhausted and not after_user_id:
+            if start:
+                # Конец ленты - в начале могли появиться новые анкеты
+                rows, cursor, exhausted = self._load(user_id, 0)
+            if not rows and exhausted and seen.recycle:
+                # Просмотрено все - лента начинается заново
+                seen.reset(user_id)
+                rows, cursor, exhausted = self._load(user_id, 0)
+        loading = seen is not None and not rows and not exhausted
+        if loading:
+            # max_scan просмотренных подряд: дальше продолжит дозагрузка, а после перерыва - отсюда
+            seen.set_cursor(user_id, cursor)
+        with self._lock:
+            # Ничего не показано: "Продолжить поиск" (after_user_id = 0) заберет найденное дозагрузкой
+            feed = self._reset(user_id, 0 if loading else after_user_id, rows, cursor, exhausted, now)
+            profile = self._pop(feed)
+            self._schedule_refill(user_id, feed)
+            return LOADING if loading else profile
+
+    def invalidate(self, user_id: int, rewind: bool = False) -> None:
+        """Сбрасывает очередь пользователя (сменил игру, забанен и т.п.).
+
+        rewind - порядок ленты другой (игра, ранг): курсор seen в начало.
+        """
+        with self._lock:
+            self._feeds.pop(user_id, None)
+        if rewind and self._seen is not None:
+            self._seen.set_cursor(user_id, 0)
+
+    def hide(self, user_id: int) -> None:
+        """Убирает анкету из всех очередей: забанена или перестала искать."""
+        with self._lock:
+            self._hidden[user_id] = time.monotonic()
+
+    def unhide(self, user_id: int) -> None:
+        with self._lock:
+            self._hidden.pop(user_id, None)
+
+    def _load(self, user_id, after_user_id):
+        # -> (непросмотренные анкеты, курсор, кончилась ли лента); курсор -
+        # последняя прочитанная анкета, в том числе просмотренная
+        rows, cursor, limit, scanned = [], after_user_id, self.batch_size, 0
+        while True:
+            batch = self._fetch(user_id, cursor, limit)
+            scanned += len(batch)
+            if batch:
+                cursor = batch[-1][0]
+            rows.extend(batch if self._seen is None else self._seen.unseen(user_id, batch))
+            if len(batch) < limit:
+                return rows, cursor, True
+            if len(rows) >= self.batch_size or scanned >= self.max_scan:
+                return rows, cursor, False
+            limit = min(limit * 2, self.max_scan - scanned)
+
+    def _reset(self, user_id, after_user_id, rows, cursor, exhausted, now):
+        feed = self._feeds.pop(user_id, None) or _UserFeed()
+        feed.generation = next(self._generations)
+        feed.queue = deque(rows)
+        feed.cursor = cursor
+        feed.last_shown = after_user_id
+        feed.exhausted = exhausted
+        feed.expires = now + self.ttl
+        feed.refilling = False
+        self._feeds[user_id] = feed
+        while len(self._feeds) > self.max_users:
+            self._feeds.popitem(last=False)
+        self._prune_hidden(now)
+        return feed
+
+    def _pop(self, feed):
+        while feed.queue:
+            profile = feed.queue.popleft()
+            if profile[0] not in self._hidden:
+                feed.last_shown = profile[0]
+                return profile
+        return None
+
+    def _schedule_refill(self, user_id, feed):
+        if feed.refilling or feed.exhausted or len(feed.queue) > self.low_watermark:
+            return
+        feed.refilling = True
+        self._executor.submit(self._refill, user_id, feed.generation, feed.cursor)
+
+    def _refill(self, user_id, generation, cursor):
+        deadline = time.monotonic() + self.scan_budget
+        try:
+            while True:
+                rows, cursor, exhausted = self._load(user_id, cursor)
+                # Только просмотренные - читаем дальше, пока есть время
+                if rows or exhausted or self._seen is None or time.monotonic() >= deadline:
+                    break
+        except Exception:
+            logger.exception("Не удалось дозагрузить анкеты для %s", user_id)
+            rows = None
+        with self._lock:
+            feed = self._feeds.get(user_id)
+            # Очередь успели сбросить - результат устарел
+            if feed is None or feed.generation != generation:
+                return
+            feed.refilling = False
+            if rows is None:
+                return
+            feed.queue.extend(rows)
+            feed.cursor = cursor
+            feed.exhausted = exhausted
+            # Ничего не показано и все прочитанное просмотрено - продолжать отсюда
+            advance = self._seen is not None and not feed.queue and not feed.last_shown
+        if advance:
+            self._seen.set_cursor(user_id, cursor)
+
+    def _prune_hidden(self, now):
+        # Очереди старше ttl уже перечитаны из базы, старые отметки не нужны
+        if len(self._hidden) > self.max_users:
+            for user_id, hidden_at in list(self._hidden.items()):
+                if now - hidden_at > self.ttl:
+                    del self._hidden[user_id]
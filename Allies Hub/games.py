@@ -0,0 +1,170 @@
+"""Каталог игр: канонические игры с целыми id и их варианты написания.
+
+    python games.py list
+    python games.py add "Path of Exile 2" poe2 "пое 2"   # новая игра с алиасами
+    python games.py alias "Dota 2" доту                   # алиас существующей игры
+
+Алиас хранится нормализованным (casefold, только буквы и цифры), для
+нечеткого поиска по нему строится индекс триграмм. Бот только ищет в
+каталоге (resolve_game); игры и алиасы добавляются явно - этой командой,
+сидом и миграциями. База - как у бота (ALLIES_DATABASE_URL или allies.db).
+"""
+import argparse
+import re
+import sqlite3
+
+SIMILARITY_THRESHOLD = 0.6
+
+SEED_GAMES = {
+    'Dota 2': ['dota', 'дота', 'дота 2', 'дота2'],
+    'Counter-Strike 2': ['cs2', 'cs 2', 'cs', 'кс', 'кс2', 'кс 2', 'counter strike', 'контр страйк 2'],
+    'Valorant': ['valo', 'валорант', 'валик'],
+    'League of Legends': ['lol', 'лол', 'league', 'лига легенд'],
+    'Apex Legends': ['apex', 'апекс', 'апекс легендс'],
+    'PUBG: Battlegrounds': ['pubg', 'пабг', 'пубг'],
+    'Overwatch 2': ['ow2', 'ow 2', 'overwatch', 'овервотч'],
+    'Fortnite': ['фортнайт'],
+    'Minecraft': ['майнкрафт', 'майн'],
+    'Rainbow Six Siege': ['r6', 'r6s', 'rainbow six', 'радуга'],
+    'Rocket League': ['рокет лига'],
+    'World of Tanks': ['wot', 'танки'],
+    'Genshin Impact': ['genshin', 'геншин'],
+    'Deadlock': ['дедлок'],
+}
+
+
+def normalize(text: str) -> str:
+    text = text.casefold().replace('ё', 'е')
+    return ''.join(ch for ch in text if ch.isalnum())
+
+
+def trigrams(alias: str) -> set:
+    # С отступами, чтобы начало слова весило больше (как в pg_trgm)
+    padded = f'  {alias} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _numbers(alias: str) -> list:
+    return re.findall(r'\d+', alias)
+
+
+def add_alias(conn: sqlite3.Connection, game_id: int, text: str) -> None:
+    alias = normalize(text)
+    if not alias:
+        return
+    # SQL каталога одинаков для SQLite и PostgreSQL (storage.py)
+    if conn.execute('INSERT INTO game_aliases (alias, game_id) VALUES (?, ?) ON CONFLICT DO NOTHING',
+                    (alias, game_id)).rowcount:
+        conn.executemany('INSERT INTO game_alias_trigrams (trigram, alias) VALUES (?, ?) ON CONFLICT DO NOTHING',
+                         ((trigram, alias) for trigram in trigrams(alias)))
+
+
+def add_game(conn: sqlite3.Connection, name: str, aliases=()) -> int:
+    conn.execute('INSERT INTO games (name) VALUES (?)', (name,))
+    game_id = conn.execute('SELECT id FROM games WHERE name = ?', (name,)).fetchone()[0]
+    for alias in (name, *aliases):
+        add_alias(conn, game_id, alias)
+    return game_id
+
+
+def seed(conn: sqlite3.Connection) -> None:
+    for name, aliases in SEED_GAMES.items():
+        row = conn.execute('SELECT game_id FROM game_aliases WHERE alias = ?', (normalize(name),)).fetchone()
+        if row is None:
+            add_game(conn, name, aliases)
+
+
+def find_game(conn: sqlite3.Connection, text: str):
+    """(game_id, название) по вводу пользователя или None."""
+    alias = normalize(text)
+    if not alias:
+        return None
+    row = conn.execute('''
+        SELECT g.id, g.name FROM game_aliases a JOIN games g ON g.id = a.game_id
+        WHERE a.alias = ?
+    ''', (alias,)).fetchone()
+    if row:
+        return row
+
+    # Нечеткий поиск: алиасы с наибольшим числом общих триграмм, затем коэффициент Дайса.
+    # Номера частей должны совпадать, иначе "Battlefield 1" склеится с "Battlefield 4".
+    query = trigrams(alias)
+    placeholders = ', '.join('?' * len(query))
+    candidates = conn.execute(f'''
+        SELECT t.alias, a.game_id, COUNT(*) AS shared
+        FROM game_alias_trigrams t JOIN game_aliases a ON a.alias = t.alias
+        WHERE t.trigram IN ({placeholders})
+        GROUP BY t.alias, a.game_id
+        ORDER BY shared DESC
+        LIMIT 10
+    ''', tuple(query)).fetchall()
+    best, best_score = None, SIMILARITY_THRESHOLD
+    for candidate, game_id, shared in candidates:
+        score = 2 * shared / (len(query) + len(trigrams(candidate)))
+        if score >= best_score and _numbers(candidate) == _numbers(alias):
+            best, best_score = game_id, score
+    if best is None:
+        return None
+    return conn.execute('SELECT id, name FROM games WHERE id = ?', (best,)).fetchone()
+
+
+def resolve_game(conn: sqlite3.Connection, text: str):
+    """Приводит ввод к канонической игре каталога: (game_id, название) или None.
+
+    Только чтение: неизвестная игра не добавляется, написание не запоминается
+    (нечеткое совпадение может быть ошибкой) - для этого add_game и add_alias.
+    """
+    text = text.strip()
+    return find_game(conn, text) or conn.execute('SELECT id, name FROM games WHERE name = ?', (text,)).fetchone()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='игры и их алиасы')
+    add = commands.add_parser('add', help='новая игра')
+    add.add_argument('name')
+    add.add_argument('aliases', nargs='*')
+    alias = commands.add_parser('alias', help='алиасы существующей игры')
+    alias.add_argument('game', help='название или алиас игры')
+    alias.add_argument('aliases', nargs='+')
+    args = parser.parse_args()
+
+    import storage  # storage импортирует этот модуль
+
+    store = storage.open_storage(storage.DATABASE_URL)
+    store.init_schema()
+    try:
+        if args.command == 'list':
+            with store.reading() as conn:
+                rows = conn.execute('''
+                    SELECT g.name, a.alias FROM games g JOIN game_aliases a ON a.game_id = g.id
+                    ORDER BY g.name, a.alias
+                ''').fetchall()
+            aliases = {}
+            for name, alias_text in rows:
+                aliases.setdefault(name, []).append(alias_text)
+            for name, names in aliases.items():
+                print(f'{name}: {", ".join(names)}')
+            return
+
+        with store.transaction() as conn:
+            if args.command == 'add':
+                found = resolve_game(conn, args.name)
+                if found is not None:
+                    parser.error(f"Игра уже есть в каталоге: {found[1]}")
+                game_id, name = store.add_game(conn, args.name.strip(), args.aliases), args.name.strip()
+            else:
+                found = resolve_game(conn, args.game)
+                if found is None:
+                    parser.error(f"Нет в каталоге: {args.game}")
+                game_id, name = found
+                for text in args.aliases:
+                    store.add_alias(conn, game_id, text)
+        print(f'{name} (id {game_id})')
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import logging
+import secrets
+import threading
+import time
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Как часто процесс забирает чужие изменения и сколько секунд хранить строки
+POLL_INTERVAL = 1.0
+KEEP_SECONDS = 600
+
+
+class Invalidations:
+    """Сбросы кэшей между процессами (воркеры router.py) через таблицу invalidations.
+
+    Процесс, изменивший анкету, сам сбрасывает свои кэши и пишет строку
+    record(conn, user_id, kind) в той же транзакции, что и изменение.
+    Остальные раз в interval секунд забирают строки с id больше последнего
+    увиденного и вызывают apply(user_id, kind, ban_end): чужое изменение
+    доходит до их кэшей не позже чем через interval после коммита.
+
+    Пока процесс один (enabled=False), строки не пишутся и не читаются.
+    """
+
+    def __init__(self, apply, enabled: bool = False, interval: float = POLL_INTERVAL,
+                 keep: float = KEEP_SECONDS, store=None):
+        self._apply = apply
+        self._store = store or storage.get_storage()
+        self.enabled = enabled
+        self.interval = interval
+        self.keep = keep
+        # Свои строки при чтении пропускаются: их кэши уже сброшены
+        self.origin = secrets.token_hex(8)
+        self._last_id = 0
+        self._pruned = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self.applied = 0
+
+    def record(self, conn, user_id: int, kind: str, ban_end: int = None) -> None:
+        if self.enabled:
+            self._store.invalidation_add(conn, user_id, kind, ban_end, self.origin, time.time())
+
+    def start(self) -> None:
+        # Кэши нового процесса пусты: старые строки ему не нужны
+        self._last_id = self._store.invalidations_last_id()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='invalidations', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def poll(self) -> int:
+        """Применяет чужие изменения, записанные после прошлого вызова."""
+        # id растут в порядке фиксации (storage.invalidation_add)
+        rows = self._store.invalidations_after(self._last_id)
+        applied = 0
+        for row_id, user_id, kind, ban_end, origin in rows:
+            self._last_id = row_id
+            if origin != self.origin:
+                self._apply(user_id, kind, ban_end)
+                applied += 1
+        self.applied += applied
+        return applied
+
+    def prune(self, now: float = None) -> None:
+        now = time.time() if now is None else now
+        self._store.invalidations_prune(now - self.keep)
+        self._pruned = now
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+                if time.time() - self._pruned > self.keep / 10:
+                    self.prune()
+            except Exception:
+                logger.exception("Не удалось применить изменения других процессов")
@@ -0,0 +1,50 @@
+"""Обслуживание базы бота, которое нельзя делать на ходу.
+
+    python maintenance.py vacuum    # полное сжатие; бот должен быть остановлен
+    python maintenance.py compact   # вернуть файлу место удаленных строк сейчас
+
+vacuum в SQLite переписывает файл целиком и заодно переводит его на
+auto_vacuum = INCREMENTAL (нужно один раз для баз, созданных до архива
+инвайтов), в PostgreSQL - VACUUM FULL всей базы. Обе операции держат
+эксклюзивную блокировку всё время работы, поэтому бот их сам не запускает.
+compact то же, что бот делает после архивации: по частям и без остановки.
+База - как у бота (ALLIES_DATABASE_URL или allies.db).
+"""
+import argparse
+import logging
+import os
+import time
+
+import db
+import storage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('vacuum', help='полное сжатие при остановленном боте')
+    commands.add_parser('compact', help='вернуть место удаленных строк')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    store = storage.open_storage(storage.DATABASE_URL)
+    try:
+        size = os.path.getsize(db.DB_PATH) if store.name == 'sqlite' else None
+        started = time.perf_counter()
+        if args.command == 'vacuum':
+            # Схема не нужна: сжимается то, что есть, и init_schema уже не
+            # предупреждает о режиме auto_vacuum
+            store.vacuum()
+            store.init_schema()
+        else:
+            store.init_schema()
+            print(f'Освобождено страниц: {store.compact()}')
+        if size is not None:
+            print(f'{db.DB_PATH}: {size / 2 ** 20:.1f} -> {os.path.getsize(db.DB_PATH) / 2 ** 20:.1f} МБ')
+        print(f'Готово за {time.perf_counter() - started:.1f} c')
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
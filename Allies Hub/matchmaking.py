@@ -0,0 +1,106 @@
+import sqlite3
+
+# Подбор по близости тира: два встречных обхода индекса (game_id, tier, user_id)
+# от тира смотрящего - вниз и вверх, которые сливаются по расстоянию.
+# Каждый обход идет в порядке индекса, поэтому сортировки нет, и читается
+# не больше limit строк с каждой стороны. Анкеты без тира идут в конце.
+#
+# Порядок выдачи: (расстояние, сначала нижняя сторона, user_id - вниз по
+# убыванию, вверх по возрастанию). Курсор - последняя выданная анкета.
+
+MAX_USER_ID = 2 ** 63 - 1
+
+_FILTER = '''
+    FROM users
+    WHERE game_id = :game_id
+    AND is_searching = TRUE
+    AND is_banned = FALSE
+    AND user_id != :me
+'''
+
+# Половина обхода от курсора (from_tier, from_user): остаток его тира и дальние
+# тиры - отдельными диапазонами индекса. Одно сравнение (tier, user_id) < (...)
+# планировщик ограничивает только по tier и перебирает весь тир курсора.
+_STREAM_SQL = '''
+    SELECT * FROM (
+        SELECT tier AS sort_tier, * {filter}
+        AND tier = :from_tier AND user_id {op} :from_user
+        ORDER BY user_id {order}
+        LIMIT :limit
+    ) AS same_tier
+    UNION ALL
+    SELECT * FROM (
+        SELECT tier AS sort_tier, * {filter}
+        AND tier {op} :from_tier
+        ORDER BY tier {order}, user_id {order}
+        LIMIT :limit
+    ) AS next_tiers
+    ORDER BY sort_tier {order}, user_id {order}
+    LIMIT :limit
+'''
+DOWN_SQL = _STREAM_SQL.format(filter=_FILTER, op='<', order='DESC')
+UP_SQL = _STREAM_SQL.format(filter=_FILTER, op='>', order='ASC')
+
+UNRANKED_SQL = f'''
+    SELECT tier, * {_FILTER}
+    AND tier IS NULL
+    AND user_id > :after
+    ORDER BY user_id
+    LIMIT :limit
+'''
+
+# Смотрящий без тира: просто по user_id (индекс idx_users_game_id_searching)
+PLAIN_SQL = f'''
+    SELECT tier, * {_FILTER}
+    AND user_id > :after
+    ORDER BY user_id
+    LIMIT :limit
+'''
+
+VIEWER_SQL = '''
+    SELECT me.game_id, me.tier, (SELECT tier FROM users WHERE user_id = :after)
+    FROM users me
+    WHERE me.user_id = :me
+'''
+
+
+def nearest_candidates(conn: sqlite3.Connection, user_id: int, after_user_id: int = 0, limit: int = 20) -> list:
+    """Анкеты игры user_id по возрастанию расстояния тира, после анкеты after_user_id."""
+    viewer = conn.execute(VIEWER_SQL, {'me': user_id, 'after': after_user_id}).fetchone()
+    if viewer is None or viewer[0] is None:
+        return []
+    game_id, tier, after_tier = viewer
+    params = {'game_id': game_id, 'me': user_id, 'limit': limit}
+
+    if tier is None:
+        return [row[1:] for row in conn.execute(PLAIN_SQL, dict(params, after=after_user_id))]
+
+    rows = []
+    if not after_user_id or after_tier is not None:
+        if not after_user_id:
+            down_from, up_from = (tier, MAX_USER_ID), (tier, MAX_USER_ID)
+        elif after_tier <= tier:
+            # Курсор снизу на расстоянии d: вверху остались тиры от tier + d
+            distance = tier - after_tier
+            down_from, up_from = (after_tier, after_user_id), (max(tier + distance, tier + 1), 0)
+        else:
+            # Курсор сверху: внизу остались тиры дальше, чем он
+            distance = after_tier - tier
+            down_from, up_from = (tier - distance, 0), (after_tier, after_user_id)
+
+        down = conn.execute(DOWN_SQL, dict(params, from_tier=down_from[0], from_user=down_from[1])).fetchall()
+        up = conn.execute(UP_SQL, dict(params, from_tier=up_from[0], from_user=up_from[1])).fetchall()
+        i = j = 0
+        while len(rows) < limit and (i < len(down) or j < len(up)):
+            if j == len(up) or (i < len(down) and tier - down[i][0] <= up[j][0] - tier):
+                rows.append(down[i][1:])
+                i += 1
+            else:
+                rows.append(up[j][1:])
+                j += 1
+        after_user_id = 0
+
+    if len(rows) < limit:
+        unranked = conn.execute(UNRANKED_SQL, dict(params, after=after_user_id, limit=limit - len(rows)))
+        rows.extend(row[1:] for row in unranked)
+    return rows
@@ -0,0 +1,335 @@
+import bisect
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.ext import ConversationHandler
+from telegram.utils.request import Request
+
+from callbacks import action_name
+
+logger = logging.getLogger(__name__)
+
+# Метрики процесса в памяти: гистограммы времени обработчиков, запросов
+# к базе и вызовов Telegram. Отдаются в формате Prometheus локальным
+# HTTP-эндпоинтом (MetricsServer) и сводкой для команды /stats.
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Больше стольких значений метки в семействе не заводим - остальное идет в 'other'
+# (callback_data присылает клиент, его можно подделать)
+MAX_SERIES = 200
+OTHER = 'other'
+# Запросы к базе дольше этого пишутся в лог
+SLOW_QUERY_SECONDS = float(os.environ.get('ALLIES_SLOW_QUERY_MS', 100)) / 1000
+
+
+class Histogram:
+    """Одна серия: счетчики по корзинам, сумма и число наблюдений."""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)  # последняя - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def quantile(self, bounds, q: float) -> float:
+        # Оценка по корзинам с линейной интерполяцией, как histogram_quantile
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(bounds):
+                    return bounds[-1]
+                lower = bounds[i - 1] if i else 0.0
+                return lower + (bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return bounds[-1]
+
+
+class HistogramFamily:
+    def __init__(self, name: str, help: str, label: str, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: str, seconds: float) -> None:
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                if len(self._series) >= MAX_SERIES:
+                    value = OTHER
+                series = self._series.setdefault(value, Histogram(len(self.buckets)))
+            series.counts[i] += 1
+            series.sum += seconds
+            series.count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {value: (list(s.counts), s.sum, s.count) for value, s in self._series.items()}
+
+    def top(self, limit: int):
+        """Самые затратные серии по суммарному времени: (значение, число, сумма, p50, p99)."""
+        with self._lock:
+            rows = [(value, s.count, s.sum, s.quantile(self.buckets, 0.5), s.quantile(self.buckets, 0.99))
+                    for value, s in self._series.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:limit]
+
+    def render(self, out: list) -> None:
+        out.append(f'# HELP {self.name} {self.help}')
+        out.append(f'# TYPE {self.name} histogram')
+        for value, (counts, total, count) in sorted(self.snapshot().items()):
+            label = f'{self.label}="{_escape(value)}"'
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                out.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            out.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+            out.append(f'{self.name}_sum{{{label}}} {total}')
+            out.append(f'{self.name}_count{{{label}}} {count}')
+
+
+class CounterFamily:
+    def __init__(self, name: str, help: str, label: str):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: str) -> None:
+        with self._lock:
+            if value not in self._values and len(self._values) >= MAX_SERIES:
+                value = OTHER
+            self._values[value] = self._values.get(value, 0) + 1
+
+    def render(self, out: list) -> None:
+        with self._lock:
+            values = sorted(self._values.items())
+        out.append(f'# HELP {self.name} {self.help}')
+        out.append(f'# TYPE {self.name} counter')
+        for value, n in values:
+            out.append(f'{self.name}{{{self.label}="{_escape(value)}"}} {n}')
+
+
+class Gauge:
+    """Значение, которое читается в момент выдачи метрик (длина очереди и т.п.)."""
+
+    def __init__(self, name: str, help: str, read, kind: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def render(self, out: list) -> None:
+        try:
+            value = self.read()
+        except Exception:
+            logger.exception("Метрика %s не прочитана", self.name)
+            return
+        out.append(f'# HELP {self.name} {self.help}')
+        out.append(f'# TYPE {self.name} {self.kind}')
+        out.append(f'{self.name} {value}')
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            if metric.name in self._names:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._names.add(metric.name)
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, label: str) -> HistogramFamily:
+        return self._add(HistogramFamily(name, help, label))
+
+    def counter(self, name: str, help: str, label: str) -> CounterFamily:
+        return self._add(CounterFamily(name, help, label))
+
+    def gauge(self, name: str, help: str, read, kind: str = 'gauge') -> Gauge:
+        return self._add(Gauge(name, help, read, kind))
+
+    def render(self) -> str:
+        out = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            metric.render(out)
+        return '\n'.join(out) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+handler_seconds = registry.histogram('allies_handler_seconds', 'Время работы обработчика', 'handler')
+handler_errors = registry.counter('allies_handler_errors_total', 'Исключения в обработчиках', 'handler')
+callback_seconds = registry.histogram('allies_callback_seconds', 'Время обработки кнопки по действию',
+                                      'action')
+sql_seconds = registry.histogram('allies_sql_seconds', 'Время выполнения оператора SQL (SELECT - до первой строки)',
+                                 'statement')
+slow_queries = registry.counter('allies_slow_queries_total', 'Операторы SQL дольше порога', 'statement')
+telegram_seconds = registry.histogram('allies_telegram_seconds', 'Время вызова Bot API', 'method')
+
+
+# Метка кнопки - действие из callback_data ('1n.2n9c' и 'next_123' -> 'next')
+def callback_action(data: str) -> str:
+    return action_name(data or '') or OTHER
+
+
+# Обработчики
+
+def timed(callback, name: str = None):
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            handler_seconds.observe(name, elapsed)
+            query = getattr(update, 'callback_query', None)
+            if query is not None:
+                callback_seconds.observe(callback_action(query.data), elapsed)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def _instrument(handler) -> None:
+    if isinstance(handler, ConversationHandler):
+        for nested in handler.entry_points + handler.fallbacks:
+            _instrument(nested)
+        for handlers in handler.states.values():
+            for nested in handlers:
+                _instrument(nested)
+    elif not getattr(handler.callback, 'timed', False):
+        handler.callback = timed(handler.callback)
+
+
+def instrument_handlers(dispatcher) -> None:
+    """Оборачивает все зарегистрированные обработчики (и внутри ConversationHandler)."""
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            _instrument(handler)
+
+
+# База
+
+@functools.lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    # Один оператор - одна серия: списки (?, ?, ...) разной длины схлопываются
+    sql = ' '.join(sql.split())
+    return re.sub(r'\?(\s*,\s*\?)+', '?, ...', sql)
+
+
+def observe_query(sql: str, seconds: float) -> None:
+    label = statement_label(sql)
+    sql_seconds.observe(label, seconds)
+    if seconds >= SLOW_QUERY_SECONDS:
+        slow_queries.inc(label)
+        logger.warning("Медленный запрос %.1f мс: %s", seconds * 1000, label)
+
+
+# Telegram
+
+class TimedRequest(Request):
+    """Request для Bot: время каждого вызова API по имени метода."""
+
+    def post(self, url: str, data, timeout: float = None):
+        started = time.perf_counter()
+        try:
+            return super().post(url, data, timeout)
+        finally:
+            telegram_seconds.observe(url.rsplit('/', 1)[-1], time.perf_counter() - started)
+
+
+# Выдача
+
+def format_stats(limit: int = 8) -> str:
+    """Сводка для /stats: самые затратные обработчики, кнопки, запросы и вызовы API."""
+    lines = []
+    for title, family in (("Обработчики", handler_seconds), ("Кнопки", callback_seconds),
+                          ("SQL", sql_seconds), ("Telegram API", telegram_seconds)):
+        rows = family.top(limit)
+        if not rows:
+            continue
+        lines.append(f"{title} (число, всего / p50 / p99, мс):")
+        for value, count, total, p50, p99 in rows:
+            value = value if len(value) <= 60 else value[:57] + '...'
+            lines.append(f"  {value}: {count}, {total * 1000:.1f} / {p50 * 1000:.2f} / {p99 * 1000:.2f}")
+    return '\n'.join(lines) or "Метрик пока нет"
+
+
+class MetricsServer:
+    """GET /metrics в текстовом формате Prometheus. Слушать стоит только локальный адрес."""
+
+    def __init__(self, registry: Registry = registry, host: str = '127.0.0.1', port: int = 9100,
+                 path: str = '/metrics'):
+        self.registry = registry
+        self.path = path
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+        logger.info("Метрики: http://%s:%s%s", *self.address, self.path)
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != server.path:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = server.registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,381 @@
+import logging
+import sqlite3
+from datetime import datetime
+
+from games import add_game, resolve_game, seed as seed_games
+from ranks import parse_rank
+
+logger = logging.getLogger(__name__)
+
+
+def _ban_end_to_epoch(conn: sqlite3.Connection) -> None:
+    # ban_end хранился строкой локального времени "%Y-%m-%d %H:%M:%S".
+    # Тип колонки в SQLite не поменять, но значения теперь целые (epoch).
+    rows = conn.execute("SELECT user_id, ban_end FROM users WHERE typeof(ban_end) = 'text'").fetchall()
+    for user_id, ban_end in rows:
+        epoch = int(datetime.strptime(ban_end, "%Y-%m-%d %H:%M:%S").timestamp())
+        conn.execute('UPDATE users SET ban_end = ? WHERE user_id = ?', (epoch, user_id))
+
+
+def _backfill_game_ids(conn: sqlite3.Connection) -> None:
+    # Каждое различное написание игры приводим к канонической игре один раз,
+    # затем проставляем game_id и каноническое название одним UPDATE.
+    # Игру, которой нет в каталоге, старые анкеты сохраняют - добавляем ее
+    seed_games(conn)
+    conn.execute('CREATE TEMP TABLE game_map (game TEXT PRIMARY KEY, game_id INTEGER, name TEXT)')
+    for (game,) in conn.execute('SELECT DISTINCT game FROM users WHERE game IS NOT NULL').fetchall():
+        found = resolve_game(conn, game)
+        if found is None:
+            found = add_game(conn, game.strip()), game.strip()
+        conn.execute('INSERT INTO temp.game_map VALUES (?, ?, ?)', (game, *found))
+    conn.execute('''
+        UPDATE users SET (game_id, game) = (SELECT game_id, name FROM temp.game_map m WHERE m.game = users.game)
+        WHERE game IS NOT NULL
+    ''')
+    conn.execute('DROP TABLE temp.game_map')
+
+
+def _backfill_tiers(conn: sqlite3.Connection) -> None:
+    rows = conn.execute('SELECT user_id, game, rank FROM users WHERE rank IS NOT NULL').fetchall()
+    conn.executemany('UPDATE users SET tier = ? WHERE user_id = ?',
+                     ((parse_rank(game, rank), user_id) for user_id, game, rank in rows))
+
+# Версионные миграции схемы.
+# Текущая версия хранится в PRAGMA user_version, каждая миграция применяется
+# один раз и целиком в одной транзакции. Шаг миграции - SQL-строка или функция,
+# принимающая соединение (для переносов данных).
+MIGRATIONS = [
+    (1, [
+        # Подбор анкет: game = ? AND is_searching AND NOT is_banned.
+        # Частичный индекс содержит только активные анкеты.
+        '''
+        CREATE INDEX IF NOT EXISTS idx_users_game_searching
+        ON users (game, user_id)
+        WHERE is_searching = TRUE AND is_banned = FALSE
+        ''',
+        # Проверка "уже отправили запрос", accept_/decline_ и отправленные инвайты
+        '''
+        CREATE INDEX IF NOT EXISTS idx_invites_from_to_status
+        ON invites (from_user_id, to_user_id, status)
+        ''',
+        # Полученные инвайты
+        '''
+        CREATE INDEX IF NOT EXISTS idx_invites_to_from_status
+        ON invites (to_user_id, from_user_id, status)
+        ''',
+        # COUNT(*) жалоб на пользователя
+        '''
+        CREATE INDEX IF NOT EXISTS idx_reports_reported
+        ON reports (reported_user_id)
+        ''',
+    ]),
+    (2, [
+        # Состояния диалогов и user_data (persistence.py)
+        '''
+        CREATE TABLE IF NOT EXISTS bot_state (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (3, [
+        # Исходящие сообщения (outbox.py); строка удаляется после доставки
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    (4, [
+        _ban_end_to_epoch,
+        # Снятие истекших блокировок: is_banned AND ban_end <= now
+        '''
+        CREATE INDEX IF NOT EXISTS idx_users_ban_end
+        ON users (ban_end)
+        WHERE is_banned = TRUE
+        ''',
+    ]),
+    (5, [
+        # Повторные жалобы от одного пользователя: оставляем последнюю
+        '''
+        DELETE FROM reports WHERE id NOT IN (
+            SELECT MAX(id) FROM reports GROUP BY reporter_user_id, reported_user_id
+        )
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_reporter_reported
+        ON reports (reporter_user_id, reported_user_id)
+        ''',
+        # Счетчики жалоб (AlliesHub.bump_report_count) вместо COUNT(*)
+        '''
+        CREATE TABLE IF NOT EXISTS report_counts (
+            reported_user_id INTEGER PRIMARY KEY,
+            window_start INTEGER NOT NULL,
+            current INTEGER NOT NULL DEFAULT 0,
+            previous INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        # Жалобы за последние 30 дней (REPORT_WINDOW) переносим в предыдущий интервал
+        '''
+        INSERT OR REPLACE INTO report_counts (reported_user_id, window_start, current, previous)
+        SELECT reported_user_id, CAST(strftime('%s', 'now') AS INTEGER), 0, COUNT(*)
+        FROM reports
+        WHERE timestamp >= datetime('now', '-30 days')
+        GROUP BY reported_user_id
+        ''',
+        'DROP INDEX IF EXISTS idx_reports_reported',
+    ]),
+    (6, [
+        # История инвайтов: keyset по (timestamp, id) отдельно для отправленных и полученных
+        '''
+        CREATE INDEX IF NOT EXISTS idx_invites_from_time
+        ON invites (from_user_id, timestamp)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_invites_to_time
+        ON invites (to_user_id, timestamp)
+        ''',
+    ]),
+    (7, [
+        # Каталог игр (games.py): канонические игры, алиасы и их триграммы
+        '''
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS game_aliases (
+            alias TEXT PRIMARY KEY,
+            game_id INTEGER NOT NULL REFERENCES games(id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS game_alias_trigrams (
+            trigram TEXT NOT NULL,
+            alias TEXT NOT NULL,
+            PRIMARY KEY (trigram, alias)
+        ) WITHOUT ROWID
+        ''',
+        'ALTER TABLE users ADD COLUMN game_id INTEGER REFERENCES games(id)',
+        _backfill_game_ids,
+        # Подбор анкет теперь по целому game_id
+        'DROP INDEX IF EXISTS idx_users_game_searching',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_users_game_id_searching
+        ON users (game_id, user_id)
+        WHERE is_searching = TRUE AND is_banned = FALSE
+        ''',
+    ]),
+    (8, [
+        # Тир ранга (ranks.py) и подбор по близости тира (matchmaking.py)
+        'ALTER TABLE users ADD COLUMN tier INTEGER',
+        _backfill_tiers,
+        '''
+        CREATE INDEX IF NOT EXISTS idx_users_game_tier_searching
+        ON users (game_id, tier, user_id)
+        WHERE is_searching = TRUE AND is_banned = FALSE
+        ''',
+    ]),
+    (9, [
+        # Полнотекстовый поиск по описаниям (search.py). В индекс идет текст с "ё" -> "е":
+        # unicode61 ее не сворачивает. Триггеры обновляют только измененные анкеты.
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            description,
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+        ''',
+        # OR REPLACE: INSERT OR REPLACE в users не вызывает триггер удаления
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users
+        WHEN new.description IS NOT NULL
+        BEGIN
+            INSERT OR REPLACE INTO users_fts (rowid, description)
+            VALUES (new.user_id, replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е'));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM users_fts WHERE rowid = old.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF description ON users
+        WHEN old.description IS NOT new.description
+        BEGIN
+            DELETE FROM users_fts WHERE rowid = old.user_id;
+            INSERT INTO users_fts (rowid, description)
+            SELECT new.user_id, replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е')
+            WHERE new.description IS NOT NULL;
+        END
+        ''',
+        # Начальное заполнение по уже существующим анкетам
+        '''
+        INSERT INTO users_fts (rowid, description)
+        SELECT user_id, replace(replace(description, 'ё', 'е'), 'Ё', 'Е')
+        FROM users WHERE description IS NOT NULL
+        ''',
+    ]),
+    (10, [
+        # Отправитель в другом процессе (Outbox.start(follow=...)) забирает строки
+        # с id больше последнего увиденного: id не должны переиспользоваться
+        # после удаления отправленных строк, поэтому AUTOINCREMENT
+        '''
+        CREATE TABLE outbox_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )
+        ''',
+        'INSERT INTO outbox_new (id, chat_id, payload, attempts, created_at) SELECT * FROM outbox',
+        'DROP TABLE outbox',
+        'ALTER TABLE outbox_new RENAME TO outbox',
+        # Сбросы кэшей между воркерами (invalidations.py), читаются так же по id
+        '''
+        CREATE TABLE invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            ban_end INTEGER,
+            origin TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    (11, [
+        # Жизненный цикл инвайтов: запросы без ответа истекают (status = 'expired'),
+        # отвеченные и истекшие со временем переносятся в архив. id - те же, что в invites.
+        '''
+        CREATE TABLE IF NOT EXISTS invites_archive (
+            id INTEGER PRIMARY KEY,
+            from_user_id INTEGER,
+            to_user_id INTEGER,
+            status TEXT,
+            timestamp DATETIME
+        )
+        ''',
+        # История инвайтов из архива - как из invites
+        '''
+        CREATE INDEX IF NOT EXISTS idx_invites_archive_from_time
+        ON invites_archive (from_user_id, timestamp)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_invites_archive_to_time
+        ON invites_archive (to_user_id, timestamp)
+        ''',
+        # Истечение запросов и перенос в архив: каждый ищет только свои строки
+        '''
+        CREATE INDEX IF NOT EXISTS idx_invites_pending_time
+        ON invites (timestamp) WHERE status = 'pending'
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_invites_settled_time
+        ON invites (timestamp) WHERE status != 'pending'
+        ''',
+    ]),
+    (12, [
+        # Просмотренные анкеты (seen.py): Bloom-фильтры двух поколений на пользователя
+        # и где он остановился в ленте (cursor, user_id анкеты) - "Продолжить поиск"
+        # начинается отсюда, а не перебирает заново все просмотренное
+        '''
+        CREATE TABLE IF NOT EXISTS seen_profiles (
+            user_id INTEGER PRIMARY KEY,
+            started_at REAL NOT NULL,
+            count INTEGER NOT NULL,
+            bits BLOB NOT NULL,
+            previous BLOB,
+            cursor INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+    ]),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    version = schema_version(conn)
+    pending = [(v, steps) for v, steps in MIGRATIONS if v > version]
+    if not pending:
+        return version
+
+    for target, steps in pending:
+        logger.info("Применяем миграцию схемы %s -> %s", version, target)
+        conn.execute('BEGIN')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Миграция %s не применена", target)
+            raise
+        version = target
+
+    # Обновляем статистику планировщика под новые индексы
+    conn.execute('ANALYZE')
+    conn.commit()
+    return version
+
+
+# Таблицы первой версии бота; все последующие изменения схемы - миграции
+BASE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        game TEXT,
+        rank TEXT,
+        description TEXT,
+        is_searching BOOLEAN DEFAULT FALSE,
+        is_banned BOOLEAN DEFAULT FALSE,
+        ban_end DATETIME
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS invites (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_user_id INTEGER,
+        to_user_id INTEGER,
+        status TEXT DEFAULT 'pending',
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(from_user_id) REFERENCES users(user_id),
+        FOREIGN KEY(to_user_id) REFERENCES users(user_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reported_user_id INTEGER,
+        reporter_user_id INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(reported_user_id) REFERENCES users(user_id),
+        FOREIGN KEY(reporter_user_id) REFERENCES users(user_id)
+    )
+    ''',
+]
+
+
+def init_schema(conn: sqlite3.Connection) -> int:
+    """Создает таблицы в новой базе и применяет миграции; возвращает версию схемы."""
+    for sql in BASE_TABLES:
+        conn.execute(sql)
+    conn.commit()
+    return migrate(conn)
@@ -0,0 +1,364 @@
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import NetworkError, BadRequest, RetryAfter, TelegramError
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: около 30 сообщений в секунду всего и не больше
+# одного в секунду в один чат (короткие всплески допускаются)
+GLOBAL_RATE = 30
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+MAX_ATTEMPTS = 5
+BACKOFF_MAX = 60
+MAX_CHATS = 100000
+# Доставленные строки удаляются пачкой: по DELETE_BATCH штук, раз в
+# DELETE_INTERVAL секунд или когда очередь опустела
+DELETE_BATCH = 100
+DELETE_INTERVAL = 1.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float = None) -> float:
+        # 0 - токен взят, иначе сколько секунд ждать следующего
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def drain(self, seconds: float, now: float = None) -> None:
+        # Следующий токен - не раньше чем через seconds секунд
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens = min(self.tokens, 1.0) - seconds * self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Item:
+    __slots__ = ('id', 'chat_id', 'messages', 'key', 'pos', 'attempts')
+
+    def __init__(self, id, chat_id, messages, key=None, attempts=0):
+        self.id = id
+        self.chat_id = chat_id
+        self.messages = messages
+        self.key = key
+        self.pos = 0
+        self.attempts = attempts
+
+
+class Outbox:
+    """Исходящие сообщения: очередь в памяти, продублированная таблицей outbox.
+
+    Обработчик только записывает строку в базу и сразу возвращается, отправкой
+    занимаются фоновые потоки. Они соблюдают лимиты Telegram (общий и на чат,
+    токен-бакеты), повторяют отправку после 429 и сетевых ошибок и сохраняют
+    порядок сообщений внутри чата. Неотправленное переживает перезапуск:
+    строка удаляется из таблицы только после доставки (пачками, так что после
+    падения процесса последние доставленные сообщения могут уйти повторно).
+
+    Пара "меню" (send_menu) склеивается: заголовок с reply-клавиатурой не
+    отправляется, если эта клавиатура уже стоит в чате, а еще не отправленное
+    меню заменяется более новым.
+
+    С несколькими процессами (router.py) воркеры только пишут в таблицу
+    (start не вызывают), а отправляет один процесс: start(bot, follow=...)
+    раз в follow секунд забирает новые строки. Так лимиты Telegram на токен
+    и порядок сообщений в чате соблюдаются для всех воркеров сразу.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, senders: int = 4, max_attempts: int = MAX_ATTEMPTS, store=None):
+        self._store = store or storage.get_storage()
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.senders = senders
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate, global_rate)
+        self._global_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._chats = {}            # chat_id -> deque[_Item]
+        self._buckets = {}          # chat_id -> TokenBucket
+        self._ready = []            # куча (когда можно слать, seq, chat_id)
+        self._busy = set()          # чаты, из которых сейчас идет отправка
+        self._keyboards = OrderedDict()  # chat_id -> последняя отправленная reply-клавиатура
+        self._seq = itertools.count()
+        self._done = []             # id строк, которые осталось удалить из таблицы
+        self._flushed = time.monotonic()
+        self._threads = []
+        self._bot = None
+        self._closing = False
+        self._follow = None
+        self._last_id = 0  # последняя строка таблицы, взятая в очередь (режим follow)
+        self.queued = 0  # сообщений поставлено в очередь за все время
+
+    # Постановка в очередь (вызывается из обработчиков)
+
+    def send_message(self, chat_id: int, text: str, reply_markup=None) -> None:
+        self._put(chat_id, [(text, reply_markup)])
+
+    def send_menu(self, chat_id: int, header: str, keyboard, text: str, reply_markup) -> None:
+        self._put(chat_id, [(header, keyboard), (text, reply_markup)], key='menu')
+
+    def _put(self, chat_id: int, messages, key: str = None) -> None:
+        messages = [[text, markup.to_json() if markup is not None else None] for text, markup in messages]
+        payload = json.dumps({'messages': messages, 'key': key}, ensure_ascii=False)
+        item_id = self._store.outbox_add(chat_id, payload, time.time())
+        with self._cond:
+            self.queued += len(messages)
+            # До start() строки только копятся в таблице, start() их и загрузит
+            if self._bot is not None and self._follow is None:
+                self._schedule(_Item(item_id, chat_id, messages, key))
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(items) for items in self._chats.values())
+
+    # Запуск и остановка
+
+    def start(self, bot, follow: float = None) -> None:
+        with self._cond:
+            self._bot = bot
+            self._closing = False
+            self._follow = follow
+            self._last_id = 0
+            rows = self._load_new()
+        if rows:
+            logger.info("Исходящая очередь: %s неотправленных сообщений", rows)
+        for i in range(self.senders):
+            thread = threading.Thread(target=self._sender, name=f'outbox-sender-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if follow is not None:
+            thread = threading.Thread(target=self._follower, name='outbox-follower', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _load_new(self) -> int:
+        # Под self._cond. id растут в порядке фиксации (AUTOINCREMENT и один писатель
+        # в SQLite, очередь вставок в PostgreSQL), поэтому строка с меньшим id уже не появится позже
+        rows = self._store.outbox_after(self._last_id)
+        for item_id, chat_id, payload, attempts in rows:
+            data = json.loads(payload)
+            self._schedule(_Item(item_id, chat_id, data['messages'], data['key'], attempts))
+            self._last_id = item_id
+            if self._follow is not None:
+                self.queued += len(data['messages'])
+        return len(rows)
+
+    def _follower(self) -> None:
+        with self._cond:
+            while not self._closing:
+                self._cond.wait(self._follow)
+                if not self._closing:
+                    self._load_new()
+
+    def stop(self, timeout: float = 10) -> None:
+        # Дожидаемся отправки того, что уже можно слать; остальное останется в таблице
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._chats or self._busy) and time.monotonic() < deadline:
+                self._cond.wait(0.1)
+            self._closing = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._cond:
+            done = self._take_done(force=True)
+        self._flush(done)
+        with self._cond:
+            self._bot = None
+            self._chats.clear()
+            self._ready.clear()
+
+    def is_alive(self) -> bool:
+        return bool(self._threads) and all(thread.is_alive() for thread in self._threads)
+
+    # Планирование (под self._cond)
+
+    def _schedule(self, item: _Item) -> None:
+        items = self._chats.get(item.chat_id)
+        if items is None:
+            items = self._chats[item.chat_id] = deque()
+            if item.chat_id not in self._busy:
+                self._push(item.chat_id, 0)
+        if item.key:
+            # Еще не отправленное меню устарело - оставляем только новое
+            busy_head = items[0] if items and item.chat_id in self._busy else None
+            stale = [old for old in items if old.key == item.key and old is not busy_head and old.pos == 0]
+            for old in stale:
+                items.remove(old)
+                self._delete(old)
+        items.append(item)
+        self._cond.notify()
+
+    def _push(self, chat_id: int, delay: float) -> None:
+        heapq.heappush(self._ready, (time.monotonic() + delay, next(self._seq), chat_id))
+
+    def _release(self, chat_id: int, delay: float = 0) -> None:
+        self._busy.discard(chat_id)
+        if self._chats.get(chat_id):
+            self._push(chat_id, delay)
+        else:
+            self._chats.pop(chat_id, None)
+        self._cond.notify_all()
+
+    def _next_chat(self):
+        while True:
+            if self._closing:
+                return None
+            now = time.monotonic()
+            if self._ready and self._ready[0][0] <= now:
+                chat_id = heapq.heappop(self._ready)[2]
+                if chat_id in self._busy or not self._chats.get(chat_id):
+                    continue
+                self._busy.add(chat_id)
+                return chat_id
+            self._cond.wait(self._ready[0][0] - now if self._ready else None)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > MAX_CHATS:
+                # Полные бакеты простаивающих чатов ничего не ограничивают
+                now = time.monotonic()
+                for idle in [c for c, b in self._buckets.items() if c not in self._chats and b.is_full(now)]:
+                    del self._buckets[idle]
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    # Отправка
+
+    def _sender(self) -> None:
+        while True:
+            with self._cond:
+                chat_id = self._next_chat()
+                if chat_id is None:
+                    return
+                item = self._chats[chat_id][0]
+                text, markup = item.messages[item.pos]
+                if item.key and item.pos == 0 and markup is not None and self._keyboards.get(chat_id) == markup:
+                    # Клавиатура уже в чате, заголовок меню не нужен
+                    item.pos += 1
+                    text, markup = item.messages[item.pos]
+                wait = self._chat_bucket(chat_id).take()
+                if wait:
+                    self._release(chat_id, wait)
+                    continue
+
+            self._acquire_global()
+            delay = self._deliver(item, text, markup)
+
+            with self._cond:
+                if item.pos >= len(item.messages) or item.attempts >= self.max_attempts:
+                    items = self._chats.get(chat_id)
+                    if items and items[0] is item:
+                        items.popleft()
+                    self._delete(item)
+                self._release(chat_id, delay)
+                done = self._take_done()
+            self._flush(done)
+
+    def _acquire_global(self) -> None:
+        while True:
+            with self._global_lock:
+                wait = self._global.take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def _deliver(self, item: _Item, text: str, markup) -> float:
+        # Возвращает задержку перед следующей отправкой в этот чат
+        try:
+            self._bot.send_message(chat_id=item.chat_id, text=text, reply_markup=markup)
+        except RetryAfter as e:
+            logger.warning("429 для чата %s, ждем %s с", item.chat_id, e.retry_after)
+            # Флуд-лимит может быть общим для бота: притормаживаем и остальные чаты
+            with self._global_lock:
+                self._global.drain(e.retry_after)
+            return float(e.retry_after)
+        except BadRequest as e:
+            logger.warning("Сообщение в чат %s отброшено: %s", item.chat_id, e)
+            item.attempts = self.max_attempts
+            return 0
+        except NetworkError as e:
+            item.attempts += 1
+            if item.attempts >= self.max_attempts:
+                logger.error("Сообщение в чат %s не доставлено после %s попыток: %s", item.chat_id, item.attempts, e)
+                return 0
+            self._save_attempts(item)
+            return min(2 ** item.attempts, BACKOFF_MAX)
+        except TelegramError as e:
+            # Бот заблокирован пользователем и т.п. - повтор не поможет
+            logger.warning("Сообщение в чат %s отброшено: %s", item.chat_id, e)
+            item.attempts = self.max_attempts
+            return 0
+        except Exception:
+            logger.exception("Ошибка отправки в чат %s", item.chat_id)
+            item.attempts = self.max_attempts
+            return 0
+
+        item.pos += 1
+        if markup is not None:
+            self._remember_keyboard(item.chat_id, markup)
+        return 0
+
+    def _remember_keyboard(self, chat_id: int, markup: str) -> None:
+        kind = json.loads(markup)
+        with self._cond:
+            if 'keyboard' in kind:
+                self._keyboards[chat_id] = markup
+                self._keyboards.move_to_end(chat_id)
+                if len(self._keyboards) > MAX_CHATS:
+                    self._keyboards.popitem(last=False)
+            elif 'remove_keyboard' in kind:
+                self._keyboards.pop(chat_id, None)
+
+    def _delete(self, item: _Item) -> None:
+        # Под self._cond; сама запись в базу - в _flush
+        self._done.append(item.id)
+
+    def _take_done(self, force: bool = False) -> list:
+        now = time.monotonic()
+        if not self._done or not (force or not self._chats or len(self._done) >= DELETE_BATCH
+                                  or now - self._flushed >= DELETE_INTERVAL):
+            return []
+        done, self._done = self._done, []
+        self._flushed = now
+        return done
+
+    def _flush(self, done: list) -> None:
+        if not done:
+            return
+        try:
+            self._store.outbox_delete(done)
+        except Exception:
+            logger.exception("Не удалось удалить %s отправленных сообщений из outbox", len(done))
+            with self._cond:
+                self._done.extend(done)
+
+    def _save_attempts(self, item: _Item) -> None:
+        self._store.outbox_set_attempts(item.id, item.attempts)
@@ -0,0 +1,101 @@
+import json
+from collections import defaultdict
+from copy import deepcopy
+
+from telegram.ext import BasePersistence
+
+import storage
+
+
+class SQLitePersistence(BasePersistence):
+    """Состояния диалогов и user_data в таблице bot_state основной базы
+    (SQLite или PostgreSQL - через storage.py).
+
+    Запись идет сразу при изменении (только если данные поменялись), поэтому
+    перезапуск бота не теряет недозаполненные анкеты. chat_data и bot_data
+    бот не использует и не сохраняет.
+    """
+
+    def __init__(self, store=None):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self._store = store or storage.get_storage()
+        self._user_data = None
+        self._conversations = {}
+
+    # user_data
+
+    def get_user_data(self):
+        if self._user_data is None:
+            self._user_data = defaultdict(dict)
+            for key, data in self._store.load_state('user'):
+                self._user_data[int(key)] = json.loads(data)
+        return deepcopy(self._user_data)
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        if self._user_data is None:
+            self.get_user_data()
+        if self._user_data.get(user_id) == data:
+            return
+        self._user_data[user_id] = deepcopy(data)
+        if data:
+            self._save('user', str(user_id), data)
+        else:
+            self._delete('user', str(user_id))
+
+    def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    # Диалоги: ключ ConversationHandler - кортеж (chat_id, user_id)
+
+    def get_conversations(self, name: str) -> dict:
+        if name not in self._conversations:
+            rows = self._store.load_state('conv:' + name)
+            self._conversations[name] = {tuple(json.loads(key)): json.loads(data) for key, data in rows}
+        return dict(self._conversations[name])
+
+    def update_conversation(self, name: str, key, new_state) -> None:
+        states = self._conversations.setdefault(name, {})
+        if states.get(key) == new_state:
+            return
+        if new_state is None:
+            states.pop(key, None)
+            self._delete('conv:' + name, json.dumps(list(key)))
+        else:
+            states[key] = new_state
+            self._save('conv:' + name, json.dumps(list(key)), new_state)
+
+    # Не используются ботом
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    def get_bot_data(self) -> dict:
+        return {}
+
+    def update_bot_data(self, data: dict) -> None:
+        pass
+
+    def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    def get_callback_data(self):
+        return None
+
+    def update_callback_data(self, data) -> None:
+        pass
+
+    def flush(self) -> None:
+        # Все изменения уже записаны
+        pass
+
+    def _save(self, kind: str, key: str, data) -> None:
+        self._store.save_state(kind, key, json.dumps(data, ensure_ascii=False))
+
+    def _delete(self, kind: str, key: str) -> None:
+        self._store.delete_state(kind, key)
@@ -0,0 +1,195 @@
+"""Синтетическая популяция в новой базе: анкеты, инвайты и жалобы.
+
+    python populate.py --db big.db --users 1000000
+    python populate.py --db big.db --users 100000 --invites 5 --force
+
+Схема - как у бота (таблицы AlliesHub + все миграции). Игры распределены
+по закону Ципфа (первые в каталоге популярнее), ранги - реальные названия
+ступеней с тиром из ranks.parse_rank, ближе к середине лестницы.
+Часть анкет не в поиске, часть заблокирована (есть и истекшие блокировки),
+у инвайтов и жалоб - история за последние --days дней.
+Все вставки - executemany в одной транзакции; индексы, триггеры и
+полнотекстовый индекс строятся после заливки.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+from explain_queries import create_schema
+from migrations import migrate
+from ranks import LADDERS, parse_rank
+
+WORDS = (
+    'ищу тиммейта на вечер микрофон обязателен играю спокойно без токсиков '
+    'нужен саппорт керри мидер танк снайпер ранкед каждый день после работы '
+    'по выходным ночью дискорд есть опыт турниры учусь поднимаю ранг весело '
+    'стрим общение взрослый адекватный новичок ветеран фарм тактика'
+).split()
+INVITE_STATUSES = ('pending', 'accepted', 'rejected')
+INVITE_WEIGHTS = (30, 40, 30)
+
+
+def zipf_weights(n: int, s: float = 1.1) -> list:
+    return [1 / (i + 1) ** s for i in range(n)]
+
+
+def rank_table(game: str) -> list:
+    """(название ранга, тир) по возрастанию тира; для игр без лестницы - рейтинг."""
+    ladder = LADDERS.get(game)
+    if ladder is None:
+        return [(str(rating), rating) for rating in range(800, 2600, 50)]
+    names = []
+    for words, divisions in ladder['steps']:
+        title = words[0].title()
+        names.extend([title] if divisions == 1 else [f'{title} {d}' for d in range(1, divisions + 1)])
+    return sorted(((name, parse_rank(game, name)) for name in names), key=lambda rank: rank[1])
+
+
+def timestamp(rnd: random.Random, now: datetime, days: int) -> str:
+    # Как CURRENT_TIMESTAMP: UTC, "%Y-%m-%d %H:%M:%S"
+    return (now - timedelta(seconds=rnd.randrange(days * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def populate(conn: sqlite3.Connection, users: int, invites: float = 3.0, report_rate: float = 0.02,
+             ban_rate: float = 0.005, searching_rate: float = 0.7, days: int = 180, seed: int = 1) -> dict:
+    """Заполняет пустую базу со схемой бота, возвращает число строк по таблицам."""
+    rnd = random.Random(seed)
+    games = conn.execute('SELECT id, name FROM games ORDER BY id').fetchall()
+    ranks = {game_id: rank_table(name) for game_id, name in games}
+    weights = zipf_weights(len(games))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    epoch = int(time.time())
+
+    user_games = rnd.choices(games, weights, k=users)
+    by_game = {}
+    for user_id, (game_id, _) in enumerate(user_games, start=1):
+        by_game.setdefault(game_id, []).append(user_id)
+
+    def user_rows():
+        for user_id, (game_id, name) in enumerate(user_games, start=1):
+            table = ranks[game_id]
+            # Треугольное распределение: большинство в середине лестницы
+            rank, tier = table[min(int(rnd.triangular(0, len(table), len(table) * 0.45)), len(table) - 1)]
+            banned = rnd.random() < ban_rate
+            # Каждая пятая блокировка уже истекла - ее снимет ban_expiry_job
+            ban_end = None
+            if banned:
+                ban_end = epoch - rnd.randrange(1, 86400) if rnd.random() < 0.2 else \
+                    epoch + rnd.randrange(3600, 14 * 86400)
+            description = ' '.join(rnd.sample(WORDS, rnd.randint(4, 12)))
+            yield (user_id, f'player{user_id}', name, game_id, rank, tier, description,
+                   rnd.random() < searching_rate, banned, ban_end)
+
+    def invite_rows():
+        # Инвайты внутри игры отправителя
+        for from_user_id, (game_id, _) in enumerate(user_games, start=1):
+            players = by_game[game_id]
+            if len(players) < 2:
+                continue
+            for _ in range(int(rnd.expovariate(1 / invites)) if invites else 0):
+                to_user_id = rnd.choice(players)
+                if to_user_id != from_user_id:
+                    yield (from_user_id, to_user_id, rnd.choices(INVITE_STATUSES, INVITE_WEIGHTS)[0],
+                           timestamp(rnd, now, days))
+
+    def report_rows():
+        # Жалоба - одна на пару (уникальный индекс), жалуются на немногих
+        seen = set()
+        for _ in range(int(users * report_rate)):
+            pair = (rnd.randint(1, users), rnd.randint(1, users))
+            if pair[0] != pair[1] and pair not in seen:
+                seen.add(pair)
+                yield (*pair, timestamp(rnd, now, days))
+
+    conn.execute('BEGIN')
+    # Индексы и триггеры пересоздаем после вставки: одна сортировка на индекс
+    # вместо миллионов вставок в случайные места B-дерева
+    deferred = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL"
+    ).fetchall()
+    for kind, name, _ in deferred:
+        conn.execute(f'DROP {kind.upper()} {name}')
+
+    conn.executemany('''
+        INSERT INTO users (user_id, username, game, game_id, rank, tier, description,
+                           is_searching, is_banned, ban_end)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', user_rows())
+    conn.executemany('INSERT INTO invites (from_user_id, to_user_id, status, timestamp) VALUES (?, ?, ?, ?)',
+                     invite_rows())
+    conn.executemany('INSERT INTO reports (reported_user_id, reporter_user_id, timestamp) VALUES (?, ?, ?)',
+                     report_rows())
+    # Счетчики жалоб - как после миграции 5: жалобы за окно в предыдущем интервале
+    conn.execute('''
+        INSERT OR REPLACE INTO report_counts (reported_user_id, window_start, current, previous)
+        SELECT reported_user_id, CAST(strftime('%s', 'now') AS INTEGER), 0, COUNT(*)
+        FROM reports
+        WHERE timestamp >= datetime('now', '-30 days')
+        GROUP BY reported_user_id
+    ''')
+
+    for _, _, sql in deferred:
+        conn.execute(sql)
+    # Полнотекстовый индекс - как начальное заполнение в миграции 9
+    conn.execute('''
+        INSERT INTO users_fts (rowid, description)
+        SELECT user_id, replace(replace(description, 'ё', 'е'), 'Ё', 'Е')
+        FROM users WHERE description IS NOT NULL
+    ''')
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.commit()
+    return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            for table in ('users', 'invites', 'reports', 'report_counts')}
+
+
+def create(path: str, users: int, **options) -> dict:
+    """Новая база path со схемой бота и популяцией."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Надежность записи на время заливки не нужна: упадет - создадим заново
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA cache_size=-262144')
+        create_schema(conn)
+        migrate(conn)
+        counts = populate(conn, users, **options)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return counts
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', required=True, help='файл новой базы')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--invites', type=float, default=3.0, help='инвайтов на анкету в среднем')
+    parser.add_argument('--reports', type=float, default=0.02, help='жалоб на анкету в среднем')
+    parser.add_argument('--bans', type=float, default=0.005, help='доля заблокированных')
+    parser.add_argument('--searching', type=float, default=0.7, help='доля анкет в поиске')
+    parser.add_argument('--days', type=int, default=180, help='глубина истории инвайтов и жалоб')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help='перезаписать существующий файл')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f'{args.db} уже есть (--force - перезаписать)')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    started = time.perf_counter()
+    counts = create(args.db, args.users, invites=args.invites, report_rate=args.reports, ban_rate=args.bans,
+                    searching_rate=args.searching, days=args.days, seed=args.seed)
+    elapsed = time.perf_counter() - started
+    print(', '.join(f'{table}: {n}' for table, n in counts.items()))
+    print(f'{elapsed:.1f} c, {os.path.getsize(args.db) / 2 ** 20:.0f} МБ')
+
+
+if __name__ == '__main__':
+    main()
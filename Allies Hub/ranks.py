@@ -0,0 +1,184 @@
+import re
+
+# Ранговые лестницы игр каталога (названия - как в games.SEED_GAMES).
+# Ступень: (ключевые слова, число делений). Тир - номер деления снизу,
+# поэтому тиры сравнимы только внутри одной игры.
+# descending - деления считаются сверху вниз (LoL: IV ниже I).
+# number_step - во сколько очков рейтинга (MMR, SR) укладывается один тир.
+LADDERS = {
+    'Dota 2': {
+        'steps': [
+            (('herald', 'рекрут'), 5),
+            (('guardian', 'страж'), 5),
+            (('crusader', 'рыцарь'), 5),
+            (('archon', 'герой'), 5),
+            (('legend', 'легенд'), 5),
+            (('ancient', 'властелин'), 5),
+            (('divine', 'божеств'), 5),
+            (('immortal', 'титан'), 1),
+        ],
+        'number_step': 154,
+    },
+    'Counter-Strike 2': {
+        'steps': [
+            (('silver', 'сильвер', 'серебр'), 6),
+            (('gold nova', 'голд', 'gn'), 4),
+            (('master guardian', 'калаш', 'mg', 'dmg'), 4),
+            (('legendary eagle', 'беркут', 'le', 'lem'), 2),
+            (('supreme', 'суприм', 'smfc'), 1),
+            (('global', 'глобал', 'ge'), 1),
+        ],
+        'number_step': 1700,
+    },
+    'Valorant': {
+        'steps': [
+            (('iron', 'желез'), 3),
+            (('bronze', 'бронз'), 3),
+            (('silver', 'серебр'), 3),
+            (('gold', 'золот'), 3),
+            (('platinum', 'платин'), 3),
+            (('diamond', 'алмаз'), 3),
+            (('ascendant', 'асцендант', 'восходящ'), 3),
+            (('immortal', 'бессмерт'), 3),
+            (('radiant', 'радиант'), 1),
+        ],
+    },
+    'League of Legends': {
+        'steps': [
+            (('iron', 'желез'), 4),
+            (('bronze', 'бронз'), 4),
+            (('silver', 'серебр'), 4),
+            (('gold', 'золот'), 4),
+            (('platinum', 'платин'), 4),
+            (('emerald', 'изумруд'), 4),
+            (('diamond', 'алмаз'), 4),
+            (('master', 'мастер'), 1),
+            (('grandmaster', 'грандмастер'), 1),
+            (('challenger', 'претендент'), 1),
+        ],
+        'descending': True,
+    },
+    'Apex Legends': {
+        'steps': [
+            (('rookie', 'новичок'), 4),
+            (('bronze', 'бронз'), 4),
+            (('silver', 'серебр'), 4),
+            (('gold', 'золот'), 4),
+            (('platinum', 'платин'), 4),
+            (('diamond', 'алмаз'), 4),
+            (('master', 'мастер'), 1),
+            (('predator', 'хищник', 'пред'), 1),
+        ],
+        'descending': True,
+    },
+    'Overwatch 2': {
+        'steps': [
+            (('bronze', 'бронз'), 5),
+            (('silver', 'серебр'), 5),
+            (('gold', 'золот'), 5),
+            (('platinum', 'платин'), 5),
+            (('diamond', 'алмаз'), 5),
+            (('master', 'мастер'), 5),
+            (('grandmaster', 'грандмастер'), 5),
+            (('champion', 'чемпион'), 5),
+            (('top 500', 'top500', 'топ 500', 'топ500'), 1),
+        ],
+        'descending': True,
+        'number_step': 120,
+    },
+    'Rainbow Six Siege': {
+        'steps': [
+            (('copper', 'медь', 'медн'), 5),
+            (('bronze', 'бронз'), 5),
+            (('silver', 'серебр'), 5),
+            (('gold', 'золот'), 5),
+            (('platinum', 'платин'), 5),
+            (('emerald', 'изумруд'), 5),
+            (('diamond', 'алмаз'), 5),
+            (('champion', 'чемпион'), 1),
+        ],
+        'descending': True,
+    },
+    'Rocket League': {
+        'steps': [
+            (('bronze', 'бронз'), 3),
+            (('silver', 'серебр'), 3),
+            (('gold', 'золот'), 3),
+            (('platinum', 'платин'), 3),
+            (('diamond', 'алмаз'), 3),
+            (('champion', 'чемпион'), 3),
+            (('grand champion', 'гранд чемпион', 'gc'), 3),
+            (('supersonic legend', 'ssl'), 1),
+        ],
+    },
+    'PUBG: Battlegrounds': {
+        'steps': [
+            (('bronze', 'бронз'), 5),
+            (('silver', 'серебр'), 5),
+            (('gold', 'золот'), 5),
+            (('platinum', 'платин'), 5),
+            (('diamond', 'алмаз'), 5),
+            (('master', 'мастер'), 1),
+        ],
+        'descending': True,
+    },
+}
+
+ROMAN = {'i': 1, 'ii': 2, 'iii': 3, 'iv': 4, 'v': 5}
+
+
+def _compile(ladder: dict):
+    # Ключевые слова от длинных к коротким: "grandmaster" раньше "master".
+    # Короткие (аббревиатуры) ищем только целым словом или с номером: "mg2".
+    keywords, base = [], 0
+    for words, divisions in ladder['steps']:
+        for word in words:
+            pattern = re.escape(word) if len(word) > 3 else rf'\b{re.escape(word)}(?=\d|\b)'
+            keywords.append((len(word), re.compile(pattern), base, divisions))
+        base += divisions
+    keywords.sort(key=lambda keyword: -keyword[0])
+    return keywords, base
+
+
+_COMPILED = {game: _compile(ladder) for game, ladder in LADDERS.items()}
+
+
+def _division(text: str, divisions: int):
+    for token in re.findall(r'[a-z]+|\d+', text):
+        number = int(token) if token.isdigit() else ROMAN.get(token)
+        if number and 1 <= number <= divisions:
+            return number
+    return None
+
+
+def parse_rank(game: str, text: str):
+    """Тир ранга в игре game (каноническое название) или None, если не распознан."""
+    if not text:
+        return None
+    text = text.casefold().replace('ё', 'е').strip()
+    ladder = LADDERS.get(game)
+    number = re.fullmatch(r'\d+', text.replace(' ', ''))
+
+    if ladder is None:
+        # Игра без лестницы: число (эло, рейтинг) сравнимо само с собой
+        return int(number.group()) if number else None
+
+    keywords, total = _COMPILED[game]
+    if number:
+        step = ladder.get('number_step')
+        return min(int(number.group()) // step, total - 1) if step else None
+
+    for _, pattern, base, divisions in keywords:
+        match = pattern.search(text)
+        if match is None:
+            continue
+        if divisions == 1:
+            return base
+        division = _division(text[match.end():], divisions) or _division(text[:match.start()], divisions)
+        if division is None:
+            # Без деления - середина ступени
+            return base + divisions // 2
+        if ladder.get('descending'):
+            return base + divisions - division
+        return base + division - 1
+    return None
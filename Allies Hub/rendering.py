@@ -0,0 +1,137 @@
+import json
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyMarkup
+
+from callbacks import encode, pack_int, template
+
+# Клавиатуры и карточка анкеты. Постоянные клавиатуры собираются и
+# сериализуются один раз при импорте, клавиатуры с id - из готового JSON,
+# в который подставляется id. Обработчики получают готовые объекты.
+
+MAIN_MENU_BUTTON = "🏠 Главное меню"
+
+
+class FrozenMarkup(ReplyMarkup):
+    """Разметка в виде готового JSON: to_json() ничего не сериализует.
+
+    Неизменяема; принимается Bot.send_message и AsyncBotAPI как обычная разметка.
+    """
+
+    __slots__ = ('_json', '_dict')
+
+    def __init__(self, markup_json: str):
+        object.__setattr__(self, '_json', markup_json)
+        object.__setattr__(self, '_dict', None)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is frozen")
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenMarkup) and other._json == self._json
+
+    def __hash__(self):
+        return hash(self._json)
+
+    def to_json(self) -> str:
+        return self._json
+
+    def to_dict(self) -> dict:
+        # Словарь общий для всех вызовов - не менять
+        if self._dict is None:
+            object.__setattr__(self, '_dict', json.loads(self._json))
+        return self._dict
+
+
+def freeze(markup) -> FrozenMarkup:
+    return FrozenMarkup(markup.to_json())
+
+
+class KeyboardTemplate:
+    """Клавиатура, у которой меняется только id в callback_data ('{id}' в разметке, callbacks.template)."""
+
+    ID = '{id}'
+
+    def __init__(self, markup):
+        self._parts = markup.to_json().split(self.ID)
+
+    def __call__(self, item_id: int) -> FrozenMarkup:
+        return FrozenMarkup(pack_int(item_id).join(self._parts))
+
+
+MAIN_MENU_MARKUP = freeze(ReplyKeyboardMarkup([[MAIN_MENU_BUTTON]], resize_keyboard=True, one_time_keyboard=False))
+
+MAIN_ACTIONS_MARKUP = freeze(InlineKeyboardMarkup([
+    [InlineKeyboardButton("Продолжить поиск", callback_data=encode('resume_search'))],
+    [InlineKeyboardButton("Изменить анкету", callback_data=encode('edit_profile')),
+     InlineKeyboardButton("Остановить поиск", callback_data=encode('stop_search'))],
+    [InlineKeyboardButton("История инвайтов", callback_data=encode('invite_history')),
+     InlineKeyboardButton("Моя анкета", callback_data=encode('show_my_profile'))],
+    [InlineKeyboardButton("Поиск по описанию", callback_data=encode('description_search'))]
+]))
+
+SEARCH_LOADING_MARKUP = freeze(InlineKeyboardMarkup([
+    [InlineKeyboardButton("Продолжить поиск", callback_data=encode('resume_search'))],
+    [InlineKeyboardButton("Главное меню", callback_data=encode('main_menu'))]
+]))
+
+CREATE_PROFILE_MARKUP = freeze(InlineKeyboardMarkup([
+    [InlineKeyboardButton("Создать анкету", callback_data=encode('create_profile'))]
+]))
+
+EDIT_PROFILE_MARKUP = freeze(InlineKeyboardMarkup([
+    [InlineKeyboardButton("Поменять игру", callback_data=encode('change_game'))],
+    [InlineKeyboardButton("Поменять описание", callback_data=encode('change_description'))],
+    [InlineKeyboardButton("Изменить ранг", callback_data=encode('change_rank'))],
+    [InlineKeyboardButton("Заполнить заново", callback_data=encode('create_profile'))]
+]))
+
+profile_markup = KeyboardTemplate(InlineKeyboardMarkup([
+    [InlineKeyboardButton("Следующая анкета", callback_data=template('next'))],
+    [
+        InlineKeyboardButton("Отправить запрос", callback_data=template('invite')),
+        InlineKeyboardButton("Перестать искать", callback_data=encode('stop_search'))
+    ],
+    [
+        InlineKeyboardButton("Изменить анкету", callback_data=encode('edit_profile')),
+        InlineKeyboardButton("Пожаловаться на профиль", callback_data=template('report'))
+    ]
+]))
+
+invite_markup = KeyboardTemplate(InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Принять", callback_data=template('accept')),
+        InlineKeyboardButton("Отклонить", callback_data=template('decline'))
+    ],
+    [InlineKeyboardButton("Главное меню", callback_data=encode('main_menu'))]
+]))
+
+_MAIN_MENU_ROW = [InlineKeyboardButton("Главное меню", callback_data=encode('main_menu'))]
+
+
+def invite_history_markup(rows, has_newer: bool, has_older: bool):
+    # rows - строки страницы от новых к старым, курсор в кнопке - (timestamp, id) крайней
+    pages = []
+    if rows and has_newer:
+        pages.append(InlineKeyboardButton("⬅️ Новее", callback_data=encode('history_new', rows[0][1], rows[0][0])))
+    if rows and has_older:
+        pages.append(InlineKeyboardButton("Старее ➡️", callback_data=encode('history_old', rows[-1][1], rows[-1][0])))
+    return InlineKeyboardMarkup([pages, _MAIN_MENU_ROW])
+
+
+def search_results_markup(rows, has_more: bool):
+    # Приглашение каждому найденному; курсор в кнопке - (score, user_id) последней анкеты
+    buttons = [[InlineKeyboardButton(f"Отправить запрос {row[2] or row[1]}", callback_data=encode('invite', row[1]))]
+               for row in rows]
+    if has_more:
+        buttons.append([InlineKeyboardButton("Еще ➡️", callback_data=encode('search', rows[-1][0], rows[-1][1]))])
+    buttons.append(_MAIN_MENU_ROW)
+    return InlineKeyboardMarkup(buttons)
+
+
+# Карточка анкеты: строка users -> текст. Поля по позициям (user_id, username, game, rank, description)
+_card = '🎮 Игра: {2}\n👤 Никнейм: {1}\n🏆 Ранг: {3}\n📝 Описание: {4}'.format
+
+
+def profile_card(profile, title: str = None) -> str:
+    card = _card(*profile[:5])
+    return f"{title}\n{card}" if title else card
@@ -0,0 +1,256 @@
+"""Фронт для нескольких процессов бота: обновления распределяются по user_id.
+
+    python router.py --workers 4
+    python router.py --worker-url http://10.0.0.2:8601/updates --worker-url http://10.0.0.3:8601/updates
+
+Фронт получает обновления от Telegram (вебхук, если задан ALLIES_WEBHOOK_URL,
+иначе long polling) и пересылает каждое воркеру user_id % N. Все обновления
+пользователя попадают в один процесс и по порядку, как требует
+ConversationHandler. Воркер - обычный AlliesHub.py с ALLIES_WORKER_PORT:
+--workers N запускает N таких процессов локально и перезапускает упавшие.
+
+Общее состояние - в базе: анкеты, инвайты, состояния диалогов (ключ -
+пользователь, а он закреплен за одним воркером). Сообщения из outbox
+воркеры только пишут в таблицу, отправляет их фронт - один на токен,
+поэтому общий лимит Telegram и порядок сообщений в чате соблюдаются.
+Кэши в памяти воркера (анкеты, блокировки, скрытые из выдачи анкеты)
+сбрасываются по таблице invalidations (invalidations.py): чужое изменение
+доходит до них не позже чем через POLL_INTERVAL секунд после коммита.
+Число воркеров меняется только перезапуском всех процессов. Воркеры на
+разных машинах (--worker-url) должны видеть одну базу - PostgreSQL через
+ALLIES_DATABASE_URL (storage.py), SQLite годится только на одной машине, -
+и знать общий ALLIES_WORKER_SECRET.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import queue
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import settings
+import storage
+from outbox import Outbox
+from webhook import SECRET_HEADER, WebhookServer, update_user_id
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BATCH_SIZE = 500
+QUEUE_SIZE = 10000
+RETRY_MAX = 10
+# Как часто фронт забирает из outbox сообщения, записанные воркерами
+OUTBOX_FOLLOW_INTERVAL = 0.05
+
+
+class Router:
+    """Очередь и поток пересылки на каждого воркера.
+
+    Поток забирает из своей очереди все, что накопилось (до batch_size),
+    и отправляет одним POST списком. Ошибку повторяет с той же пачкой, пока
+    воркер не примет ее, - порядок обновлений не меняется, а переполненная
+    очередь останавливает прием (route ждет места).
+    """
+
+    def __init__(self, urls, secret: str = None, batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE):
+        self.urls = list(urls)
+        self.secret = secret
+        self.batch_size = batch_size
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in self.urls]
+        self._threads = []
+
+    def shard(self, data: dict) -> int:
+        return update_user_id(data) % len(self.urls)
+
+    def route(self, data: dict) -> None:
+        self._queues[self.shard(data)].put(data)
+
+    def start(self) -> None:
+        for i, (url, q) in enumerate(zip(self.urls, self._queues)):
+            thread = threading.Thread(target=self._forward, args=(url, q), name=f'router-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def is_alive(self) -> bool:
+        return bool(self._threads) and all(thread.is_alive() for thread in self._threads)
+
+    def stop(self) -> None:
+        # Сначала пересылаем все принятое
+        for q in self._queues:
+            q.join()
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _forward(self, url: str, q: queue.Queue) -> None:
+        parts = urlsplit(url)
+        conn = None
+        headers = {'Content-Type': 'application/json'}
+        if self.secret is not None:
+            headers[SECRET_HEADER] = self.secret
+        while True:
+            batch = [q.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            items = [data for data in batch if data is not None]
+            body = json.dumps(items, ensure_ascii=False).encode()
+
+            attempt = 0
+            while items:
+                try:
+                    if conn is None:
+                        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+                    conn.request('POST', parts.path, body, headers)
+                    response = conn.getresponse()
+                    response.read()
+                    if response.status == 200:
+                        break
+                    error = f'HTTP {response.status}'
+                except (OSError, http.client.HTTPException) as e:
+                    error = e
+                    conn.close()
+                    conn = None
+                attempt += 1
+                if attempt == 1 or attempt % 10 == 0:
+                    logger.warning("Воркер %s не принял %s обновлений: %s", url, len(items), error)
+                time.sleep(min(0.1 * 2 ** attempt, RETRY_MAX))
+
+            for _ in batch:
+                q.task_done()
+            if stop:
+                if conn is not None:
+                    conn.close()
+                return
+
+
+def spawn_worker(index: int, port: int, secret: str) -> subprocess.Popen:
+    env = dict(os.environ, ALLIES_WORKER_PORT=str(port), ALLIES_WORKER_SECRET=secret)
+    # Жив ли воркер, следит фронт; у каждого воркера свой порт метрик
+    env.pop('ALLIES_HEARTBEAT_FILE', None)
+    if os.environ.get('ALLIES_METRICS_PORT'):
+        env['ALLIES_METRICS_PORT'] = str(int(os.environ['ALLIES_METRICS_PORT']) + 1 + index)
+    kwargs = {}
+    if os.name == 'nt':
+        kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+    return subprocess.Popen([sys.executable, os.path.join(BASE_DIR, 'AlliesHub.py')], cwd=BASE_DIR, env=env, **kwargs)
+
+
+def stop_worker(process: subprocess.Popen, timeout: float) -> None:
+    process.send_signal(signal.CTRL_BREAK_EVENT if os.name == 'nt' else signal.SIGTERM)
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.warning("Воркер %s не остановился вовремя", process.pid)
+        process.kill()
+        process.wait()
+
+
+def poll_updates(bot, router: Router, stop: threading.Event) -> None:
+    # Long polling фронтом: сырые обновления пересылаются без разбора в Update
+    offset = None
+    url = f'{bot.base_url}/getUpdates'
+    while not stop.is_set():
+        params = {'timeout': 30, 'allowed_updates': ['message', 'callback_query']}
+        if offset is not None:
+            params['offset'] = offset
+        try:
+            updates = bot.request.post(url, params, timeout=40)
+        except Exception:
+            logger.exception("Ошибка getUpdates")
+            stop.wait(1)
+            continue
+        for data in updates:
+            router.route(data)
+            offset = data['update_id'] + 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=0, help='запустить столько локальных воркеров')
+    parser.add_argument('--base-port', type=int, default=int(os.environ.get('ALLIES_WORKER_BASE_PORT', 8601)))
+    parser.add_argument('--worker-url', action='append', default=[], help='воркер на другой машине (можно повторять)')
+    parser.add_argument('--drain-timeout', type=float, default=30)
+    args = parser.parse_args()
+    if not args.workers and not args.worker_url:
+        parser.error('нужен --workers или --worker-url')
+
+    if settings.WEBHOOK_URL and not settings.WEBHOOK_SECRET:
+        parser.error('вебхук без секрета не запускается: задайте ALLIES_WEBHOOK_SECRET')
+    from telegram import Bot, Update
+    from telegram.utils.request import Request
+
+    # Фронт не загружает бота целиком: ему нужны только схема базы и outbox
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    store = storage.get_storage()
+    store.init_schema()
+    outbox = Outbox(store)
+
+    secret = os.environ.get('ALLIES_WORKER_SECRET') or secrets.token_urlsafe(16)
+    ports = [args.base_port + i for i in range(args.workers)]
+    workers = [spawn_worker(i, port, secret) for i, port in enumerate(ports)]
+    urls = [f'http://127.0.0.1:{port}{settings.WORKER_PATH}' for port in ports] + args.worker_url
+    router = Router(urls, secret)
+    router.start()
+
+    bot = Bot(settings.BOT_TOKEN, request=Request(con_pool_size=settings.BOT_CON_POOL_SIZE))
+    outbox.start(bot, follow=OUTBOX_FOLLOW_INTERVAL)
+
+    stop = threading.Event()
+    for sig in [signal.SIGINT, signal.SIGTERM] + ([signal.SIGBREAK] if hasattr(signal, 'SIGBREAK') else []):
+        signal.signal(sig, lambda *_: stop.set())
+
+    server = poller = None
+    if settings.WEBHOOK_URL:
+        server = WebhookServer(router.route, host=settings.WEBHOOK_LISTEN, port=settings.WEBHOOK_PORT,
+                               path=settings.WEBHOOK_PATH, secret_token=settings.WEBHOOK_SECRET,
+                               workers=settings.WEBHOOK_WORKERS, queue_size=settings.WEBHOOK_QUEUE_SIZE)
+        server.start()
+        bot.set_webhook(settings.WEBHOOK_URL.rstrip('/') + settings.WEBHOOK_PATH,
+                        secret_token=settings.WEBHOOK_SECRET, max_connections=settings.WEBHOOK_WORKERS * 10,
+                        allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY])
+    else:
+        bot.delete_webhook()
+        poller = threading.Thread(target=poll_updates, args=(bot, router, stop), name='router-poll', daemon=True)
+        poller.start()
+    logger.info("Фронт: %s воркеров", len(urls))
+
+    while not stop.wait(1):
+        for i, process in enumerate(workers):
+            code = process.poll()
+            if code is not None:
+                logger.error("Воркер %s завершился с кодом %s, перезапускаем", i, code)
+                workers[i] = spawn_worker(i, ports[i], secret)
+        if settings.HEARTBEAT_FILE and router.is_alive() and outbox.is_alive() \
+                and (server is None or server.is_alive()) and (poller is None or poller.is_alive()):
+            with open(settings.HEARTBEAT_FILE, 'w') as f:
+                f.write(str(time.time()))
+
+    # Прием -> пересылка -> воркеры дорабатывают свое -> отправляем то, что они записали
+    logger.info("Остановка фронта...")
+    if server is not None:
+        server.stop()
+    if poller is not None:
+        poller.join()
+    router.stop()
+    for process in workers:
+        stop_worker(process, args.drain_timeout)
+    outbox.stop()
+    store.close()
+    logger.info("Фронт остановлен")
+
+
+if __name__ == '__main__':
+    main()
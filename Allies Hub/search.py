@@ -0,0 +1,53 @@
+import re
+import sqlite3
+
+# Поиск по описаниям анкет в игре смотрящего (FTS5, таблица users_fts).
+# Порядок - по BM25 (меньше - релевантнее), курсор страницы - (score, user_id)
+# последней выданной анкеты. CROSS JOIN фиксирует порядок обхода: сначала
+# совпадения из индекса, потом их анкеты, а не проверка каждой анкеты игры.
+
+# Слов запроса больше не берем: длинный запрос только замедляет поиск
+MAX_TERMS = 8
+
+SEARCH_START = (float('-inf'), 0)
+
+SEARCH_SQL = '''
+    SELECT * FROM (
+        SELECT bm25(users_fts) AS score, u.*
+        FROM users_fts
+        CROSS JOIN users u ON u.user_id = users_fts.rowid
+        WHERE users_fts MATCH :query
+        AND u.game_id = (SELECT game_id FROM users WHERE user_id = :me)
+        AND u.is_searching = TRUE
+        AND u.is_banned = FALSE
+        AND u.user_id != :me
+    )
+    WHERE (score, user_id) > (:score, :after)
+    ORDER BY score, user_id
+    LIMIT :limit
+'''
+
+
+def query_terms(text: str) -> list:
+    """Префиксы слов запроса: у длинных слов отрезается окончание,
+    "микрофоном" найдет и "микрофон" (вместо стемминга)."""
+    words = re.findall(r'\w+', text.casefold().replace('ё', 'е'))[:MAX_TERMS]
+    return [word[:max(5, len(word) - 2)] for word in words]
+
+
+def fts_query(text: str):
+    """Запрос FTS5 из ввода пользователя или None, если искать нечего.
+
+    Все слова обязательны, каждое ищется как префикс.
+    """
+    return ' '.join(f'"{term}"*' for term in query_terms(text)) or None
+
+
+def search_profiles(conn: sqlite3.Connection, user_id: int, text: str, cursor=SEARCH_START, limit: int = 5) -> list:
+    """Строки (score, *анкета) по запросу text после курсора (score, user_id)."""
+    query = fts_query(text)
+    if query is None:
+        return []
+    score, after = cursor
+    return conn.execute(SEARCH_SQL, {'query': query, 'me': user_id, 'score': score, 'after': after,
+                                     'limit': limit}).fetchall()
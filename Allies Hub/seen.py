@@ -0,0 +1,203 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_MASK = (1 << 64) - 1
+
+
+def filter_size(capacity: int, error_rate: float) -> tuple:
+    """-> (байт, хешей) Bloom-фильтра на capacity элементов с долей ложных срабатываний error_rate."""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    size = (bits + 7) // 8
+    hashes = max(1, round(size * 8 / capacity * math.log(2)))
+    return size, hashes
+
+
+def _positions(value: int, bits: int, hashes: int):
+    # splitmix64 от user_id, k позиций двойным хешированием
+    z = (value + 0x9E3779B97F4A7C15) & _MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    z ^= z >> 31
+    h1, h2 = z & 0xFFFFFFFF, (z >> 32) | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class _UserSeen:
+    __slots__ = ('current', 'previous', 'count', 'started', 'cursor', 'dirty')
+
+    def __init__(self, current: bytearray, previous, count: int, started: float, cursor: int = 0):
+        self.current = current      # фильтр текущего поколения
+        self.previous = previous    # прошлого поколения или None
+        self.count = count          # добавлено в текущее поколение
+        self.started = started      # time.time() начала текущего поколения
+        self.cursor = cursor        # где остановилась лента (user_id анкеты), 0 - в начале
+        self.dirty = False
+
+
+class SeenProfiles:
+    """Анкеты, которые пользователь уже пролистал: Bloom-фильтр на пользователя.
+
+    Фильтр из двух поколений по capacity анкет: проверяются оба, добавляется
+    в текущее. Текущее становится прошлым, когда в нем capacity анкет или ему
+    больше rotate_after секунд, - так пролистанная анкета снова появится
+    в ленте через одно-два поколения. Ложное срабатывание (доля error_rate
+    на поколение, до 2 * error_rate на оба) прячет непросмотренную анкету
+    до смены поколений.
+
+    cursor - место в ленте, до которого все просмотрено: с него лента
+    продолжается после перерыва (CandidateFeed).
+
+    load(user_id) -> (started, count, current, previous, cursor) или None,
+    save(rows) - запись пачки таких строк с user_id первым полем; изменения
+    копятся в памяти и пишутся flush(), потерянные при падении - не страшно.
+    recycle - когда лента пройдена до конца, начинать ее заново (reset).
+    """
+
+    def __init__(self, load, save, capacity: int = 1000, error_rate: float = 0.01,
+                 rotate_after: float = 14 * 24 * 3600, max_users: int = 10000, recycle: bool = True):
+        self._load = load
+        self._save = save
+        self.capacity = capacity
+        self.rotate_after = rotate_after
+        self.max_users = max_users
+        self.recycle = recycle
+        self.size, self.hashes = filter_size(capacity, error_rate)
+        self._bits = self.size * 8
+        self._users = OrderedDict()
+        self._evicted = {}  # вытесненные из памяти с несохраненными изменениями
+        self._lock = threading.Lock()
+
+    def add(self, user_id: int, profile_id: int) -> None:
+        with self._user(user_id) as entry:
+            current = entry.current
+            changed = False
+            for position in _positions(profile_id, self._bits, self.hashes):
+                mask = 1 << (position & 7)
+                if not current[position >> 3] & mask:
+                    current[position >> 3] |= mask
+                    changed = True
+            if changed:
+                entry.count += 1
+                entry.dirty = True
+
+    def unseen(self, user_id: int, rows) -> list:
+        """Строки анкет (user_id первым полем), которых пользователь еще не видел."""
+        with self._user(user_id) as entry:
+            if not entry.count and entry.previous is None:
+                return list(rows)
+            bits, hashes = self._bits, self.hashes
+            filters = (entry.current,) if entry.previous is None else (entry.current, entry.previous)
+            result = []
+            for row in rows:
+                positions = _positions(row[0], bits, hashes)
+                if not any(all(f[p >> 3] & (1 << (p & 7)) for p in positions) for f in filters):
+                    result.append(row)
+            return result
+
+    def cursor(self, user_id: int) -> int:
+        with self._user(user_id) as entry:
+            return entry.cursor
+
+    def set_cursor(self, user_id: int, cursor: int) -> None:
+        with self._user(user_id) as entry:
+            if entry.cursor != cursor:
+                entry.cursor = cursor
+                entry.dirty = True
+
+    def reset(self, user_id: int) -> None:
+        """Забывает просмотренное: лента начнется с начала."""
+        with self._user(user_id) as entry:
+            entry.current = bytearray(self.size)
+            entry.previous = None
+            entry.count = 0
+            entry.started = time.time()
+            entry.cursor = 0
+            entry.dirty = True
+
+    def flush(self) -> int:
+        """Пишет измененные фильтры одной пачкой; -> сколько записано."""
+        with self._lock:
+            dirty = list(self._evicted.items())
+            self._evicted.clear()
+            for user_id, entry in self._users.items():
+                if entry.dirty:
+                    dirty.append((user_id, entry))
+            rows = []
+            for user_id, entry in dirty:
+                entry.dirty = False
+                rows.append((user_id, entry.started, entry.count, bytes(entry.current),
+                             None if entry.previous is None else bytes(entry.previous), entry.cursor))
+        if not rows:
+            return 0
+        try:
+            self._save(rows)
+        except Exception:
+            # Не записалось - попробуем в следующий раз
+            with self._lock:
+                for user_id, entry in dirty:
+                    if self._users.get(user_id) is entry:
+                        entry.dirty = True
+                    else:
+                        self._evicted.setdefault(user_id, entry)
+            raise
+        return len(rows)
+
+    def memory_per_user(self) -> int:
+        """Байт фильтров на пользователя в памяти с обоими поколениями."""
+        return 2 * self.size
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._users)
+
+    @contextmanager
+    def _user(self, user_id):
+        # Запись пользователя под блокировкой; из базы читаем без нее
+        with self._lock:
+            entry = self._cached(user_id)
+        row = self._load(user_id) if entry is None else None
+        with self._lock:
+            # Пока читали, запись могли загрузить или вытеснить
+            entry = self._cached(user_id) or self._insert(user_id, entry or self._from_row(row))
+            if self._rotate(entry):
+                entry.dirty = True
+            yield entry
+
+    def _cached(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is not None:
+            self._users.move_to_end(user_id)
+            return entry
+        entry = self._evicted.pop(user_id, None)
+        return self._insert(user_id, entry) if entry is not None else None
+
+    def _insert(self, user_id, entry):
+        self._users[user_id] = entry
+        while len(self._users) > self.max_users:
+            old_id, old = self._users.popitem(last=False)
+            if old.dirty:
+                self._evicted[old_id] = old
+        return entry
+
+    def _from_row(self, row):
+        if row is not None:
+            started, count, current, previous, cursor = row
+            # Фильтр другого размера (сменили capacity) не читается - начинаем заново
+            if len(current) == self.size and (previous is None or len(previous) == self.size):
+                return _UserSeen(bytearray(current), None if previous is None else bytearray(previous),
+                                 count, started, cursor)
+        return _UserSeen(bytearray(self.size), None, 0, time.time())
+
+    def _rotate(self, entry) -> bool:
+        if entry.count < self.capacity and time.time() - entry.started < self.rotate_after:
+            return False
+        # Прошлое поколение старше rotate_after - забываем совсем
+        entry.previous = entry.current if entry.count and time.time() - entry.started < 2 * self.rotate_after \
+            else None
+        entry.current = bytearray(self.size)
+        entry.count = 0
+        entry.started = time.time()
+        return True
@@ -0,0 +1,39 @@
+"""Настройки процесса из окружения: токен, вебхук, воркеры router.py, метрики.
+
+Отдельно от AlliesHub.py, чтобы фронт router.py брал их, не загружая
+обработчики, кэши и прочее состояние бота.
+"""
+import os
+
+# Токен можно передать через окружение: его же получают воркеры router.py
+BOT_TOKEN = os.environ.get('ALLIES_BOT_TOKEN', "*******************")
+
+# Файл, который бот периодически обновляет для супервизора (start_bot2.py)
+HEARTBEAT_FILE = os.environ.get('ALLIES_HEARTBEAT_FILE')
+HEARTBEAT_INTERVAL = 10
+# Сколько ждать доработки уже полученных обновлений при остановке
+DRAIN_TIMEOUT = 30
+
+# Режим вебхука включается заданием публичного URL (TLS завершается на прокси).
+# Без него бот работает через long polling. Без ALLIES_WEBHOOK_SECRET вебхук не запускается
+WEBHOOK_URL = os.environ.get('ALLIES_WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('ALLIES_WEBHOOK_SECRET')
+WEBHOOK_LISTEN = os.environ.get('ALLIES_WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('ALLIES_WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_WORKERS = int(os.environ.get('ALLIES_WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('ALLIES_WEBHOOK_QUEUE_SIZE', 1000))
+
+# Воркер за фронтом router.py: принимает от него пачки обновлений на этом порту.
+# Вебхук (или polling) и отправку сообщений из outbox ведет фронт.
+WORKER_LISTEN = os.environ.get('ALLIES_WORKER_LISTEN', '127.0.0.1')
+WORKER_PORT = int(os.environ['ALLIES_WORKER_PORT']) if os.environ.get('ALLIES_WORKER_PORT') else None
+WORKER_SECRET = os.environ.get('ALLIES_WORKER_SECRET')
+WORKER_PATH = '/updates'
+
+# Эндпоинт метрик Prometheus включается заданием порта; /stats - только для админов
+METRICS_LISTEN = os.environ.get('ALLIES_METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.environ['ALLIES_METRICS_PORT']) if os.environ.get('ALLIES_METRICS_PORT') else None
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get('ALLIES_ADMIN_IDS', '').split(',') if user_id.strip()}
+# Пул соединений к Bot API: воркеры диспетчера (4 по умолчанию) + запас, как в Updater
+BOT_CON_POOL_SIZE = 8
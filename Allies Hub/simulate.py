@@ -0,0 +1,220 @@
+"""Нагрузочный прогон подбора: параллельные просмотр, инвайты и принятие через настоящие обработчики.
+
+    python simulate.py --db big.db --threads 8 --duration 30
+    python simulate.py --scale 10000,100000,1000000 --duration 15 --json scale.json
+    python simulate.py --db big.db --pg postgresql://localhost/allies
+
+База - от populate.py. Активные пользователи (--actors, из анкет в поиске)
+распределены по потокам как в вебхуке: обновления одного пользователя идут
+по порядку в одном потоке. Каждое действие - обновление через диспетчер
+с обработчиками бота (AlliesHub.add_handlers), бот - FakeBot:
+  next_    - следующая анкета (resume_search, если анкета еще не показана);
+  invite_  - запрос показанной анкете;
+  accept_  - принятие входящего запроса из истории.
+Печатает обновлений в секунду и p50/p99 по действиям.
+--scale создает базу каждого размера и прогоняет ее в отдельном процессе.
+С --pg прогон идет на PostgreSQL: база SQLite копируется в нее (данные там заменяются).
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from telegram.ext import Dispatcher
+
+import db
+import storage
+from callbacks import encode
+from fakebot import FakeBot, UpdateFactory, button_arg
+
+ACTIONS = ('next_', 'invite_', 'accept_')
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class Actor:
+    __slots__ = ('user_id', 'shown')
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.shown = None  # user_id анкеты на экране
+
+
+def shown_profile(bot: FakeBot, user_id: int):
+    return button_arg(bot.replies.get(user_id), 'next')
+
+
+def worker(store, dispatcher, bot, updates, actors, weights, deadline, rnd, samples) -> None:
+    while time.monotonic() < deadline:
+        actor = rnd.choice(actors)
+        action = rnd.choices(ACTIONS, weights)[0]
+        if action == 'accept_':
+            with store.reading() as conn:
+                row = conn.execute("SELECT from_user_id FROM invites WHERE to_user_id = ? AND status = 'pending' LIMIT 1",
+                                   (actor.user_id,)).fetchone()
+            if row is None:
+                action = 'next_'
+            else:
+                data = encode('accept', row[0])
+        if action == 'invite_':
+            if actor.shown is None:
+                action = 'next_'
+            else:
+                data = encode('invite', actor.shown)
+        if action == 'next_':
+            data = encode('next', actor.shown) if actor.shown is not None else encode('resume_search')
+
+        update = updates.callback(actor.user_id, data)
+        started = time.perf_counter()
+        dispatcher.process_update(update)
+        samples[action].append(time.perf_counter() - started)
+        actor.shown = shown_profile(bot, actor.user_id)
+
+
+def run(path: str, threads: int, actors: int, duration: float, weights, seed: int, pg: str = None) -> dict:
+    if pg:
+        from storage_pg import copy_from_sqlite
+
+        storage.configure(pg)
+        store = storage.get_storage()
+        store.init_schema()
+        copy_from_sqlite(path, store, replace=True)
+    else:
+        db.configure(path)
+    import AlliesHub as hub  # схема и кэши - на базе path
+    from persistence import SQLitePersistence
+
+    rnd = random.Random(seed)
+    with hub.store.reading() as conn:
+        user_ids = [row[0] for row in conn.execute(
+            'SELECT user_id FROM users WHERE is_searching = TRUE AND is_banned = FALSE ORDER BY random() LIMIT ?',
+            (actors,)
+        ).fetchall()]
+    if not user_ids:
+        raise SystemExit(f'{path}: нет анкет в поиске, сначала populate.py')
+
+    bot = FakeBot(record_calls=False)
+    dispatcher = Dispatcher(bot, queue.Queue(), persistence=SQLitePersistence())
+    hub.add_handlers(dispatcher)
+    updates = UpdateFactory(bot)
+    hub.writes.start()
+
+    # Как в вебхуке: пользователь закреплен за одним потоком
+    groups = [[Actor(user_id) for user_id in user_ids[i::threads]] for i in range(threads)]
+    samples = [{action: [] for action in ACTIONS} for _ in groups]
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(hub.store, dispatcher, bot, updates, group, weights, deadline,
+                                                  random.Random(seed + i), samples[i]))
+            for i, group in enumerate(groups) if group]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    hub.writes.stop()
+
+    merged = {action: [s for group in samples for s in group[action]] for action in ACTIONS}
+    total = sum(len(s) for s in merged.values())
+    with hub.store.reading() as conn:
+        users = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    hub.store.close()
+    return {
+        'backend': hub.store.name,
+        'users': users,
+        'threads': len(pool),
+        'updates': total,
+        'updates_per_s': total / elapsed,
+        'api_calls': bot.count,
+        'outbox_queued': hub.outbox.queued,
+        'actions': {
+            action: {
+                'updates': len(s),
+                'p50_ms': statistics.median(s) * 1000,
+                'p99_ms': percentile(s, 0.99) * 1000,
+            }
+            for action, s in merged.items() if s
+        },
+    }
+
+
+def print_result(result: dict) -> None:
+    print(f"{result['backend']}, {result['users']} анкет, {result['threads']} потоков: {result['updates']} обновлений, "
+          f"{result['updates_per_s']:.0f}/с, вызовов API {result['api_calls']}, в outbox {result['outbox_queued']}")
+    for action, row in result['actions'].items():
+        print(f"  {action:>8} {row['updates']:>8} p50 {row['p50_ms']:7.2f} мс  p99 {row['p99_ms']:7.2f} мс")
+
+
+def run_scale(sizes, args) -> list:
+    # Каждый размер - новая база и отдельный процесс: у бота состояние на уровне модуля
+    import populate
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix='allies-sim-')
+    for size in sizes:
+        path = os.path.join(workdir, f'sim{size}.db')
+        started = time.perf_counter()
+        populate.create(path, size, seed=args.seed)
+        print(f'база на {size} анкет: {time.perf_counter() - started:.1f} c')
+        out = os.path.join(workdir, f'sim{size}.json')
+        command = [sys.executable, os.path.abspath(__file__), '--db', path, '--json', out,
+                   '--threads', str(args.threads), '--actors', str(args.actors),
+                   '--duration', str(args.duration), '--mix', args.mix, '--seed', str(args.seed)]
+        if args.pg:
+            command += ['--pg', args.pg]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(out, encoding='utf-8') as f:
+            results.append(json.load(f))
+        print_result(results[-1])
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    print(f'\n{"анкет":>10} {"обн/с":>8}' + ''.join(f' {a + " p50":>12} {a + " p99":>12}' for a in ACTIONS))
+    for result in results:
+        cells = []
+        for action in ACTIONS:
+            row = result['actions'].get(action)
+            cells += [f"{row['p50_ms']:>12.2f}", f"{row['p99_ms']:>12.2f}"] if row else [f'{"-":>12}'] * 2
+        print(f"{result['users']:>10} {result['updates_per_s']:>8.0f} " + ' '.join(cells))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--db', help='база от populate.py (ее изменят: инвайты, статусы)')
+    source.add_argument('--scale', help='размеры популяции через запятую')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--actors', type=int, default=2000, help='активных пользователей')
+    parser.add_argument('--duration', type=float, default=20, help='секунд на прогон')
+    parser.add_argument('--mix', default='80,15,5', help='доли next_,invite_,accept_')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='записать результат в файл')
+    parser.add_argument('--pg', help='прогон на PostgreSQL по этому URL')
+    args = parser.parse_args()
+
+    if args.scale:
+        result = run_scale([int(size) for size in args.scale.split(',')], args)
+    else:
+        weights = [float(w) for w in args.mix.split(',')]
+        result = run(args.db, args.threads, args.actors, args.duration, weights, args.seed, args.pg)
+        print_result(result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
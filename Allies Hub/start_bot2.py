@@ -1,21 +1,106 @@
+import argparse
+import os
+import signal
 import subprocess
+import sys
 import time
 
-RESTART_INTERVAL = 180  # 3 минуты
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-while True:
+HEALTH_TIMEOUT = 60     # секунд без heartbeat - бот завис
+DRAIN_TIMEOUT = 40      # сколько ждать штатной остановки перед kill
+BACKOFF_MIN = 1
+BACKOFF_MAX = 300
+STABLE_RUN = 120        # после стольких секунд работы backoff сбрасывается
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Супервизор бота: перезапуск при падении или зависании")
+    parser.add_argument('--python', default=os.environ.get('ALLIES_PYTHON', sys.executable),
+                        help="интерпретатор для запуска бота (по умолчанию текущий)")
+    parser.add_argument('--script', default=os.environ.get('ALLIES_BOT_SCRIPT', os.path.join(BASE_DIR, 'AlliesHub.py')))
+    parser.add_argument('--heartbeat-file', default=os.environ.get('ALLIES_HEARTBEAT_FILE',
+                                                                   os.path.join(BASE_DIR, 'bot.heartbeat')))
+    parser.add_argument('--health-timeout', type=float, default=HEALTH_TIMEOUT)
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT)
+    return parser.parse_args()
+
+
+def start_bot(args):
     print("🚀 Запуск бота...")
-    process = subprocess.Popen([
-        r"D:\Allies Hub\.venv\Scripts\python.exe", "AlliesHub.py"
-    ])
+    env = dict(os.environ, ALLIES_HEARTBEAT_FILE=args.heartbeat_file)
+    kwargs = {}
+    if os.name == 'nt':
+        # Отдельная группа процессов, чтобы можно было послать CTRL_BREAK_EVENT
+        kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+    return subprocess.Popen([args.python, args.script], cwd=os.path.dirname(args.script), env=env, **kwargs)
 
-    time.sleep(RESTART_INTERVAL)
 
-    print("🔁 Перезапуск бота...")
-    process.terminate()
+def stop_bot(process, timeout):
+    # Штатная остановка: бот дорабатывает полученные обновления и сохраняет состояние
+    print("🛑 Останавливаем бота...")
+    if os.name == 'nt':
+        process.send_signal(signal.CTRL_BREAK_EVENT)
+    else:
+        process.send_signal(signal.SIGTERM)
     try:
-        process.wait(timeout=10)
+        process.wait(timeout=timeout)
     except subprocess.TimeoutExpired:
+        print("⚠️ Бот не остановился вовремя, завершаем принудительно")
         process.kill()
+        process.wait()
+
+
+def heartbeat_age(path):
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def supervise(args):
+    backoff = BACKOFF_MIN
+    while True:
+        try:
+            os.remove(args.heartbeat_file)
+        except OSError:
+            pass
+
+        process = start_bot(args)
+        started = time.monotonic()
+        reason = None
+
+        try:
+            while reason is None:
+                time.sleep(1)
+                code = process.poll()
+                if code is not None:
+                    reason = f"бот завершился с кодом {code}"
+                    break
+                age = heartbeat_age(args.heartbeat_file)
+                uptime = time.monotonic() - started
+                # Пока бот стартует, heartbeat может еще не появиться
+                if (age is None and uptime > args.health_timeout) or (age is not None and age > args.health_timeout):
+                    reason = "нет heartbeat"
+                    stop_bot(process, args.drain_timeout)
+        except KeyboardInterrupt:
+            stop_bot(process, args.drain_timeout)
+            raise
+
+        if time.monotonic() - started > STABLE_RUN:
+            backoff = BACKOFF_MIN
+        print(f"♻️ Перезапуск через {backoff} с: {reason}")
+        time.sleep(backoff)
+        backoff = min(backoff * 2, BACKOFF_MAX)
+
+
+def main():
+    args = parse_args()
+    try:
+        supervise(args)
+    except KeyboardInterrupt:
+        pass
+
 
-    print("⏳ Перезапуск через несколько секунд...\n")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,449 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+import db
+from games import add_alias, add_game, resolve_game
+from matchmaking import nearest_candidates
+from migrations import init_schema
+from search import search_profiles
+
+# Слой хранения: все запросы бота к анкетам, инвайтам, жалобам, ленте,
+# состояниям диалогов и outbox. Бэкенд выбирается URL базы:
+# postgresql://... - PostgreSQL (storage_pg.py), иначе SQLite через db.py.
+#
+# Методы записи принимают соединение открытой транзакции (store.transaction()
+# или пачки WriteBehind), чтобы несколько операций шли одной транзакцией.
+# Соединения обоих бэкендов принимают параметры ? и :name, поэтому общий SQL
+# написан один раз, а бэкенды переопределяют только то, что расходится в диалектах.
+DATABASE_URL = os.environ.get('ALLIES_DATABASE_URL')
+# PRAGMA auto_vacuum = INCREMENTAL и страниц за один шаг compact() в SQLite
+AUTO_VACUUM_INCREMENTAL = 2
+VACUUM_STEP = 1000
+
+logger = logging.getLogger(__name__)
+
+_url = DATABASE_URL
+_storage = None
+
+# Каждая часть UNION берет не больше limit строк по своему индексу
+# (from_user_id, timestamp) или (to_user_id, timestamp) в invites и в архиве
+# invites_archive (id в них не пересекаются), затем части сливаются
+_INVITE_HISTORY_PART = '''
+    SELECT * FROM (
+        SELECT i.id, i.timestamp, i.status, {outgoing} AS outgoing, u.username
+        FROM {table} i
+        JOIN users u ON u.user_id = i.{partner}
+        WHERE i.{own} = :user_id AND (i.timestamp, i.id) {{op}} (:ts, :id)
+        ORDER BY i.timestamp {{order}}, i.id {{order}}
+        LIMIT :limit
+    ) AS {alias}
+'''
+INVITE_HISTORY_SQL = '    UNION ALL'.join(
+    _INVITE_HISTORY_PART.format(table=table, alias=alias + suffix, outgoing=outgoing, own=own, partner=partner)
+    for table, suffix in (('invites', ''), ('invites_archive', '_archived'))
+    for alias, outgoing, own, partner in (('sent', 1, 'from_user_id', 'to_user_id'),
+                                          ('received', 0, 'to_user_id', 'from_user_id'))
+) + '''    ORDER BY timestamp {order}, id {order}
+    LIMIT :limit
+'''
+INVITE_HISTORY_OLDER_SQL = INVITE_HISTORY_SQL.format(op='<', order='DESC')
+INVITE_HISTORY_NEWER_SQL = INVITE_HISTORY_SQL.format(op='>', order='ASC')
+
+
+class Storage(ABC):
+    """Запросы, общие для SQLite и PostgreSQL. Соединения дает бэкенд:
+    без любого из абстрактных методов он не создается."""
+
+    name = None
+
+    # Соединения
+
+    @abstractmethod
+    def reading(self):
+        """Контекст чтения вне транзакции, отдает соединение."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def transaction(self):
+        """Контекст транзакции записи, отдает соединение."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def init_schema(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_trace(self, callback) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_observer(self, callback) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def lock_user(self, conn, user_id: int) -> None:
+        """До конца транзакции сериализует записи, завязанные на пользователя."""
+
+    # Анкеты
+
+    def get_profiles(self, user_ids) -> dict:
+        placeholders = ', '.join('?' * len(user_ids))
+        with self.reading() as conn:
+            rows = conn.execute(f'SELECT * FROM users WHERE user_id IN ({placeholders})', tuple(user_ids)).fetchall()
+        return {row[0]: row for row in rows}
+
+    def banned_users(self, conn=None) -> list:
+        if conn is None:
+            with self.reading() as conn:
+                return self.banned_users(conn)
+        return conn.execute('SELECT user_id, ban_end FROM users WHERE is_banned = TRUE').fetchall()
+
+    def lift_expired_bans(self, conn, now: int) -> list:
+        # Все истекшие блокировки снимаются одним UPDATE по индексу idx_users_ban_end
+        lifted = [row[0] for row in conn.execute(
+            'SELECT user_id FROM users WHERE is_banned = TRUE AND ban_end <= ?', (now,)
+        ).fetchall()]
+        if lifted:
+            conn.execute('''
+                UPDATE users SET is_banned = FALSE, ban_end = NULL
+                WHERE is_banned = TRUE AND ban_end <= ?
+            ''', (now,))
+        return lifted
+
+    def resolve_game(self, conn, text: str):
+        """(game_id, название) из каталога или None; каталог не меняется."""
+        return resolve_game(conn, text)
+
+    def add_game(self, conn, name: str, aliases=()) -> int:
+        return add_game(conn, name, aliases)
+
+    def add_alias(self, conn, game_id: int, text: str) -> None:
+        add_alias(conn, game_id, text)
+
+    def save_profile(self, conn, user_id: int, username, game: str, game_id: int, rank: str, tier,
+                     description: str) -> None:
+        # Блокировка анкеты переживает ее пересоздание
+        conn.execute('''
+            INSERT INTO users (user_id, username, game, game_id, rank, tier, description, is_searching)
+            VALUES (?, ?, ?, ?, ?, ?, ?, TRUE)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = excluded.username, game = excluded.game, game_id = excluded.game_id,
+                rank = excluded.rank, tier = excluded.tier, description = excluded.description,
+                is_searching = TRUE
+        ''', (user_id, username, game, game_id, rank, tier, description))
+
+    def get_rank(self, conn, user_id: int):
+        row = conn.execute('SELECT rank FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row and row[0]
+
+    def get_game(self, conn, user_id: int):
+        row = conn.execute('SELECT game FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row and row[0]
+
+    def set_game(self, conn, user_id: int, game: str, game_id: int, tier) -> None:
+        conn.execute('UPDATE users SET game = ?, game_id = ?, tier = ? WHERE user_id = ?',
+                     (game, game_id, tier, user_id))
+
+    def set_rank(self, conn, user_id: int, rank: str, tier) -> None:
+        conn.execute('UPDATE users SET rank = ?, tier = ? WHERE user_id = ?', (rank, tier, user_id))
+
+    def set_description(self, conn, user_id: int, description: str) -> None:
+        conn.execute('UPDATE users SET description = ? WHERE user_id = ?', (description, user_id))
+
+    def set_searching(self, conn, user_id: int, is_searching: bool) -> None:
+        conn.execute('UPDATE users SET is_searching = ? WHERE user_id = ?', (is_searching, user_id))
+
+    def ban(self, conn, user_id: int, ban_end: int) -> bool:
+        # Уже заблокированного не трогаем
+        return conn.execute('''
+            UPDATE users
+            SET is_banned = TRUE, ban_end = ?, is_searching = FALSE
+            WHERE user_id = ? AND is_banned = FALSE
+        ''', (ban_end, user_id)).rowcount > 0
+
+    # Инвайты
+
+    def create_invite(self, conn, from_user_id: int, to_user_id: int) -> bool:
+        # Проверка и вставка в одной транзакции, чтобы двойное нажатие не создало два запроса
+        self.lock_user(conn, from_user_id)
+        already_sent = conn.execute('''
+            SELECT 1 FROM invites
+            WHERE from_user_id = ? AND to_user_id = ?
+            AND status = 'pending'
+        ''', (from_user_id, to_user_id)).fetchone() is not None
+        if not already_sent:
+            conn.execute('INSERT INTO invites (from_user_id, to_user_id) VALUES (?, ?)', (from_user_id, to_user_id))
+        return not already_sent
+
+    def set_invite_status(self, conn, from_user_id: int, to_user_id: int, status: str) -> bool:
+        # Условный UPDATE: из двух быстрых нажатий True получит только одно;
+        # отвеченные и истекшие строки пары не трогаем
+        return conn.execute('''
+            UPDATE invites SET status = ?
+            WHERE from_user_id = ? AND to_user_id = ?
+            AND status = 'pending'
+        ''', (status, from_user_id, to_user_id)).rowcount > 0
+
+    def expire_invites(self, conn, before: str, limit: int) -> int:
+        # Запросы без ответа старше before ("%Y-%m-%d %H:%M:%S", UTC) - пачкой
+        # по частичному индексу idx_invites_pending_time
+        return conn.execute('''
+            UPDATE invites SET status = 'expired'
+            WHERE id IN (
+                SELECT id FROM invites
+                WHERE status = 'pending' AND timestamp < ?
+                LIMIT ?
+            )
+        ''', (before, limit)).rowcount
+
+    def archive_invites(self, conn, before: str, limit: int) -> int:
+        # Отвеченные и истекшие старше before переносятся в invites_archive
+        ids = [row[0] for row in conn.execute('''
+            SELECT id FROM invites
+            WHERE status != 'pending' AND timestamp < ?
+            LIMIT ?
+        ''', (before, limit)).fetchall()]
+        if ids:
+            marks = ', '.join('?' * len(ids))
+            conn.execute(f'''
+                INSERT INTO invites_archive (id, from_user_id, to_user_id, status, timestamp)
+                SELECT id, from_user_id, to_user_id, status, timestamp FROM invites
+                WHERE id IN ({marks})
+            ''', ids)
+            conn.execute(f'DELETE FROM invites WHERE id IN ({marks})', ids)
+        return len(ids)
+
+    def compact(self) -> int:
+        """Возвращает место, освобожденное удалениями, -> число освобожденных страниц."""
+        return 0
+
+    @abstractmethod
+    def vacuum(self) -> None:
+        """Полное сжатие базы; блокирует запись, только при остановленном боте (maintenance.py)."""
+        raise NotImplementedError
+
+    def invite_history(self, user_id: int, cursor, newer: bool, limit: int) -> list:
+        """Строки (id, timestamp, status, outgoing, username) от курсора (timestamp, id)."""
+        ts, invite_id = cursor
+        sql = INVITE_HISTORY_NEWER_SQL if newer else INVITE_HISTORY_OLDER_SQL
+        with self.reading() as conn:
+            return conn.execute(sql, {'user_id': user_id, 'ts': ts, 'id': invite_id, 'limit': limit}).fetchall()
+
+    # Жалобы
+
+    def add_report(self, conn, reported_user_id: int, reporter_user_id: int, repeat_before: str) -> bool:
+        # Одна жалоба на пользователя от каждого; повторная считается, только
+        # если прошлая старше repeat_before ("%Y-%m-%d %H:%M:%S", UTC)
+        return conn.execute('''
+            INSERT INTO reports (reported_user_id, reporter_user_id)
+            VALUES (?, ?)
+            ON CONFLICT (reporter_user_id, reported_user_id) DO UPDATE SET timestamp = CURRENT_TIMESTAMP
+            WHERE reports.timestamp < ?
+        ''', (reported_user_id, reporter_user_id, repeat_before)).rowcount > 0
+
+    def report_window(self, conn, reported_user_id: int):
+        """(window_start, current, previous) или None."""
+        return conn.execute(
+            'SELECT window_start, current, previous FROM report_counts WHERE reported_user_id = ?',
+            (reported_user_id,)
+        ).fetchone()
+
+    def save_report_window(self, conn, reported_user_id: int, window_start: int, current: int,
+                           previous: int) -> None:
+        conn.execute('''
+            INSERT INTO report_counts (reported_user_id, window_start, current, previous)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (reported_user_id) DO UPDATE SET
+                window_start = excluded.window_start, current = excluded.current, previous = excluded.previous
+        ''', (reported_user_id, window_start, current, previous))
+
+    def reset_report_window(self, conn, reported_user_id: int) -> None:
+        conn.execute('DELETE FROM report_counts WHERE reported_user_id = ?', (reported_user_id,))
+
+    # Лента и поиск
+
+    def nearest_candidates(self, user_id: int, after_user_id: int, limit: int) -> list:
+        with self.reading() as conn:
+            return nearest_candidates(conn, user_id, after_user_id, limit)
+
+    def load_seen(self, user_id: int):
+        """Фильтр просмотренных анкет (seen.py): (started_at, count, bits, previous, cursor) или None."""
+        with self.reading() as conn:
+            return conn.execute('SELECT started_at, count, bits, previous, cursor FROM seen_profiles '
+                                'WHERE user_id = ?', (user_id,)).fetchone()
+
+    def save_seen(self, conn, rows) -> None:
+        """rows - (user_id, started_at, count, bits, previous, cursor)."""
+        conn.executemany('''
+            INSERT INTO seen_profiles (user_id, started_at, count, bits, previous, cursor) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                started_at = excluded.started_at, count = excluded.count,
+                bits = excluded.bits, previous = excluded.previous, cursor = excluded.cursor
+        ''', rows)
+
+    @abstractmethod
+    def search_profiles(self, user_id: int, text: str, cursor, limit: int) -> list:
+        raise NotImplementedError
+
+    # Состояния диалогов (persistence.py)
+
+    def load_state(self, kind: str) -> list:
+        with self.reading() as conn:
+            return conn.execute('SELECT key, data FROM bot_state WHERE kind = ?', (kind,)).fetchall()
+
+    def save_state(self, kind: str, key: str, data: str) -> None:
+        with self.transaction() as conn:
+            conn.execute('''
+                INSERT INTO bot_state (kind, key, data) VALUES (?, ?, ?)
+                ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data
+            ''', (kind, key, data))
+
+    def delete_state(self, kind: str, key: str) -> None:
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM bot_state WHERE kind = ? AND key = ?', (kind, key))
+
+    # Исходящие сообщения (outbox.py)
+
+    @abstractmethod
+    def outbox_add(self, chat_id: int, payload: str, created_at: float) -> int:
+        raise NotImplementedError
+
+    def outbox_after(self, last_id: int) -> list:
+        """Строки (id, chat_id, payload, attempts) с id больше last_id по порядку."""
+        with self.reading() as conn:
+            return conn.execute('SELECT id, chat_id, payload, attempts FROM outbox WHERE id > ? ORDER BY id',
+                                (last_id,)).fetchall()
+
+    def outbox_delete(self, item_ids) -> None:
+        # Отправленные строки удаляются пачкой, одной транзакцией
+        with self.transaction() as conn:
+            conn.executemany('DELETE FROM outbox WHERE id = ?', [(item_id,) for item_id in item_ids])
+
+    def outbox_set_attempts(self, item_id: int, attempts: int) -> None:
+        with self.transaction() as conn:
+            conn.execute('UPDATE outbox SET attempts = ? WHERE id = ?', (attempts, item_id))
+
+    # Сбросы кэшей между процессами (invalidations.py)
+
+    def invalidation_add(self, conn, user_id: int, kind: str, ban_end, origin: str, created_at: float) -> None:
+        # В SQLite писатель один: id растут в порядке фиксации
+        conn.execute('''
+            INSERT INTO invalidations (user_id, kind, ban_end, origin, created_at) VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, kind, ban_end, origin, created_at))
+
+    def invalidations_last_id(self) -> int:
+        with self.reading() as conn:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM invalidations').fetchone()[0]
+
+    def invalidations_after(self, last_id: int) -> list:
+        """Строки (id, user_id, kind, ban_end, origin) с id больше last_id по порядку."""
+        with self.reading() as conn:
+            return conn.execute('''
+                SELECT id, user_id, kind, ban_end, origin FROM invalidations WHERE id > ? ORDER BY id
+            ''', (last_id,)).fetchall()
+
+    def invalidations_prune(self, before: float) -> None:
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM invalidations WHERE created_at < ?', (before,))
+
+
+class SQLiteStorage(Storage):
+    """Файл SQLite через db.py: соединение на поток, один писатель (BEGIN IMMEDIATE)."""
+
+    name = 'sqlite'
+
+    @contextmanager
+    def reading(self):
+        yield db.get_connection()
+
+    def transaction(self):
+        return db.transaction()
+
+    def set_trace(self, callback) -> None:
+        db.set_trace(callback)
+
+    def set_observer(self, callback) -> None:
+        db.set_observer(callback)
+
+    def close(self) -> None:
+        db.close()
+
+    def init_schema(self) -> None:
+        conn = db.get_connection()
+        # Место от удаленных строк (архив инвайтов) compact() возвращает по частям
+        # только при auto_vacuum = INCREMENTAL. После journal_mode = WAL режим
+        # меняет только VACUUM: в новом пустом файле он мгновенный, существующую
+        # базу переводит python maintenance.py vacuum при остановленном боте
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            if conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0:
+                self.vacuum()
+            else:
+                logger.warning("auto_vacuum не INCREMENTAL: место архивированных инвайтов не возвращается "
+                               "файлу, выполните python maintenance.py vacuum при остановленном боте")
+        init_schema(conn)
+
+    def vacuum(self) -> None:
+        # Переписывает файл целиком под эксклюзивной блокировкой
+        conn = db.get_connection()
+        conn.execute(f'PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}')
+        conn.execute('VACUUM')
+
+    def search_profiles(self, user_id: int, text: str, cursor, limit: int) -> list:
+        return search_profiles(db.get_connection(), user_id, text, cursor, limit)
+
+    def compact(self) -> int:
+        # Свободные страницы возвращаются файлу по VACUUM_STEP за транзакцию,
+        # чтобы запись бота не ждала долго. incremental_vacuum освобождает по
+        # странице на шаг оператора, а execute делает один шаг - поэтому
+        # executescript, который выполняет оператор до конца
+        conn = db.get_connection()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            # incremental_vacuum ничего не делает, страницы остаются свободными
+            return 0
+        freed = 0
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        while free:
+            try:
+                conn.executescript(f'BEGIN IMMEDIATE; PRAGMA incremental_vacuum({VACUUM_STEP}); COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            left = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if left >= free:
+                break
+            freed, free = freed + free - left, left
+        return freed
+
+    def outbox_add(self, chat_id: int, payload: str, created_at: float) -> int:
+        with self.transaction() as conn:
+            return conn.execute('INSERT INTO outbox (chat_id, payload, created_at) VALUES (?, ?, ?)',
+                                (chat_id, payload, created_at)).lastrowid
+
+
+def configure(url: str = None) -> None:
+    """Бэкенд для get_storage(): URL PostgreSQL или None - SQLite (db.configure)."""
+    global _url, _storage
+    if _storage is not None:
+        _storage.close()
+    _url = url
+    _storage = None
+
+
+def open_storage(url: str = None) -> Storage:
+    if url and url.startswith(('postgres://', 'postgresql://')):
+        from storage_pg import PostgresStorage  # psycopg2 нужен только этому бэкенду
+        return PostgresStorage(url)
+    return SQLiteStorage()
+
+
+def get_storage() -> Storage:
+    """Общее хранилище процесса, открывается при первом обращении."""
+    global _storage
+    if _storage is None:
+        _storage = open_storage(_url)
+    return _storage
@@ -0,0 +1,608 @@
+"""Хранилище на PostgreSQL: пул соединений и подготовленные на сервере операторы.
+
+    ALLIES_DATABASE_URL=postgresql://allies@localhost/allies python AlliesHub.py
+    python storage_pg.py allies.db postgresql://allies@localhost/allies   # перенос данных из SQLite
+
+Схема та же, что у SQLite после migrations.py (номера версий общие), ее
+создает init_schema при старте. Каждое соединение пула готовит оператор
+при первом использовании (PREPARE) и дальше выполняет его через EXECUTE:
+разбор и план запроса - один раз на соединение. Несколько процессов бота
+(router.py) могут работать с одной базой, в том числе с разных машин.
+
+База должна быть в UTF-8 с локалью, знающей кириллицу (ru_RU.UTF-8,
+C.UTF-8): по lower() строится индекс поиска по описаниям.
+"""
+import argparse
+import functools
+import io
+import itertools
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extras import execute_batch
+from psycopg2.pool import PoolError
+
+from games import seed as seed_games
+from search import query_terms
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.environ.get('ALLIES_PG_POOL_SIZE', 16))
+# Сколько ждать свободного соединения, прежде чем считать пул исчерпанным
+POOL_TIMEOUT = 30
+# Подготовленных операторов на соединение; самые старые освобождаются (DEALLOCATE)
+MAX_PREPARED = 500
+# executemany: столько EXECUTE уходит на сервер одним запросом
+BATCH_PAGE = 100
+# Ключ pg_advisory_xact_lock для вставки в outbox (+1 - миграции, +2 - invalidations)
+OUTBOX_LOCK = 0x616c6c696573
+INVALIDATIONS_LOCK = OUTBOX_LOCK + 2
+
+USER_TABLES = ('users', 'invites', 'invites_archive', 'reports', 'report_counts', 'bot_state', 'outbox',
+               'seen_profiles')
+# Не переносятся из SQLite: нужны только работающим процессам
+TRANSIENT_TABLES = ('invalidations',)
+CATALOG_TABLES = ('games', 'game_aliases', 'game_alias_trigrams')
+SERIAL_TABLES = ('games', 'invites', 'reports', 'outbox')
+
+# ? и :name -> $1, $2, ...; приведения типов (::) не трогаем
+_PARAM = re.compile(r'\?|(?<![:\w]):([A-Za-z_]\w*)')
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_sql(sql: str):
+    """(текст с $n, имена параметров по порядку или None для позиционных ?)."""
+    names = []
+
+    def number(match):
+        name = match.group(1)
+        if name is None:
+            names.append(None)
+            return f'${len(names)}'
+        if name not in names:
+            names.append(name)
+        return f'${names.index(name) + 1}'
+
+    text = _PARAM.sub(number, sql)
+    if None in names:
+        if len(set(names)) > 1:
+            raise ValueError("В одном операторе нельзя смешивать ? и :name")
+        return text, None
+    return text, tuple(names)
+
+
+class PgConnection:
+    """Соединение пула с интерфейсом sqlite3: execute(sql, params) с ? или :name.
+
+    Автокоммит: каждый оператор вне transaction() фиксируется сам.
+    """
+
+    def __init__(self, raw, storage):
+        self.raw = raw
+        self.broken = False
+        self._storage = storage
+        self._prepared = OrderedDict()  # sql -> имя подготовленного оператора
+        self._names = itertools.count(1)
+
+    def execute(self, sql: str, params=()):
+        text, names = compile_sql(sql)
+        values = [params[name] for name in names] if names is not None else list(params)
+        storage = self._storage
+        if storage.trace is not None:
+            storage.trace(sql)
+        observer, started = storage.observer, time.perf_counter()
+        cursor = self.raw.cursor()
+        try:
+            name = self._prepare(cursor, sql, text)
+            if values:
+                cursor.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(values))})', values)
+            else:
+                cursor.execute(f'EXECUTE {name}')
+        finally:
+            if observer is not None:
+                observer(sql, time.perf_counter() - started)
+        return cursor
+
+    def executemany(self, sql: str, seq_of_params):
+        # Один PREPARE, затем EXECUTE пачками по BATCH_PAGE за обмен с сервером.
+        # rowcount, в отличие от sqlite3, - только последнего оператора
+        text, names = compile_sql(sql)
+        rows = [[params[name] for name in names] if names is not None else list(params)
+                for params in seq_of_params]
+        storage = self._storage
+        if storage.trace is not None:
+            storage.trace(sql)
+        observer, started = storage.observer, time.perf_counter()
+        cursor = self.raw.cursor()
+        try:
+            name = self._prepare(cursor, sql, text)
+            if rows:
+                execute_batch(cursor, f'EXECUTE {name} ({", ".join(["%s"] * len(rows[0]))})', rows,
+                              page_size=BATCH_PAGE)
+        finally:
+            if observer is not None:
+                observer(sql, time.perf_counter() - started)
+        return cursor
+
+    def _prepare(self, cursor, sql: str, text: str) -> str:
+        name = self._prepared.get(sql)
+        if name is None:
+            name = f'allies_{next(self._names)}'
+            cursor.execute(f'PREPARE {name} AS {text}')
+            self._prepared[sql] = name
+            if len(self._prepared) > MAX_PREPARED:
+                _, old = self._prepared.popitem(last=False)
+                cursor.execute(f'DEALLOCATE {old}')
+        else:
+            self._prepared.move_to_end(sql)
+        return name
+
+    def begin(self) -> None:
+        if self._storage.trace is not None:
+            self._storage.trace('BEGIN')
+        self.raw.cursor().execute('BEGIN')
+
+    def commit(self) -> None:
+        if self._storage.trace is not None:
+            self._storage.trace('COMMIT')
+        observer, started = self._storage.observer, time.perf_counter()
+        try:
+            self.raw.cursor().execute('COMMIT')
+        finally:
+            if observer is not None:
+                observer('COMMIT', time.perf_counter() - started)
+
+    def rollback(self) -> None:
+        try:
+            self.raw.cursor().execute('ROLLBACK')
+        except psycopg2.Error:
+            self.broken = True
+
+
+class ConnectionPool:
+    """Не больше size соединений; свободные выдаются последними вернувшиеся (LIFO),
+    при исчерпании get ждет до timeout."""
+
+    def __init__(self, dsn: str, storage, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.dsn = dsn
+        self.size = size
+        self.timeout = timeout
+        self._storage = storage
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> PgConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._connect()
+            except BaseException:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolError(f"Нет свободного соединения за {self.timeout} с (пул {self.size})") from None
+
+    def put(self, conn: PgConnection) -> None:
+        if conn.broken or conn.raw.closed:
+            conn.raw.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.raw.close()
+            with self._lock:
+                self._created -= 1
+
+    def _connect(self) -> PgConnection:
+        raw = psycopg2.connect(self.dsn)
+        raw.autocommit = True
+        # Время в UTC, как CURRENT_TIMESTAMP в SQLite
+        raw.cursor().execute("SET TIME ZONE 'UTC'")
+        return PgConnection(raw, self._storage)
+
+
+# Схема. Ссылки между таблицами не проверяются - как в SQLite, где foreign_keys выключены.
+# Порядок колонок users тот же: строки анкет разбираются по позициям.
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS games (
+        id BIGSERIAL PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS game_aliases (
+        alias TEXT PRIMARY KEY,
+        game_id BIGINT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS game_alias_trigrams (
+        trigram TEXT NOT NULL,
+        alias TEXT NOT NULL,
+        PRIMARY KEY (trigram, alias)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        game TEXT,
+        rank TEXT,
+        description TEXT,
+        is_searching BOOLEAN DEFAULT FALSE,
+        is_banned BOOLEAN DEFAULT FALSE,
+        ban_end BIGINT,
+        game_id BIGINT,
+        tier INTEGER
+    )
+    ''',
+    # timestamp(0): секунды, как у CURRENT_TIMESTAMP в SQLite - курсор истории без потерь
+    '''
+    CREATE TABLE IF NOT EXISTS invites (
+        id BIGSERIAL PRIMARY KEY,
+        from_user_id BIGINT,
+        to_user_id BIGINT,
+        status TEXT DEFAULT 'pending',
+        timestamp TIMESTAMP(0) DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS reports (
+        id BIGSERIAL PRIMARY KEY,
+        reported_user_id BIGINT,
+        reporter_user_id BIGINT,
+        timestamp TIMESTAMP(0) DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS report_counts (
+        reported_user_id BIGINT PRIMARY KEY,
+        window_start BIGINT NOT NULL,
+        current INTEGER NOT NULL DEFAULT 0,
+        previous INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS bot_state (
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (kind, key)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS outbox (
+        id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT NOT NULL,
+        payload TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at DOUBLE PRECISION NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS invalidations (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        kind TEXT NOT NULL,
+        ban_end BIGINT,
+        origin TEXT NOT NULL,
+        created_at DOUBLE PRECISION NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_invites_from_to_status ON invites (from_user_id, to_user_id, status)',
+    'CREATE INDEX IF NOT EXISTS idx_invites_to_from_status ON invites (to_user_id, from_user_id, status)',
+    'CREATE INDEX IF NOT EXISTS idx_invites_from_time ON invites (from_user_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_invites_to_time ON invites (to_user_id, timestamp)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_reporter_reported ON reports (reporter_user_id, reported_user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_users_ban_end ON users (ban_end) WHERE is_banned = TRUE',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_users_game_id_searching ON users (game_id, user_id)
+    WHERE is_searching = TRUE AND is_banned = FALSE
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_users_game_tier_searching ON users (game_id, tier, user_id)
+    WHERE is_searching = TRUE AND is_banned = FALSE
+    ''',
+    # Поиск по описаниям (вместо FTS5): выражение то же, что в SEARCH_SQL
+    '''
+    CREATE INDEX IF NOT EXISTS idx_users_fts ON users
+    USING gin (to_tsvector('simple', replace(lower(description), 'ё', 'е')))
+    ''',
+    seed_games,
+]
+
+# Версии - как в migrations.py: 10 - схема SQLite после миграции 10
+MIGRATIONS = [
+    (10, SCHEMA),
+    (11, [
+        # Архив инвайтов и индексы истечения - как миграция 11 в migrations.py
+        '''
+        CREATE TABLE IF NOT EXISTS invites_archive (
+            id BIGINT PRIMARY KEY,
+            from_user_id BIGINT,
+            to_user_id BIGINT,
+            status TEXT,
+            timestamp TIMESTAMP(0)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_invites_archive_from_time ON invites_archive (from_user_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_invites_archive_to_time ON invites_archive (to_user_id, timestamp)',
+        "CREATE INDEX IF NOT EXISTS idx_invites_pending_time ON invites (timestamp) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_invites_settled_time ON invites (timestamp) WHERE status != 'pending'",
+    ]),
+    (12, [
+        '''
+        CREATE TABLE IF NOT EXISTS seen_profiles (
+            user_id BIGINT PRIMARY KEY,
+            started_at DOUBLE PRECISION NOT NULL,
+            count INTEGER NOT NULL,
+            bits BYTEA NOT NULL,
+            previous BYTEA,
+            cursor BIGINT NOT NULL DEFAULT 0
+        )
+        ''',
+    ]),
+]
+
+# Как search.SEARCH_SQL: score меньше - релевантнее, курсор (score, user_id)
+SEARCH_SQL = '''
+    SELECT * FROM (
+        SELECT -ts_rank(to_tsvector('simple', replace(lower(u.description), 'ё', 'е')), q) AS score, u.*
+        FROM users u, to_tsquery('simple', :query) q
+        WHERE to_tsvector('simple', replace(lower(u.description), 'ё', 'е')) @@ q
+        AND u.game_id = (SELECT game_id FROM users WHERE user_id = :me)
+        AND u.is_searching = TRUE
+        AND u.is_banned = FALSE
+        AND u.user_id != :me
+    ) AS found
+    WHERE (score, user_id) > (:score, :after)
+    ORDER BY score, user_id
+    LIMIT :limit
+'''
+
+
+def migrate(conn: PgConnection) -> int:
+    conn.begin()
+    try:
+        # Несколько процессов могут стартовать одновременно
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (OUTBOX_LOCK + 1,))
+        conn.raw.cursor().execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+        version = row[0] or 0
+        for target, steps in MIGRATIONS:
+            if target <= version:
+                continue
+            logger.info("Применяем миграцию схемы PostgreSQL %s -> %s", version, target)
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.raw.cursor().execute(step)
+            conn.execute('INSERT INTO schema_version (version) VALUES (?)', (target,))
+            version = target
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return version
+
+
+class PostgresStorage(Storage):
+    """PostgreSQL через пул соединений. Соединение берется на операцию или
+    транзакцию; вложенные обращения в том же потоке идут через него же."""
+
+    name = 'postgres'
+
+    def __init__(self, dsn: str, pool_size: int = POOL_SIZE):
+        self.trace = None
+        self.observer = None
+        self._pool = ConnectionPool(dsn, self, pool_size)
+        self._local = threading.local()
+
+    @contextmanager
+    def _borrow(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._local.conn = self._pool.get()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            conn.broken = True
+            raise
+        finally:
+            self._local.conn = None
+            self._pool.put(conn)
+
+    def reading(self):
+        return self._borrow()
+
+    @contextmanager
+    def transaction(self):
+        with self._borrow() as conn:
+            conn.begin()
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def set_trace(self, callback) -> None:
+        self.trace = callback
+
+    def set_observer(self, callback) -> None:
+        self.observer = callback
+
+    def close(self) -> None:
+        self._pool.close()
+
+    def init_schema(self) -> None:
+        with self._borrow() as conn:
+            migrate(conn)
+
+    def clear(self) -> None:
+        """Удаляет анкеты, инвайты, жалобы, состояния и outbox; каталог игр остается."""
+        with self._borrow() as conn:
+            conn.raw.cursor().execute(f'TRUNCATE {", ".join(USER_TABLES + TRANSIENT_TABLES)} RESTART IDENTITY')
+
+    def lock_user(self, conn, user_id: int) -> None:
+        # Строка анкеты под блокировкой до конца транзакции: вторая такая же
+        # транзакция ждет и видит результат первой (в SQLite это дает BEGIN IMMEDIATE)
+        conn.execute('SELECT 1 FROM users WHERE user_id = ? FOR UPDATE', (user_id,))
+
+    def search_profiles(self, user_id: int, text: str, cursor, limit: int) -> list:
+        terms = [term.replace('_', '') for term in query_terms(text)]
+        query = ' & '.join(f'{term}:*' for term in terms if term)
+        if not query:
+            return []
+        score, after = cursor
+        with self.reading() as conn:
+            return conn.execute(SEARCH_SQL, {'query': query, 'me': user_id, 'score': score, 'after': after,
+                                             'limit': limit}).fetchall()
+
+    def outbox_add(self, chat_id: int, payload: str, created_at: float) -> int:
+        # Вставки в outbox по очереди: id фиксируются по возрастанию, и
+        # Outbox в режиме follow не пропустит строку, закоммиченную позже большей
+        with self.transaction() as conn:
+            conn.execute('SELECT pg_advisory_xact_lock(?)', (OUTBOX_LOCK,))
+            return conn.execute('INSERT INTO outbox (chat_id, payload, created_at) VALUES (?, ?, ?) RETURNING id',
+                                (chat_id, payload, created_at)).fetchone()[0]
+
+    def invalidation_add(self, conn, user_id: int, kind: str, ban_end, origin: str, created_at: float) -> None:
+        # Как outbox_add: блокировка до конца транзакции упорядочивает id по фиксации
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (INVALIDATIONS_LOCK,))
+        super().invalidation_add(conn, user_id, kind, ban_end, origin, created_at)
+
+    def archive_invites(self, conn, before: str, limit: int) -> int:
+        # Перенос одним оператором; строки, которые переносит другой процесс, пропускаются
+        return conn.execute('''
+            WITH moved AS (
+                DELETE FROM invites
+                WHERE id IN (
+                    SELECT id FROM invites
+                    WHERE status != 'pending' AND timestamp < ?
+                    LIMIT ?
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, from_user_id, to_user_id, status, timestamp
+            )
+            INSERT INTO invites_archive (id, from_user_id, to_user_id, status, timestamp)
+            SELECT * FROM moved
+        ''', (before, limit)).rowcount
+
+    def compact(self) -> int:
+        # Файл таблицы не уменьшается (нужен VACUUM FULL с блокировкой), но
+        # место удаленных строк снова используется вставками
+        with self.reading() as conn:
+            conn.raw.cursor().execute('VACUUM (ANALYZE) invites, invites_archive')
+        return 0
+
+    def vacuum(self) -> None:
+        with self.reading() as conn:
+            conn.raw.cursor().execute('VACUUM (FULL, ANALYZE)')
+
+
+# Перенос из SQLite
+
+def _copy_value(value) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        # bytea в текстовом COPY: \x и hex, обратная косая черта удвоена
+        return '\\\\x' + value.hex()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_from_sqlite(path: str, store: PostgresStorage, replace: bool = False, chunk: int = 50000) -> dict:
+    """Копирует все данные из файла SQLite (схема бота) в базу store через COPY.
+
+    База должна быть пустой, replace - заменить ее данные. Индексы idx_*
+    пересоздаются после заливки. Возвращает число строк по таблицам.
+    """
+    source = sqlite3.connect(path)
+    counts = {}
+    with store.transaction() as conn:
+        cursor = conn.raw.cursor()
+        if not replace and conn.execute('SELECT EXISTS (SELECT 1 FROM users)').fetchone()[0]:
+            raise ValueError("В базе PostgreSQL уже есть анкеты")
+        cursor.execute(f'TRUNCATE {", ".join(CATALOG_TABLES + USER_TABLES + TRANSIENT_TABLES)} RESTART IDENTITY')
+        cursor.execute("SELECT indexname, indexdef FROM pg_indexes "
+                       "WHERE schemaname = current_schema() AND indexname LIKE 'idx\\_%'")
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {name}')
+
+        for table in CATALOG_TABLES + USER_TABLES:
+            columns = [row[1] for row in source.execute(f'PRAGMA table_info({table})')]
+            if not columns:
+                continue  # база SQLite старой версии
+            rows = source.execute(f'SELECT {", ".join(columns)} FROM {table}')
+            counts[table] = 0
+            while True:
+                batch = rows.fetchmany(chunk)
+                if not batch:
+                    break
+                data = io.StringIO(''.join('\t'.join(_copy_value(v) for v in row) + '\n' for row in batch))
+                cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', data)
+                counts[table] += len(batch)
+
+        for table in SERIAL_TABLES:
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                           f"COALESCE(MAX(id), 0) + 1, false) FROM {table}")
+        for _, sql in indexes:
+            cursor.execute(sql)
+    source.close()
+    with store.reading() as conn:
+        conn.raw.cursor().execute('ANALYZE')
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sqlite', help='файл базы SQLite')
+    parser.add_argument('url', help='postgresql://...')
+    parser.add_argument('--replace', action='store_true', help='заменить данные, если база не пустая')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = PostgresStorage(args.url)
+    store.init_schema()
+    started = time.perf_counter()
+    counts = copy_from_sqlite(args.sqlite, store, replace=args.replace)
+    print(', '.join(f'{table}: {n}' for table, n in counts.items()))
+    print(f'{time.perf_counter() - started:.1f} c')
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
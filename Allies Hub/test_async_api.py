@@ -0,0 +1,92 @@
+"""Тесты клиента Bot API async_api.AsyncBotAPI на локальном HTTP-сервере.
+
+    python -m pytest test_async_api.py
+"""
+import asyncio
+import json
+import unittest
+
+from async_api import AsyncBotAPI, TelegramAPIError
+
+
+def http_response(status, body, content_type='application/json'):
+    return (f'HTTP/1.1 {status} X\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n').encode() + body
+
+
+class AsyncBotAPITest(unittest.IsolatedAsyncioTestCase):
+
+    async def serve(self, respond, delay=0.0):
+        """Поднимает сервер; respond(request_line) -> байты ответа или None (молчать)."""
+        self.requests = []
+
+        async def handle(reader, writer):
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, _, value = line.decode().partition(':')
+                    if name.lower() == 'content-length':
+                        length = int(value)
+                body = await reader.readexactly(length)
+                self.requests.append((request_line.split()[1].decode(), json.loads(body)))
+                answer = respond(request_line)
+                await asyncio.sleep(3600 if answer is None else delay)
+                writer.write(answer)
+                await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        self.addAsyncCleanup(self.stop, server)
+        port = server.sockets[0].getsockname()[1]
+        self.api = AsyncBotAPI('T', host='127.0.0.1', port=port, use_ssl=False, request_timeout=0.2)
+
+    async def stop(self, server):
+        await self.api.close()
+        server.close()
+
+    async def test_result_and_keep_alive(self):
+        await self.serve(lambda _: http_response(200, b'{"ok": true, "result": {"message_id": 5}}'))
+        self.assertEqual(await self.api.send_message(1, 'a'), {'message_id': 5})
+        self.assertEqual(await self.api.send_message(2, 'b'), {'message_id': 5})
+        self.assertEqual(self.requests, [('/botT/sendMessage', {'chat_id': 1, 'text': 'a'}),
+                                         ('/botT/sendMessage', {'chat_id': 2, 'text': 'b'})])
+        self.assertEqual(len(self.api._idle), 1)
+
+    async def test_api_error(self):
+        await self.serve(lambda _: http_response(429, json.dumps({
+            'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+            'parameters': {'retry_after': 3}}).encode()))
+        with self.assertRaises(TelegramAPIError) as caught:
+            await self.api.send_message(1, 'a')
+        self.assertEqual((caught.exception.error_code, caught.exception.retry_after), (429, 3))
+
+    async def test_non_json_body_is_api_error(self):
+        await self.serve(lambda _: http_response(502, b'<html>Bad Gateway</html>', 'text/html'))
+        with self.assertRaises(TelegramAPIError) as caught:
+            await self.api.send_message(1, 'a')
+        self.assertEqual(caught.exception.error_code, 502)
+
+    async def test_silent_server_times_out(self):
+        await self.serve(lambda _: None)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.api.send_message(1, 'a')
+        # Соединение с неполученным ответом не возвращается в пул
+        self.assertEqual(self.api._idle, [])
+
+    async def test_get_updates_waits_for_long_poll(self):
+        # Ответ дольше request_timeout, но в пределах long polling
+        await self.serve(lambda _: http_response(200, b'{"ok": true, "result": []}'), delay=0.4)
+        self.assertEqual(await self.api.get_updates(timeout=1), [])
+        self.assertEqual(self.requests[0][1]['timeout'], 1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.api.send_message(1, 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Тесты списка блокировок bans.BanList.
+
+    python -m pytest test_bans.py
+"""
+import unittest
+
+from bans import BanList
+
+NOW = 1_000_000
+
+
+class BanListTest(unittest.TestCase):
+
+    def test_get_ignores_expired(self):
+        bans = BanList()
+        bans.load([(1, NOW + 10), (2, NOW - 10), (3, None)])
+        self.assertEqual(bans.get(1, NOW), NOW + 10)
+        self.assertIsNone(bans.get(2, NOW))
+        self.assertIsNone(bans.get(3, NOW))
+        self.assertEqual(len(bans), 2)
+
+    def test_ban_and_lift(self):
+        bans = BanList()
+        bans.ban(1, NOW + 10)
+        self.assertEqual(bans.get(1, NOW), NOW + 10)
+        bans.lift([1, 2])
+        self.assertIsNone(bans.get(1, NOW))
+
+    def test_merge_keeps_ban_issued_after_read(self):
+        bans = BanList()
+        bans.load([(1, NOW - 5)])
+        # Задача прочитала строки, затем report_user выдал бан
+        rows = []
+        bans.ban(2, NOW + 100)
+        bans.merge(rows, NOW)
+        self.assertEqual(bans.get(2, NOW), NOW + 100)
+        self.assertEqual(len(bans), 1)
+
+    def test_merge_adds_bans_from_other_processes(self):
+        bans = BanList()
+        bans.ban(1, NOW + 100)
+        bans.merge([(1, NOW + 50), (2, NOW + 20)], NOW)
+        self.assertEqual((bans.get(1, NOW), bans.get(2, NOW)), (NOW + 100, NOW + 20))
+
+    def test_merge_drops_expired_missing_from_rows(self):
+        bans = BanList()
+        bans.load([(1, NOW - 1), (2, NOW + 1)])
+        bans.merge([(2, NOW + 1)], NOW)
+        self.assertEqual(len(bans), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Тесты кэша анкет cache.ProfileCache.
+
+    python -m pytest test_cache.py
+"""
+import unittest
+
+from cache import ProfileCache
+
+
+class Loader:
+    """Вместо базы: rows[user_id] -> строка, during(user_ids) вызывается посреди чтения."""
+
+    def __init__(self, rows):
+        self.rows = dict(rows)
+        self.calls = []
+        self.during = None
+
+    def __call__(self, user_ids):
+        self.calls.append(sorted(user_ids))
+        loaded = {user_id: self.rows[user_id] for user_id in user_ids if user_id in self.rows}
+        if self.during is not None:
+            self.during(user_ids)
+        return loaded
+
+
+class ProfileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.load = Loader({1: 'a', 2: 'b', 3: 'c'})
+        self.cache = ProfileCache(self.load, max_size=10, ttl=60)
+
+    def test_hits_and_missing_profiles(self):
+        self.assertEqual(self.cache.get_many([1, 2, 4]), {1: 'a', 2: 'b', 4: None})
+        self.assertEqual(self.cache.get_many([1, 2, 4]), {1: 'a', 2: 'b', 4: None})
+        self.assertEqual(self.load.calls, [[1, 2, 4]])
+        self.assertEqual(self.cache.stats()['hits'], 3)
+
+    def test_expired_entry_reloaded(self):
+        cache = ProfileCache(self.load, ttl=0)
+        cache.get(1)
+        cache.get(1)
+        self.assertEqual(self.load.calls, [[1], [1]])
+
+    def test_least_recent_evicted(self):
+        cache = ProfileCache(self.load, max_size=2)
+        cache.get(1)
+        cache.get(2)
+        cache.get(1)
+        cache.get(3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        cache.get_many([1, 3])
+        cache.get(2)
+        self.assertEqual(self.load.calls[-1], [2])
+        self.assertEqual(len(self.load.calls), 4)
+
+    def test_invalidate(self):
+        self.cache.get(1)
+        self.load.rows[1] = 'a2'
+        self.cache.invalidate(1)
+        self.assertEqual(self.cache.get(1), 'a2')
+
+    def test_invalidate_during_load_drops_only_that_key(self):
+        # Пока загрузка читала 1 и 2, анкету 1 переписали
+        def write(user_ids):
+            self.load.rows[1] = 'a2'
+            self.cache.invalidate(1)
+            self.cache.invalidate(3)
+        self.load.during = write
+        self.assertEqual(self.cache.get_many([1, 2]), {1: 'a', 2: 'b'})
+        self.load.during = None
+        self.assertEqual(self.cache.get_many([1, 2]), {1: 'a2', 2: 'b'})
+        self.assertEqual(self.load.calls, [[1, 2], [1]])
+
+    def test_unrelated_invalidation_keeps_fill(self):
+        self.load.during = lambda user_ids: self.cache.invalidate(3)
+        self.cache.get_many([1, 2])
+        self.load.during = None
+        self.cache.get_many([1, 2])
+        self.assertEqual(self.load.calls, [[1, 2]])
+
+    def test_clear_during_load_drops_fill(self):
+        self.load.during = lambda user_ids: self.cache.clear()
+        self.cache.get_many([1, 2])
+        self.load.during = None
+        self.cache.get_many([1, 2])
+        self.assertEqual(self.load.calls, [[1, 2], [1, 2]])
+
+    def test_failed_load_leaves_no_fill(self):
+        def fail(user_ids):
+            raise RuntimeError('db')
+        self.load.during = fail
+        with self.assertRaises(RuntimeError):
+            self.cache.get(1)
+        self.assertEqual(self.cache._fills, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
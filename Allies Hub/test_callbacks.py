@@ -0,0 +1,118 @@
+"""Тесты кодека callback_data и реестра кнопок callbacks.py.
+
+    python -m pytest test_callbacks.py
+"""
+import unittest
+from datetime import datetime
+
+from callbacks import ACTIONS, MAX_LENGTH, CallbackRegistry, decode, encode, matcher, pack_int, template
+
+# Аргументы по типам: i - целое, f - score поиска, t - время из базы
+SAMPLES = {'i': 987654321, 'f': -3.141592653589793, 't': '2024-02-29 23:59:58'}
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_every_action_round_trip(self):
+        for action, (_, kinds) in ACTIONS.items():
+            with self.subTest(action=action):
+                args = tuple(SAMPLES[kind] for kind in kinds)
+                data = encode(action, *args)
+                self.assertLessEqual(len(data.encode()), MAX_LENGTH)
+                self.assertEqual(decode(data), (action, args))
+
+    def test_pack_int(self):
+        self.assertEqual([pack_int(value) for value in (0, 35, 36, -36)], ['0', 'z', '10', '-10'])
+        self.assertEqual(int(pack_int(2 ** 63 - 1), 36), 2 ** 63 - 1)
+
+    def test_compact(self):
+        self.assertEqual(encode('next', 123456), '1n.2n9c')
+        self.assertEqual(decode('1n.2n9c'), ('next', (123456,)))
+        self.assertEqual(encode('main_menu'), '1m')
+
+    def test_search_score_exact(self):
+        # Курсор поиска сравнивается на равенство - score без потери точности
+        for score in (0.1 + 0.2, -1e-300, 5e300, -0.0):
+            self.assertEqual(repr(decode(encode('search', score, 7))[1][0]), repr(score))
+
+    def test_history_time_from_datetime(self):
+        # PostgreSQL отдает datetime, SQLite - строку; кнопка одна и та же
+        data = encode('history_old', datetime(2024, 2, 29, 23, 59, 58), 5)
+        self.assertEqual(data, encode('history_old', '2024-02-29 23:59:58', 5))
+        self.assertEqual(decode(data), ('history_old', ('2024-02-29 23:59:58', 5)))
+
+    def test_legacy_buttons(self):
+        self.assertEqual(decode('main_menu'), ('main_menu', ()))
+        self.assertEqual(decode('next_123'), ('next', (123,)))
+        self.assertEqual(decode('accept_42'), ('accept', (42,)))
+        self.assertEqual(decode('search_-1.5_42'), ('search', (-1.5, 42)))
+        self.assertEqual(decode('history_old_2024-01-01 10:00:00_5'), ('history_old', ('2024-01-01 10:00:00', 5)))
+        self.assertEqual(decode('history_new_2024-01-01 10:00:00_5'), ('history_new', ('2024-01-01 10:00:00', 5)))
+
+    def test_garbage_is_none(self):
+        for data in ('', '1', '1n', '1n.', '1n.zz.1', '1m.5', '2n.1', '1q.1', 'next_', 'next_x', 'main_menu_1',
+                     'history_old_5', 'search_x_1', '1f.1', 'unknown'):
+            with self.subTest(data=data):
+                self.assertIsNone(decode(data))
+
+    def test_wrong_arguments(self):
+        with self.assertRaises(ValueError):
+            encode('next')
+        with self.assertRaises(ValueError):
+            encode('main_menu', 1)
+        with self.assertRaises(KeyError):
+            encode('unknown')
+
+    def test_template(self):
+        # rendering.KeyboardTemplate подставляет id в base36
+        self.assertEqual(template('invite').format(id=pack_int(123456)), encode('invite', 123456))
+        with self.assertRaises(ValueError):
+            template('search')
+
+    def test_matcher(self):
+        accept = matcher('accept')
+        self.assertTrue(accept(encode('accept', 5)))
+        self.assertTrue(accept('accept_5'))
+        self.assertFalse(accept(encode('decline', 5)))
+        with self.assertRaises(ValueError):
+            matcher('unknown')
+
+
+class CallbackRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.registry = CallbackRegistry()
+        for action in ('main_menu', 'next', 'search', 'history_old'):
+            self.registry.register(action)(lambda *args, action=action: self.calls.append((action, args)) or action)
+
+    def test_dispatch_new_and_legacy(self):
+        self.assertEqual(self.registry.dispatch(encode('next', 10), 'ctx'), 'next')
+        self.assertEqual(self.registry.dispatch('next_10', 'ctx'), 'next')
+        self.registry.dispatch('main_menu', 'ctx')
+        self.registry.dispatch(encode('main_menu'), 'ctx')
+        self.registry.dispatch(encode('search', 0.5, 3), 'ctx')
+        self.registry.dispatch(encode('history_old', '2024-01-01 10:00:00', 5), 'ctx')
+        self.assertEqual(self.calls, [('next', ('ctx', 10)), ('next', ('ctx', 10)),
+                                      ('main_menu', ('ctx',)), ('main_menu', ('ctx',)),
+                                      ('search', ('ctx', 0.5, 3)),
+                                      ('history_old', ('ctx', '2024-01-01 10:00:00', 5))])
+
+    def test_unknown_or_unregistered_not_called(self):
+        for data in (encode('invite', 1), 'invite_1', '1n.', '1n.1.2', '1m.1', 'garbage'):
+            with self.subTest(data=data):
+                self.assertIsNone(self.registry.dispatch(data, 'ctx'))
+        self.assertEqual(self.calls, [])
+
+    def test_lookup(self):
+        handler, args = self.registry.lookup('next_7')
+        self.assertEqual(args, (7,))
+        self.assertIsNone(self.registry.lookup(encode('invite', 1)))
+
+    def test_register_unknown_action(self):
+        with self.assertRaises(ValueError):
+            self.registry.register('unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+"""Тесты очереди кандидатов feed.CandidateFeed.
+
+    python -m pytest test_feed.py
+"""
+import threading
+import time
+import unittest
+
+from feed import LOADING, CandidateFeed
+from seen import SeenProfiles
+
+
+class FakeSource:
+    """fetch для CandidateFeed поверх списка user_id; анкета - кортеж (user_id,)."""
+
+    def __init__(self, user_ids):
+        self.user_ids = sorted(user_ids)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, user_id, after_user_id, limit):
+        with self.lock:
+            self.calls.append(after_user_id)
+        rows = [(uid,) for uid in self.user_ids if uid > after_user_id and uid != user_id]
+        return rows[:limit]
+
+    def wait_calls(self, count, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.calls) >= count:
+                    return
+            time.sleep(0.005)
+        raise AssertionError(f'ожидали {count} запросов, было {len(self.calls)}')
+
+
+class CandidateFeedTest(unittest.TestCase):
+
+    def make_feed(self, source, **kwargs):
+        kwargs.setdefault('batch_size', 3)
+        kwargs.setdefault('low_watermark', 0)
+        return CandidateFeed(source, **kwargs)
+
+    def walk(self, feed, user_id, steps):
+        shown, after = [], 0
+        for _ in range(steps):
+            profile = feed.next(user_id, after)
+            if profile is None:
+                break
+            shown.append(profile[0])
+            after = profile[0]
+        return shown
+
+    def test_batch_served_from_queue(self):
+        source = FakeSource(range(1, 11))
+        feed = self.make_feed(source)
+        self.assertEqual(self.walk(feed, 1, 2), [2, 3])
+        self.assertEqual(source.calls, [0])
+
+    def test_refill_continues_after_loaded_cursor(self):
+        source = FakeSource(range(1, 11))
+        feed = self.make_feed(source, low_watermark=2)
+        self.assertEqual(feed.next(1), (2,))
+        source.wait_calls(2)
+        self.assertEqual(source.calls, [0, 4])
+        self.assertEqual(self.walk(feed, 1, 20), [2, 3, 4, 5, 6, 7, 8, 9, 10])
+
+    def test_stale_cursor_reloads(self):
+        source = FakeSource(range(1, 11))
+        feed = self.make_feed(source)
+        feed.next(1)
+        # Кнопка из старого сообщения: курсор не совпадает с последней выданной
+        self.assertEqual(feed.next(1, 7), (8,))
+        self.assertEqual(source.calls, [0, 7])
+
+    def test_hidden_profile_skipped(self):
+        source = FakeSource(range(1, 11))
+        feed = self.make_feed(source)
+        feed.next(1)
+        feed.hide(3)
+        self.assertEqual(feed.next(1, 2), (4,))
+        feed.unhide(3)
+        self.assertEqual(feed.next(1, 2), (3,))
+
+    def test_invalidate_drops_queue(self):
+        source = FakeSource(range(1, 11))
+        feed = self.make_feed(source)
+        feed.next(1)
+        feed.invalidate(1)
+        feed.next(1, 2)
+        self.assertEqual(source.calls, [0, 2])
+
+    def test_lru_bounded(self):
+        source = FakeSource(range(1, 11))
+        feed = self.make_feed(source, max_users=2)
+        for viewer in (1, 2, 3):
+            feed.next(viewer)
+        self.assertEqual(list(feed._feeds), [2, 3])
+
+
+class SeenFeedTest(unittest.TestCase):
+    """CandidateFeed с фильтром просмотренных seen.SeenProfiles."""
+
+    def setUp(self):
+        self.seen = SeenProfiles(lambda user_id: None, lambda rows: None, error_rate=1e-6)
+
+    def make_feed(self, source, **kwargs):
+        kwargs.setdefault('batch_size', 3)
+        kwargs.setdefault('low_watermark', 0)
+        return CandidateFeed(source, seen=self.seen, **kwargs)
+
+    def wait_refill(self, feed, user_id, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with feed._lock:
+                if not feed._feeds[user_id].refilling:
+                    return
+            time.sleep(0.005)
+        raise AssertionError('дозагрузка не закончилась')
+
+    def test_seen_skipped_and_resumed(self):
+        source = FakeSource(range(1, 11))
+        feed = self.make_feed(source)
+        self.assertEqual(feed.next(1), (2,))
+        self.assertEqual(feed.next(1, 2), (3,))
+        self.assertEqual(self.seen.cursor(1), 2)
+        # После перерыва "Продолжить поиск" - с курсора, 2 уже просмотрена
+        restarted = self.make_feed(source)
+        self.assertEqual(restarted.next(1), (3,))
+        self.assertEqual(source.calls[-1], 2)
+        self.seen.set_cursor(1, 0)
+        self.assertEqual(restarted.next(1), (3,))
+
+    def test_loading_when_scan_finds_only_seen(self):
+        source = FakeSource(range(1, 101))
+        for profile_id in range(2, 51):
+            self.seen.add(1, profile_id)
+        feed = self.make_feed(source, max_scan=6)
+        self.assertIs(feed.next(1), LOADING)
+        self.assertEqual(self.seen.cursor(1), 7)
+        # Дозагрузка читает дальше в пределах scan_budget и находит 51
+        self.wait_refill(feed, 1)
+        self.assertEqual(feed.next(1), (51,))
+
+    def test_scan_budget_spent(self):
+        source = FakeSource(range(1, 101))
+        for profile_id in range(2, 51):
+            self.seen.add(1, profile_id)
+        feed = self.make_feed(source, max_scan=6, scan_budget=0)
+        self.assertIs(feed.next(1), LOADING)
+        self.wait_refill(feed, 1)
+        # Одна дозагрузка без результата: курсор сдвинут, следующий запрос продолжит с него
+        self.assertEqual(self.seen.cursor(1), 13)
+        presses = 1
+        while (profile := feed.next(1)) is LOADING and presses < 10:
+            self.wait_refill(feed, 1)
+            presses += 1
+        self.assertEqual(profile, (51,))
+        self.assertGreater(presses, 1)
+
+    def test_everything_seen_starts_over(self):
+        source = FakeSource(range(1, 5))
+        for profile_id in range(2, 5):
+            self.seen.add(1, profile_id)
+        feed = self.make_feed(source)
+        self.assertEqual(feed.next(1), (2,))
+
+
+if __name__ == '__main__':
+    unittest.main()
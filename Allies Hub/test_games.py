@@ -0,0 +1,56 @@
+"""Тесты каталога игр games.py на базе в памяти.
+
+    python -m pytest test_games.py
+"""
+import sqlite3
+import unittest
+
+from explain_queries import create_schema
+from games import add_alias, add_game, normalize, resolve_game
+from migrations import migrate
+
+
+class GamesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        create_schema(self.conn)
+        migrate(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def counts(self):
+        return [self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('games', 'game_aliases', 'game_alias_trigrams')]
+
+    def test_normalize(self):
+        self.assertEqual(normalize(' Counter-Strike 2 '), 'counterstrike2')
+        self.assertEqual(normalize('Ёлка'), 'елка')
+
+    def test_spellings_resolve_to_one_game(self):
+        names = {resolve_game(self.conn, text)[1] for text in ('CS2', 'cs 2', 'Counter-Strike 2', 'кс 2')}
+        self.assertEqual(names, {'Counter-Strike 2'})
+        self.assertEqual(resolve_game(self.conn, 'Valorantt')[1], 'Valorant')
+
+    def test_numbers_must_match(self):
+        add_game(self.conn, 'Battlefield 1')
+        add_game(self.conn, 'Battlefield 4')
+        self.assertEqual(resolve_game(self.conn, 'battlefield 4')[1], 'Battlefield 4')
+        self.assertIsNone(resolve_game(self.conn, 'Battlefield 2042'))
+
+    def test_resolve_only_reads(self):
+        before = self.counts()
+        self.assertIsNone(resolve_game(self.conn, 'Kenshi'))
+        self.assertEqual(resolve_game(self.conn, 'Valorantt')[1], 'Valorant')
+        self.assertEqual(self.counts(), before)
+
+    def test_add_game_and_alias(self):
+        game_id = add_game(self.conn, 'Kenshi', ['кенши'])
+        add_alias(self.conn, game_id, 'KNSH')
+        for text in ('kenshi', 'Кенши', 'knsh'):
+            self.assertEqual(tuple(resolve_game(self.conn, text)), (game_id, 'Kenshi'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Тесты сбросов кэшей между процессами invalidations.Invalidations.
+
+    python -m pytest test_invalidations.py
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import db
+import storage
+from invalidations import Invalidations
+
+
+class InvalidationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='allies-test-')
+        db.configure(os.path.join(self.workdir, 'test.db'))
+        self.store = storage.SQLiteStorage()
+        self.store.init_schema()
+        # Два процесса над одной базой
+        self.applied = {'a': [], 'b': []}
+        self.a = Invalidations(lambda *args: self.applied['a'].append(args), enabled=True, interval=0.01,
+                               store=self.store)
+        self.b = Invalidations(lambda *args: self.applied['b'].append(args), enabled=True, interval=0.01,
+                               store=self.store)
+
+    def tearDown(self):
+        self.a.stop()
+        self.b.stop()
+        self.store.close()
+        db.configure(db.DB_PATH)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def rows(self):
+        return db.fetchone('SELECT COUNT(*) FROM invalidations')[0]
+
+    def test_other_process_applies_in_order(self):
+        with self.store.transaction() as conn:
+            self.a.record(conn, 1, 'hidden')
+            self.a.record(conn, 2, 'banned', 100)
+            self.a.record(conn, 1, 'shown')
+        self.assertEqual(self.b.poll(), 3)
+        self.assertEqual(self.applied['b'], [(1, 'hidden', None), (2, 'banned', 100), (1, 'shown', None)])
+        # Свои строки процесс пропускает, уже прочитанные не повторяются
+        self.assertEqual(self.a.poll(), 0)
+        self.assertEqual(self.b.poll(), 0)
+
+    def test_rolled_back_change_not_shared(self):
+        with self.assertRaises(RuntimeError):
+            with self.store.transaction() as conn:
+                self.a.record(conn, 1, 'banned', 100)
+                raise RuntimeError('rollback')
+        self.assertEqual(self.b.poll(), 0)
+
+    def test_disabled_writes_nothing(self):
+        single = Invalidations(lambda *args: None, store=self.store)
+        with self.store.transaction() as conn:
+            single.record(conn, 1, 'hidden')
+        self.assertEqual(self.rows(), 0)
+
+    def test_start_skips_old_rows(self):
+        with self.store.transaction() as conn:
+            self.a.record(conn, 1, 'hidden')
+        self.b.start()
+        with self.store.transaction() as conn:
+            self.a.record(conn, 2, 'hidden')
+        self.b.stop()
+        self.b.poll()
+        self.assertEqual(self.applied['b'], [(2, 'hidden', None)])
+
+    def test_background_thread_applies_within_interval(self):
+        self.b.start()
+        with self.store.transaction() as conn:
+            self.a.record(conn, 3, 'profile')
+        for _ in range(200):
+            if self.applied['b']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.applied['b'], [(3, 'profile', None)])
+        self.assertTrue(self.b.is_alive())
+
+    def test_prune_keeps_recent_rows(self):
+        with self.store.transaction() as conn:
+            self.a.record(conn, 1, 'hidden')
+        self.a.prune()
+        self.assertEqual(self.rows(), 1)
+        self.a.prune(now=db.fetchone('SELECT created_at FROM invalidations')[0] + self.a.keep + 1)
+        self.assertEqual(self.rows(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
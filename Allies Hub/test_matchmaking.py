@@ -0,0 +1,97 @@
+"""Тесты подбора по близости тира matchmaking.nearest_candidates.
+
+    python -m pytest test_matchmaking.py
+"""
+import random
+import sqlite3
+import unittest
+
+from explain_queries import create_schema
+from matchmaking import nearest_candidates
+from migrations import migrate
+
+GAME_ID = 1
+VIEWER = 500
+
+
+class NearestCandidatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        create_schema(self.conn)
+        migrate(self.conn)
+        random.seed(7)
+        self.users = {}
+        for user_id in range(1, 301):
+            tier = None if user_id % 17 == 0 else random.randint(0, 12)
+            self.add(user_id, tier)
+        # Не попадают в выдачу: другая игра, не ищет, забанен
+        self.add(1001, 5, game_id=2)
+        self.add(1002, 5, searching=False)
+        self.add(1003, 5, banned=True)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def add(self, user_id, tier, game_id=GAME_ID, searching=True, banned=False):
+        self.conn.execute('''
+            INSERT INTO users (user_id, username, game, game_id, rank, tier, description, is_searching, is_banned)
+            VALUES (?, ?, 'Dota 2', ?, '', ?, '', ?, ?)
+        ''', (user_id, f'user{user_id}', game_id, tier, searching, banned))
+        if game_id == GAME_ID and searching and not banned:
+            self.users[user_id] = tier
+
+    def expected(self, viewer):
+        tier = self.users[viewer]
+        others = [(user_id, t) for user_id, t in self.users.items() if user_id != viewer]
+        if tier is None:
+            return sorted(user_id for user_id, _ in others)
+        # Ближе по тиру раньше; при равном расстоянии сначала нижняя сторона
+        # (user_id по убыванию), затем верхняя (по возрастанию); без тира - в конце
+        ranked = sorted((abs(t - tier), t > tier, user_id if t > tier else -user_id, user_id)
+                        for user_id, t in others if t is not None)
+        return [row[-1] for row in ranked] + sorted(user_id for user_id, t in others if t is None)
+
+    def walk(self, viewer, limit):
+        shown, after = [], 0
+        while True:
+            page = nearest_candidates(self.conn, viewer, after, limit)
+            if not page:
+                return shown
+            shown.extend(row[0] for row in page)
+            after = shown[-1]
+
+    def test_first_page_is_nearest(self):
+        self.add(VIEWER, 6)
+        page = nearest_candidates(self.conn, VIEWER, 0, 20)
+        self.assertEqual([row[0] for row in page], self.expected(VIEWER)[:20])
+
+    def test_cursor_walks_whole_game_in_order(self):
+        self.add(VIEWER, 6)
+        for limit in (1, 7, 50):
+            self.assertEqual(self.walk(VIEWER, limit), self.expected(VIEWER), limit)
+
+    def test_edge_tiers(self):
+        for tier in (0, 12, 40):
+            with self.subTest(tier=tier):
+                self.conn.execute('DELETE FROM users WHERE user_id = ?', (VIEWER,))
+                self.add(VIEWER, tier)
+                self.assertEqual(self.walk(VIEWER, 9), self.expected(VIEWER))
+
+    def test_cursor_on_unranked_profile(self):
+        self.add(VIEWER, 3)
+        expected = self.expected(VIEWER)
+        after = next(user_id for user_id in expected if self.users[user_id] is None)
+        page = nearest_candidates(self.conn, VIEWER, after, 5)
+        self.assertEqual([row[0] for row in page], expected[expected.index(after) + 1:][:5])
+
+    def test_viewer_without_tier(self):
+        self.add(VIEWER, None)
+        self.assertEqual(self.walk(VIEWER, 13), self.expected(VIEWER))
+
+    def test_unknown_viewer(self):
+        self.assertEqual(nearest_candidates(self.conn, 99999, 0, 5), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
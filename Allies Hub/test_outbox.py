@@ -0,0 +1,129 @@
+"""Тесты исходящей очереди outbox.Outbox на временной базе.
+
+    python -m pytest test_outbox.py
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from telegram import ReplyKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
+
+import db
+import outbox
+import storage
+from outbox import Outbox, TokenBucket
+
+KEYBOARD = ReplyKeyboardMarkup([['Главное меню']], resize_keyboard=True)
+
+
+class RecordingBot:
+    """Вместо Bot: запоминает отправленное, errors[(chat_id, text)] - исключение на первую попытку."""
+
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = dict(errors or {})
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        with self.lock:
+            error = self.errors.pop((chat_id, text), None)
+            if error is not None:
+                raise error
+            self.sent.append((chat_id, text))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_rate(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        now = bucket.updated
+        self.assertEqual(bucket.take(now), 0)
+        self.assertEqual(bucket.take(now), 0)
+        self.assertAlmostEqual(bucket.take(now), 0.5)
+        self.assertEqual(bucket.take(now + 0.5), 0)
+
+    def test_drain(self):
+        bucket = TokenBucket(rate=30, capacity=30)
+        now = bucket.updated
+        bucket.drain(3, now)
+        self.assertAlmostEqual(bucket.take(now), 3.0)
+        self.assertEqual(bucket.take(now + 3.0), 0)
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='allies-test-')
+        db.configure(os.path.join(self.workdir, 'test.db'))
+        self.store = storage.SQLiteStorage()
+        self.store.init_schema()
+        self.outbox = Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000, senders=2, store=self.store)
+
+    def tearDown(self):
+        self.outbox.stop(timeout=1)
+        self.store.close()
+        db.configure(db.DB_PATH)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def rows(self):
+        return db.fetchone('SELECT COUNT(*) FROM outbox')[0]
+
+    def test_unsent_rows_delivered_after_start(self):
+        self.outbox.send_message(1, 'a')
+        self.outbox.send_message(2, 'b')
+        self.assertEqual(self.rows(), 2)
+        bot = RecordingBot()
+        self.outbox.start(bot)
+        self.outbox.stop()
+        self.assertEqual(sorted(bot.sent), [(1, 'a'), (2, 'b')])
+        self.assertEqual(self.rows(), 0)
+
+    def test_order_within_chat_and_batched_deletes(self):
+        bot = RecordingBot()
+        for i in range(50):
+            self.outbox.send_message(i % 5, str(i))
+        transaction = self.store.transaction
+        with mock.patch.object(self.store, 'transaction', side_effect=transaction) as writes:
+            self.outbox.start(bot)
+            self.outbox.stop()
+        for chat_id in range(5):
+            self.assertEqual([text for chat, text in bot.sent if chat == chat_id],
+                             [str(i) for i in range(chat_id, 50, 5)])
+        self.assertEqual(self.rows(), 0)
+        # Удаления пачкой, а не транзакция на сообщение
+        self.assertLessEqual(writes.call_count, 3)
+
+    def test_menu_header_skipped_when_keyboard_present(self):
+        bot = RecordingBot()
+        self.outbox.start(bot)
+        self.outbox.send_menu(1, 'Главное меню:', KEYBOARD, 'Выберите действие:', None)
+        self.outbox.stop()
+        self.outbox.start(bot)
+        self.outbox.send_menu(1, 'Главное меню:', KEYBOARD, 'Выберите действие:', None)
+        self.outbox.stop()
+        self.assertEqual(bot.sent, [(1, 'Главное меню:'), (1, 'Выберите действие:'), (1, 'Выберите действие:')])
+
+    def test_permanent_error_drops_message(self):
+        bot = RecordingBot({(1, 'a'): BadRequest('chat not found')})
+        self.outbox.start(bot)
+        self.outbox.send_message(1, 'a')
+        self.outbox.send_message(1, 'b')
+        self.outbox.stop()
+        self.assertEqual(bot.sent, [(1, 'b')])
+        self.assertEqual(self.rows(), 0)
+
+    def test_retry_after_pauses_every_chat(self):
+        bot = RecordingBot({(1, 'a'): RetryAfter(2)})
+        self.outbox._bot = bot
+        item = outbox._Item(1, 1, [['a', None]])
+        self.assertEqual(self.outbox._deliver(item, 'a', None), 2.0)
+        self.assertEqual(item.pos, 0)
+        self.assertGreater(self.outbox._global.take(), 1.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""Тесты разбора рангов ranks.parse_rank.
+
+    python -m pytest test_ranks.py
+"""
+import unittest
+
+from ranks import LADDERS, parse_rank
+
+
+class ParseRankTest(unittest.TestCase):
+
+    def test_divisions(self):
+        self.assertEqual(parse_rank('Dota 2', 'Herald 1'), 0)
+        self.assertEqual(parse_rank('Counter-Strike 2', 'mg2'), 11)
+        # LoL считает деления сверху: IV ниже I
+        self.assertEqual(parse_rank('League of Legends', 'Gold IV'), 12)
+        self.assertEqual(parse_rank('League of Legends', 'gold 1'), 15)
+
+    def test_step_without_division_is_middle(self):
+        self.assertEqual(parse_rank('Dota 2', 'рекрут'), 2)
+
+    def test_longer_keyword_wins(self):
+        self.assertEqual(parse_rank('League of Legends', 'Master'), 28)
+        self.assertEqual(parse_rank('League of Legends', 'Grandmaster'), 29)
+
+    def test_rating_numbers(self):
+        self.assertEqual(parse_rank('Dota 2', '4000'), 4000 // LADDERS['Dota 2']['number_step'])
+        # Выше лестницы - верхний тир
+        self.assertEqual(parse_rank('Dota 2', '999999'), parse_rank('Dota 2', 'Immortal'))
+        # У лестницы без number_step число не сравнимо с тирами
+        self.assertIsNone(parse_rank('Valorant', '1000'))
+
+    def test_game_without_ladder(self):
+        self.assertEqual(parse_rank('Kenshi', '1 500'), 1500)
+        self.assertIsNone(parse_rank('Kenshi', 'pro'))
+
+    def test_unrecognized(self):
+        self.assertIsNone(parse_rank('Dota 2', 'нуб'))
+        self.assertIsNone(parse_rank('Dota 2', None))
+        self.assertIsNone(parse_rank('Dota 2', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Тесты фронта router.py: распределение по воркерам, порядок и повторы.
+
+    python -m pytest test_router.py
+"""
+import socket
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+import router
+import settings
+from router import Router
+from webhook import WebhookServer
+
+SECRET = 'test-secret'
+
+
+def message(update_id, user_id):
+    return {'update_id': update_id, 'message': {'from': {'id': user_id}, 'text': str(update_id)}}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RouterTest(unittest.TestCase):
+
+    def worker(self, port=0):
+        received = []
+        lock = threading.Lock()
+
+        def process(data):
+            with lock:
+                received.append((data['message']['from']['id'], data['update_id']))
+
+        server = WebhookServer(process, port=port, path=settings.WORKER_PATH, secret_token=SECRET)
+        server.start()
+        self.addCleanup(server.stop, False)
+        host, port = server.address
+        return f'http://{host}:{port}{settings.WORKER_PATH}', server, received
+
+    def test_shard_by_user(self):
+        front = Router(['a', 'b', 'c'])
+        self.assertEqual([front.shard(message(1, user_id)) for user_id in (3, 4, 5, 7)], [0, 1, 2, 1])
+
+    def test_each_user_to_one_worker_in_order(self):
+        workers = [self.worker() for _ in range(2)]
+        front = Router([url for url, _, _ in workers], SECRET, batch_size=7)
+        front.start()
+        for update_id in range(1, 101):
+            front.route(message(update_id, update_id % 5))
+        front.stop()
+        for index, (_, server, received) in enumerate(workers):
+            server.stop()
+            self.assertEqual({user_id % 2 for user_id, _ in received}, {index})
+            for user_id in range(5):
+                updates = [update_id for sender, update_id in received if sender == user_id]
+                if user_id % 2 == index:
+                    self.assertEqual(updates, list(range(user_id or 5, 101, 5)))
+
+    def test_retries_until_worker_accepts(self):
+        port = free_port()
+        front = Router([f'http://127.0.0.1:{port}{settings.WORKER_PATH}'], SECRET)
+        front.start()
+        for update_id in range(1, 4):
+            front.route(message(update_id, 1))
+        time.sleep(0.3)  # воркер еще не поднялся, пачка повторяется
+        _, server, received = self.worker(port)
+        front.stop()
+        server.stop()
+        self.assertEqual(received, [(1, 1), (1, 2), (1, 3)])
+
+    def test_webhook_requires_secret(self):
+        with mock.patch.object(settings, 'WEBHOOK_URL', 'https://example.org'), \
+                mock.patch.object(settings, 'WEBHOOK_SECRET', None), \
+                mock.patch.object(sys, 'argv', ['router.py', '--workers', '1']), \
+                mock.patch.object(router, 'spawn_worker') as spawn, \
+                mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                router.main()
+        spawn.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Тесты фильтра просмотренных анкет seen.SeenProfiles.
+
+    python -m pytest test_seen.py
+"""
+import unittest
+from unittest import mock
+
+from seen import SeenProfiles, filter_size
+
+DAY = 24 * 3600
+
+
+class Rows:
+    """load/save для SeenProfiles поверх словаря user_id -> строка."""
+
+    def __init__(self, fail=False):
+        self.rows = {}
+        self.fail = fail
+
+    def load(self, user_id):
+        return self.rows.get(user_id)
+
+    def save(self, rows):
+        if self.fail:
+            raise RuntimeError('база недоступна')
+        for row in rows:
+            self.rows[row[0]] = row[1:]
+
+
+def profiles(*user_ids):
+    return [(user_id,) for user_id in user_ids]
+
+
+class SeenProfilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1_000_000.0
+        patcher = mock.patch('seen.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = Rows()
+
+    def make(self, **kwargs):
+        kwargs.setdefault('capacity', 10)
+        kwargs.setdefault('rotate_after', 10 * DAY)
+        # Ложные срабатывания фильтра тестам не нужны
+        kwargs.setdefault('error_rate', 1e-6)
+        return SeenProfiles(self.store.load, self.store.save, **kwargs)
+
+    def unseen(self, seen, user_id, *user_ids):
+        return [row[0] for row in seen.unseen(user_id, profiles(*user_ids))]
+
+    def test_filter_size(self):
+        self.assertEqual(filter_size(1000, 0.01), (1199, 7))
+
+    def test_add_hides_profile(self):
+        seen = self.make()
+        self.assertEqual(self.unseen(seen, 1, 5, 6, 7), [5, 6, 7])
+        seen.add(1, 6)
+        seen.add(1, 6)
+        self.assertEqual(self.unseen(seen, 1, 5, 6, 7), [5, 7])
+        # У другого пользователя свой фильтр
+        self.assertEqual(self.unseen(seen, 2, 5, 6, 7), [5, 6, 7])
+
+    def test_full_generation_rolls_over(self):
+        seen = self.make()
+        first = list(range(100, 110))
+        for profile_id in first:
+            seen.add(1, profile_id)
+        # Поколение заполнено: ушло в прошлое, но анкеты все еще скрыты
+        self.assertEqual(self.unseen(seen, 1, *first), [])
+        for profile_id in range(200, 210):
+            seen.add(1, profile_id)
+        # Следующая смена поколений - первые анкеты возвращаются в ленту
+        self.assertEqual(self.unseen(seen, 1, *first), first)
+        self.assertEqual(self.unseen(seen, 1, *range(200, 210)), [])
+
+    def test_generation_rolls_over_by_age(self):
+        seen = self.make()
+        seen.add(1, 5)
+        self.now += 10 * DAY + 1
+        seen.add(1, 6)
+        self.assertEqual(self.unseen(seen, 1, 5, 6), [])
+        self.now += 10 * DAY + 1
+        self.assertEqual(self.unseen(seen, 1, 5, 6), [5])
+
+    def test_old_previous_generation_forgotten(self):
+        # Поколение старше двух rotate_after не переходит в прошлое
+        seen = self.make()
+        seen.add(1, 5)
+        self.now += 20 * DAY + 1
+        self.assertEqual(self.unseen(seen, 1, 5), [5])
+
+    def test_flush_and_reload(self):
+        seen = self.make()
+        seen.add(1, 5)
+        seen.set_cursor(1, 42)
+        seen.add(2, 7)
+        self.assertEqual(seen.flush(), 2)
+        self.assertEqual(seen.flush(), 0)
+        started, count, current, previous, cursor = self.store.rows[1]
+        self.assertEqual((started, count, previous, cursor), (self.now, 1, None, 42))
+
+        fresh = self.make()
+        self.assertEqual(self.unseen(fresh, 1, 5, 6), [6])
+        self.assertEqual(fresh.cursor(1), 42)
+
+    def test_previous_generation_survives_reload(self):
+        seen = self.make()
+        for profile_id in range(100, 110):
+            seen.add(1, profile_id)
+        seen.add(1, 300)
+        seen.flush()
+        fresh = self.make()
+        self.assertEqual(self.unseen(fresh, 1, 100, 109, 300, 301), [301])
+
+    def test_other_filter_size_starts_over(self):
+        seen = self.make()
+        seen.add(1, 5)
+        seen.flush()
+        self.assertEqual(self.unseen(self.make(capacity=100), 1, 5), [5])
+
+    def test_failed_flush_retried(self):
+        self.store.fail = True
+        seen = self.make()
+        seen.add(1, 5)
+        with self.assertRaises(RuntimeError):
+            seen.flush()
+        self.store.fail = False
+        self.assertEqual(seen.flush(), 1)
+        self.assertIn(1, self.store.rows)
+
+    def test_evicted_changes_flushed(self):
+        seen = self.make(max_users=1)
+        seen.add(1, 5)
+        seen.add(2, 6)
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(seen.flush(), 2)
+        self.assertEqual(self.unseen(seen, 1, 5), [])
+
+    def test_reset(self):
+        seen = self.make()
+        seen.add(1, 5)
+        seen.set_cursor(1, 5)
+        seen.reset(1)
+        self.assertEqual(self.unseen(seen, 1, 5), [5])
+        self.assertEqual(seen.cursor(1), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
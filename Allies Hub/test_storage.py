@@ -0,0 +1,339 @@
+"""Тесты слоя хранения: общие для SQLite и PostgreSQL и только для PostgreSQL.
+
+    python -m pytest test_storage.py
+    ALLIES_TEST_DATABASE_URL=postgresql://allies@localhost/allies_test python -m pytest test_storage.py
+
+Тесты PostgreSQL пропускаются без ALLIES_TEST_DATABASE_URL; база по этому
+адресу очищается (clear, copy_from_sqlite с replace) - не указывайте рабочую.
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import db
+import storage
+from games import seed as seed_games
+
+try:
+    import storage_pg
+except ImportError:  # psycopg2 не установлен
+    storage_pg = None
+
+PG_URL = os.environ.get('ALLIES_TEST_DATABASE_URL')
+needs_psycopg2 = unittest.skipIf(storage_pg is None, 'нет psycopg2')
+needs_postgres = unittest.skipIf(storage_pg is None or not PG_URL, 'не задан ALLIES_TEST_DATABASE_URL')
+
+
+class AbstractStorageTest(unittest.TestCase):
+
+    def test_backend_without_connections_is_not_created(self):
+        class Incomplete(storage.Storage):
+            def reading(self):
+                pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_sqlite_backend_is_complete(self):
+        self.assertIsInstance(storage.SQLiteStorage(), storage.Storage)
+
+
+@needs_psycopg2
+class CompileSqlTest(unittest.TestCase):
+
+    def test_positional(self):
+        self.assertEqual(storage_pg.compile_sql('SELECT ? + ?'), ('SELECT $1 + $2', None))
+
+    def test_named_repeated(self):
+        text, names = storage_pg.compile_sql('SELECT :a, :b WHERE x = :a')
+        self.assertEqual(text, 'SELECT $1, $2 WHERE x = $1')
+        self.assertEqual(names, ('a', 'b'))
+
+    def test_casts_untouched(self):
+        self.assertEqual(storage_pg.compile_sql("SELECT :a::int, '1'::text"), ("SELECT $1::int, '1'::text", ('a',)))
+        self.assertEqual(storage_pg.compile_sql('SELECT ?::bigint'), ('SELECT $1::bigint', None))
+
+    def test_mixed_styles_rejected(self):
+        with self.assertRaises(ValueError):
+            storage_pg.compile_sql('SELECT ?, :a')
+
+
+class BackendTests:
+    """Запросы storage.Storage; self.store дает подкласс, база в начале теста пустая."""
+
+    store = None
+
+    def add_user(self, user_id):
+        with self.store.transaction() as conn:
+            game_id, game = self.store.resolve_game(conn, 'Dota 2')
+            self.store.save_profile(conn, user_id, f'user{user_id}', game, game_id, 'Рекрут', 1, 'описание')
+
+    def test_invite_answered_once(self):
+        self.add_user(1)
+        self.add_user(2)
+        with self.store.transaction() as conn:
+            self.assertTrue(self.store.create_invite(conn, 1, 2))
+            self.assertFalse(self.store.create_invite(conn, 1, 2))
+        with self.store.transaction() as conn:
+            self.assertTrue(self.store.set_invite_status(conn, 1, 2, 'accepted'))
+        with self.store.transaction() as conn:
+            self.assertFalse(self.store.set_invite_status(conn, 1, 2, 'rejected'))
+        with self.store.reading() as conn:
+            self.assertEqual(conn.execute('SELECT status FROM invites WHERE from_user_id = ?', (1,)).fetchall(),
+                             [('accepted',)])
+
+    def test_expire_and_archive_invites(self):
+        for user_id in (1, 2, 3):
+            self.add_user(user_id)
+        with self.store.transaction() as conn:
+            self.store.create_invite(conn, 1, 2)
+            self.store.create_invite(conn, 1, 3)
+            self.store.set_invite_status(conn, 1, 3, 'accepted')
+            conn.execute("UPDATE invites SET timestamp = ?", ('2020-01-01 00:00:00',))
+        with self.store.transaction() as conn:
+            self.assertEqual(self.store.expire_invites(conn, '2020-06-01 00:00:00', 10), 1)
+            # Истекший запрос не отвечается и не мешает отправить новый
+            self.assertFalse(self.store.set_invite_status(conn, 1, 2, 'accepted'))
+            self.assertTrue(self.store.create_invite(conn, 1, 2))
+        with self.store.transaction() as conn:
+            self.assertEqual(self.store.archive_invites(conn, '2020-06-01 00:00:00', 1), 1)
+            self.assertEqual(self.store.archive_invites(conn, '2020-06-01 00:00:00', 10), 1)
+            self.assertEqual(self.store.archive_invites(conn, '2020-06-01 00:00:00', 10), 0)
+        with self.store.reading() as conn:
+            self.assertEqual(conn.execute('SELECT status FROM invites').fetchall(), [('pending',)])
+            self.assertEqual(sorted(conn.execute('SELECT status FROM invites_archive').fetchall()),
+                             [('accepted',), ('expired',)])
+        # История читает обе таблицы
+        history = self.store.invite_history(1, ('9999-12-31 23:59:59', 0), False, 10)
+        self.assertEqual(sorted(row[2] for row in history), ['accepted', 'expired', 'pending'])
+        self.store.compact()
+
+    def test_resolve_game_only_reads_catalog(self):
+        with self.store.reading() as conn:
+            counts = [conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                      for table in ('games', 'game_aliases')]
+            self.assertEqual(self.store.resolve_game(conn, ' дота2 ')[1], 'Dota 2')
+            self.assertEqual(self.store.resolve_game(conn, 'Valorantt')[1], 'Valorant')
+            self.assertIsNone(self.store.resolve_game(conn, 'Kenshi'))
+            self.assertEqual([conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                              for table in ('games', 'game_aliases')], counts)
+
+    def test_add_game_and_alias(self):
+        with self.store.transaction() as conn:
+            game_id = self.store.add_game(conn, 'Kenshi', ['кенши'])
+            self.store.add_alias(conn, game_id, 'KNSH')
+        with self.store.reading() as conn:
+            for text in ('kenshi', 'Кенши', 'knsh'):
+                self.assertEqual(tuple(self.store.resolve_game(conn, text)), (game_id, 'Kenshi'))
+
+    def test_seen_round_trip(self):
+        self.assertIsNone(self.store.load_seen(1))
+        with self.store.transaction() as conn:
+            self.store.save_seen(conn, [(1, 100.0, 3, b'\x00\x01\\\n', None, 0), (2, 200.0, 0, b'', b'\xff', 7)])
+        with self.store.transaction() as conn:
+            self.store.save_seen(conn, [(1, 150.0, 4, b'\x02', b'\x00\x01\\\n', 2 ** 40)])
+        started, count, bits, previous, cursor = self.store.load_seen(1)
+        self.assertEqual((started, count, bytes(bits), bytes(previous), cursor),
+                         (150.0, 4, b'\x02', b'\x00\x01\\\n', 2 ** 40))
+        self.assertEqual(bytes(self.store.load_seen(2)[3]), b'\xff')
+
+    def test_outbox(self):
+        first = self.store.outbox_add(10, '{"text": "a"}', time.time())
+        second = self.store.outbox_add(11, '{"text": "b"}', time.time())
+        self.assertGreater(second, first)
+        self.assertEqual([row[:3] for row in self.store.outbox_after(0)],
+                         [(first, 10, '{"text": "a"}'), (second, 11, '{"text": "b"}')])
+        self.store.outbox_set_attempts(second, 2)
+        self.store.outbox_delete([first])
+        self.assertEqual(self.store.outbox_after(0), [(second, 11, '{"text": "b"}', 2)])
+        self.assertEqual(self.store.outbox_after(second), [])
+        # Пачка в одной транзакции; пустая ничего не делает
+        self.store.outbox_delete([])
+        self.store.outbox_delete([second, second + 1])
+        self.assertEqual(self.store.outbox_after(0), [])
+
+    def test_invalidations(self):
+        self.assertEqual(self.store.invalidations_last_id(), 0)
+        with self.store.transaction() as conn:
+            self.store.invalidation_add(conn, 1, 'hidden', None, 'a', 100.0)
+            self.store.invalidation_add(conn, 2, 'banned', 500, 'b', 200.0)
+        rows = self.store.invalidations_after(0)
+        self.assertEqual([row[1:] for row in rows], [(1, 'hidden', None, 'a'), (2, 'banned', 500, 'b')])
+        self.assertEqual(self.store.invalidations_last_id(), rows[1][0])
+        self.assertEqual(self.store.invalidations_after(rows[1][0]), [])
+        self.store.invalidations_prune(150.0)
+        self.assertEqual([row[1] for row in self.store.invalidations_after(0)], [2])
+
+    def test_state(self):
+        self.store.save_state('conversation', '1', 'a')
+        self.store.save_state('conversation', '1', 'b')
+        self.store.save_state('user_data', '1', 'c')
+        self.assertEqual(self.store.load_state('conversation'), [('1', 'b')])
+        self.store.delete_state('conversation', '1')
+        self.assertEqual(self.store.load_state('conversation'), [])
+
+
+class SQLiteStorageTest(BackendTests, unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='allies-test-')
+        db.configure(os.path.join(self.workdir, 'test.db'))
+        self.store = storage.SQLiteStorage()
+        self.store.init_schema()
+
+    def tearDown(self):
+        self.store.close()
+        db.configure(db.DB_PATH)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def auto_vacuum(self):
+        return db.fetchone('PRAGMA auto_vacuum')[0]
+
+    def test_new_database_is_incremental(self):
+        self.assertEqual(self.auto_vacuum(), storage.AUTO_VACUUM_INCREMENTAL)
+        with self.store.transaction() as conn:
+            conn.executemany('INSERT INTO bot_state (kind, key, data) VALUES (?, ?, ?)',
+                             [('t', str(i), 'x' * 1000) for i in range(2000)])
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM bot_state WHERE kind = 't'")
+        free = db.fetchone('PRAGMA freelist_count')[0]
+        self.assertGreater(free, storage.VACUUM_STEP)
+        self.assertEqual(self.store.compact(), free)
+        self.assertEqual(db.fetchone('PRAGMA freelist_count')[0], 0)
+
+    def test_existing_database_not_vacuumed_at_startup(self):
+        # База, созданная без auto_vacuum: старт ее не переписывает, compact не зацикливается
+        self.store.close()
+        path = os.path.join(self.workdir, 'old.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE legacy (x)')
+        conn.close()
+        db.configure(path)
+        with self.assertLogs('storage', 'WARNING'):
+            self.store.init_schema()
+        self.assertEqual(self.auto_vacuum(), 0)
+        self.assertEqual(self.store.compact(), 0)
+        self.store.vacuum()
+        self.assertEqual(self.auto_vacuum(), storage.AUTO_VACUUM_INCREMENTAL)
+
+
+@needs_postgres
+class PostgresStorageTest(BackendTests, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.store = storage_pg.PostgresStorage(PG_URL, pool_size=4)
+        cls.store.init_schema()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.store.close()
+
+    def setUp(self):
+        self.store.clear()
+        # Каталог игр - только сид, как в новой базе
+        with self.store.transaction() as conn:
+            conn.raw.cursor().execute(f'TRUNCATE {", ".join(storage_pg.CATALOG_TABLES)} RESTART IDENTITY')
+            seed_games(conn)
+
+    def test_placeholders(self):
+        with self.store.reading() as conn:
+            self.assertEqual(conn.execute('SELECT ?::int + ?::int', (1, 2)).fetchone(), (3,))
+            self.assertEqual(conn.execute('SELECT :a::int * :b + :a', {'a': 2, 'b': 5}).fetchone(), (12,))
+            # Тот же текст - тот же подготовленный оператор
+            prepared = len(conn._prepared)
+            self.assertEqual(conn.execute('SELECT ?::int + ?::int', (3, 4)).fetchone(), (7,))
+            self.assertEqual(len(conn._prepared), prepared)
+
+    def test_executemany_batches(self):
+        insert = 'INSERT INTO bot_state (kind, key, data) VALUES (?, ?, ?)'
+        statements = []
+        self.store.set_trace(statements.append)
+        try:
+            with self.store.transaction() as conn:
+                conn.executemany(insert, [('t', str(i), 'x') for i in range(storage_pg.BATCH_PAGE * 2 + 5)])
+                conn.executemany('UPDATE bot_state SET data = :data WHERE kind = :kind AND key = :key',
+                                 [{'kind': 't', 'key': '0', 'data': 'y'}])
+                conn.executemany('DELETE FROM bot_state WHERE key = ?', [])
+        finally:
+            self.store.set_trace(None)
+        # Один вызов на пачку, а не на строку
+        self.assertEqual(statements.count(insert), 1)
+        self.assertEqual(len(self.store.load_state('t')), storage_pg.BATCH_PAGE * 2 + 5)
+        self.assertIn(('0', 'y'), self.store.load_state('t'))
+
+    def test_pool_reuses_last_returned(self):
+        pool = storage_pg.ConnectionPool(PG_URL, self.store, size=2, timeout=0.1)
+        try:
+            first, second = pool.get(), pool.get()
+            pool.put(first)
+            pool.put(second)
+            self.assertIs(pool.get(), second)
+        finally:
+            pool.close()
+
+    def test_pool_discards_broken(self):
+        pool = storage_pg.ConnectionPool(PG_URL, self.store, size=1, timeout=0.1)
+        try:
+            conn = pool.get()
+            conn.broken = True
+            pool.put(conn)
+            self.assertTrue(conn.raw.closed)
+            fresh = pool.get()
+            self.assertIsNot(fresh, conn)
+            self.assertEqual(fresh.execute('SELECT 1').fetchone(), (1,))
+            pool.put(fresh)
+        finally:
+            pool.close()
+
+    def test_pool_exhausted(self):
+        pool = storage_pg.ConnectionPool(PG_URL, self.store, size=1, timeout=0.1)
+        try:
+            conn = pool.get()
+            with self.assertRaises(storage_pg.PoolError):
+                pool.get()
+            pool.put(conn)
+            self.assertIs(pool.get(), conn)
+            pool.put(conn)
+        finally:
+            pool.close()
+
+    def test_copy_from_sqlite(self):
+        import populate
+
+        workdir = tempfile.mkdtemp(prefix='allies-test-')
+        try:
+            path = os.path.join(workdir, 'source.db')
+            populate.create(path, 300, seed=1)
+            source = sqlite3.connect(path)
+            source.execute('INSERT INTO seen_profiles (user_id, started_at, count, bits) VALUES (1, 1.5, 2, ?)', (b'\x00\\\t\xff',))
+            source.commit()
+            expected = {table: source.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                        for table in storage_pg.CATALOG_TABLES + storage_pg.USER_TABLES}
+            max_invite = source.execute('SELECT MAX(id) FROM invites').fetchone()[0]
+            source.close()
+
+            counts = storage_pg.copy_from_sqlite(path, self.store)
+            self.assertEqual(counts, expected)
+            with self.store.reading() as conn:
+                for table, count in expected.items():
+                    self.assertEqual(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0], count, table)
+            self.assertEqual(bytes(self.store.load_seen(1)[2]), b'\x00\\\t\xff')
+
+            with self.assertRaises(ValueError):
+                storage_pg.copy_from_sqlite(path, self.store)
+            self.assertEqual(storage_pg.copy_from_sqlite(path, self.store, replace=True), expected)
+
+            # Последовательности продолжаются после перенесенных id
+            with self.store.transaction() as conn:
+                conn.execute('INSERT INTO invites (from_user_id, to_user_id) VALUES (?, ?)', (1, 2))
+                self.assertEqual(conn.execute('SELECT MAX(id) FROM invites').fetchone()[0], max_invite + 1)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
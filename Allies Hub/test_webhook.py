@@ -0,0 +1,98 @@
+"""Тесты эндпоинта вебхука webhook.WebhookServer.
+
+    python -m pytest test_webhook.py
+"""
+import http.client
+import json
+import threading
+import unittest
+
+from webhook import SECRET_HEADER, WebhookServer, update_user_id
+
+SECRET = 'test-secret'
+
+
+def message(update_id, user_id):
+    return {'update_id': update_id, 'message': {'from': {'id': user_id}, 'text': str(update_id)}}
+
+
+class UpdateUserIdTest(unittest.TestCase):
+
+    def test_sender(self):
+        self.assertEqual(update_user_id(message(1, 42)), 42)
+        self.assertEqual(update_user_id({'update_id': 2, 'callback_query': {'from': {'id': 7}}}), 7)
+
+    def test_malformed_falls_back(self):
+        self.assertEqual(update_user_id({'update_id': 3, 'message': {'from': 'x'}}), 3)
+        self.assertEqual(update_user_id({'update_id': 'x', 'message': []}), 0)
+
+
+class WebhookServerTest(unittest.TestCase):
+
+    def start(self, process_update, workers=2, queue_size=100):
+        self.server = WebhookServer(process_update, port=0, secret_token=SECRET,
+                                    workers=workers, queue_size=queue_size)
+        self.server.start()
+        self.addCleanup(self.server.stop, False)
+        self.conn = http.client.HTTPConnection(*self.server.address, timeout=5)
+        self.addCleanup(self.conn.close)
+
+    def post(self, data, secret=SECRET, path='/webhook'):
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        headers = {'Content-Type': 'application/json'}
+        if secret is not None:
+            headers[SECRET_HEADER] = secret
+        self.conn.request('POST', path, body, headers)
+        response = self.conn.getresponse()
+        response.read()
+        return response.status
+
+    def test_secret_required(self):
+        with self.assertRaises(ValueError):
+            WebhookServer(lambda data: None, port=0)
+
+    def test_wrong_secret_rejected(self):
+        received = []
+        self.start(received.append)
+        self.assertEqual(self.post(message(1, 1), secret=None), 403)
+        self.assertEqual(self.post(message(2, 1), secret='wrong'), 403)
+        self.conn.putrequest('POST', '/webhook')
+        self.conn.putheader(SECRET_HEADER, 'тест'.encode())
+        self.conn.putheader('Content-Length', '2')
+        self.conn.endheaders(b'{}')
+        self.assertEqual(self.conn.getresponse().status, 403)
+        self.server.stop()
+        self.assertEqual(received, [])
+
+    def test_malformed_body(self):
+        self.start(lambda data: None)
+        self.assertEqual(self.post(b'not json'), 400)
+        self.assertEqual(self.post(5), 400)
+        self.assertEqual(self.post(message(1, 1), path='/other'), 404)
+
+    def test_same_user_in_order(self):
+        received = []
+        self.start(lambda data: received.append(data['update_id']), workers=3)
+        for update_id in range(1, 21):
+            self.assertEqual(self.post(message(update_id, 5)), 200)
+        self.server.stop()
+        self.assertEqual(received, list(range(1, 21)))
+
+    def test_full_queue_answers_503(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def process(data):
+            started.set()
+            release.wait(5)
+
+        self.start(process, workers=1, queue_size=1)
+        self.assertEqual(self.post(message(1, 1)), 200)
+        started.wait(5)  # первое обновление у воркера, очередь пуста
+        self.assertEqual(self.post(message(2, 1)), 200)
+        self.assertEqual(self.post(message(3, 1)), 503)
+        release.set()
+
+
+if __name__ == '__main__':
+    unittest.main()
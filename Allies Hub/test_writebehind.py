@@ -0,0 +1,95 @@
+"""Тесты отложенной записи writebehind.WriteBehind на временной базе.
+
+    python -m pytest test_writebehind.py
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import db
+from writebehind import WriteBehind
+
+
+class WriteBehindTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='allies-test-')
+        db.configure(os.path.join(self.workdir, 'test.db'))
+        with db.transaction() as conn:
+            conn.execute('CREATE TABLE kv (user_id INTEGER PRIMARY KEY, value TEXT)')
+        # Пачку сбрасывают только wait() и stop()
+        self.writes = WriteBehind(interval=60)
+
+    def tearDown(self):
+        self.writes.stop()
+        db.close()
+        db.configure(db.DB_PATH)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def put(self, user_id, value):
+        self.writes.execute((user_id,), 'INSERT OR REPLACE INTO kv VALUES (?, ?)', (user_id, value))
+
+    def rows(self):
+        return dict(db.fetchall('SELECT user_id, value FROM kv'))
+
+    def test_before_start_writes_immediately(self):
+        self.put(1, 'a')
+        self.assertEqual(self.rows(), {1: 'a'})
+        self.assertEqual((self.writes.commits, self.writes.writes), (1, 1))
+
+    def test_batch_is_one_commit(self):
+        self.writes.start()
+        for user_id in range(100):
+            self.put(user_id, 'x')
+        self.assertEqual(self.writes.pending(), 100)
+        self.writes.wait(99)
+        self.assertEqual(len(self.rows()), 100)
+        self.assertEqual((self.writes.commits, self.writes.writes), (1, 100))
+
+    def test_wait_sees_own_writes(self):
+        self.writes.start()
+        self.put(1, 'a')
+        self.put(1, 'b')
+        self.writes.wait(1)
+        self.assertEqual(self.rows(), {1: 'b'})
+        # У другого пользователя ждать нечего
+        self.writes.wait(2)
+
+    def test_failing_write_retried_alone(self):
+        self.writes.start()
+        self.put(1, 'a')
+        self.writes.submit((2,), lambda conn: conn.execute('INSERT INTO missing VALUES (1)'))
+        self.put(3, 'c')
+        with self.assertLogs('writebehind', 'ERROR'):
+            self.writes.wait(3)
+        self.assertEqual(self.rows(), {1: 'a', 3: 'c'})
+        # Пачка откатилась, затем две записи из трех прошли поодиночке
+        self.assertEqual((self.writes.commits, self.writes.writes), (2, 3))
+        self.writes.wait(2)
+
+    def test_stop_flushes_queue(self):
+        self.writes.start()
+        self.put(1, 'a')
+        self.put(2, 'b')
+        self.writes.stop()
+        self.assertEqual(self.rows(), {1: 'a', 2: 'b'})
+        # После остановки - снова сразу
+        self.put(3, 'c')
+        self.assertEqual(self.rows()[3], 'c')
+
+    def test_unique_violation_keeps_batch(self):
+        with db.transaction() as conn:
+            conn.execute('CREATE TABLE uniq (value TEXT UNIQUE)')
+        self.writes.start()
+        for user_id, value in ((1, 'a'), (2, 'a'), (3, 'b')):
+            self.writes.execute((user_id,), 'INSERT INTO uniq VALUES (?)', (value,))
+        with self.assertLogs('writebehind', 'ERROR'):
+            self.writes.wait(1, 2, 3)
+        self.assertEqual(db.fetchall('SELECT value FROM uniq ORDER BY value'), [('a',), ('b',)])
+        self.assertRaises(sqlite3.IntegrityError, db.execute, 'INSERT INTO uniq VALUES (?)', ('a',))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def update_user_id(data: dict) -> int:
+    # Отправитель обновления - по нему выбирается воркер
+    for kind in ('message', 'edited_message', 'callback_query', 'inline_query'):
+        payload = data.get(kind)
+        if isinstance(payload, dict) and isinstance(payload.get('from'), dict):
+            user_id = payload['from'].get('id')
+            if isinstance(user_id, int):
+                return user_id
+    update_id = data.get('update_id', 0)
+    return update_id if isinstance(update_id, int) else 0
+
+
+class WebhookServer:
+    """Локальный HTTP-эндпоинт для вебхука Telegram.
+
+    Принятые обновления раскладываются по ограниченным очередям воркеров
+    по user_id: обновления одного пользователя обрабатываются одним воркером
+    и по порядку, как того требует ConversationHandler. Если очередь воркера
+    заполнена, отвечаем 503 - Telegram повторит доставку позже.
+
+    secret_token обязателен: без него эндпоинт принимал бы обновления от кого
+    угодно. Запрос без верного заголовка получает 403, не JSON-объект - 400.
+    Список обновлений (пачка от router.py) принимается целиком, с ожиданием
+    места в очередях.
+    """
+
+    def __init__(self, process_update, host='127.0.0.1', port=8443, path='/webhook',
+                 secret_token=None, workers=4, queue_size=1000):
+        if not secret_token:
+            raise ValueError("Вебхук без secret_token не запускается: задайте секрет")
+        self.process_update = process_update
+        self.path = path
+        self.secret_token = secret_token
+        self._secret = secret_token.encode()
+        self._queues = [queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self._threads = []
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self) -> None:
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(q,), name=f'webhook-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._server.serve_forever, name='webhook-http', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        logger.info("Вебхук слушает %s:%s%s", *self.address, self.path)
+
+    def is_alive(self) -> bool:
+        return bool(self._threads) and all(thread.is_alive() for thread in self._threads)
+
+    def stop(self, drain: bool = True) -> None:
+        # Сначала перестаем принимать, затем дорабатываем очереди
+        self._server.shutdown()
+        self._server.server_close()
+        for q in self._queues:
+            if drain:
+                q.join()
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def enqueue(self, data: dict) -> bool:
+        q = self._queues[update_user_id(data) % len(self._queues)]
+        try:
+            q.put_nowait(data)
+        except queue.Full:
+            return False
+        return True
+
+    def enqueue_many(self, items) -> None:
+        # Пачка от router.py: ждем места в очередях - фронт не повторяет
+        # доставку, и отказ посреди пачки переставил бы обновления
+        for data in items:
+            self._queues[update_user_id(data) % len(self._queues)].put(data)
+
+    def _worker(self, q: queue.Queue) -> None:
+        while True:
+            data = q.get()
+            if data is None:
+                q.task_done()
+                return
+            try:
+                self.process_update(data)
+            except Exception:
+                logger.exception("Ошибка обработки обновления %s", data.get('update_id'))
+            finally:
+                q.task_done()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                # Тело читаем всегда, иначе оно сломает следующий запрос в keep-alive соединении
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path != server.path:
+                    return self._reply(404)
+                # Заголовки http.server декодирует как latin-1: сравниваем байты,
+                # иначе не-ASCII в заголовке дает TypeError вместо 403
+                token = self.headers.get(SECRET_HEADER, '').encode('latin-1')
+                if not hmac.compare_digest(token, server._secret):
+                    return self._reply(403)
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    return self._reply(400)
+                if isinstance(data, list):
+                    if not all(isinstance(item, dict) for item in data):
+                        return self._reply(400)
+                    server.enqueue_many(data)
+                    return self._reply(200)
+                if not isinstance(data, dict):
+                    return self._reply(400)
+                self._reply(200 if server.enqueue(data) else 503)
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
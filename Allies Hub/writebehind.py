@@ -0,0 +1,148 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Сколько копить мелкие записи перед коммитом и когда коммитить раньше срока
+FLUSH_INTERVAL = 0.05
+MAX_BATCH = 500
+
+
+class WriteBehind:
+    """Отложенная запись мелких изменений пачками: одна транзакция на пачку.
+
+    Обработчик ставит запись в очередь и сразу возвращается, фоновый поток
+    раз в interval (или при max_batch записях) выполняет всю пачку в одной
+    транзакции. Каждая запись привязана к пользователям, которых она меняет:
+    wait(user_id) дожидается коммита их записей, поэтому свои изменения
+    пользователь видит сразу (read-your-writes), остальные - через interval.
+
+    До start() и после stop() записи выполняются сразу, как раньше.
+    Записи, не дождавшиеся коммита, при аварийном завершении теряются.
+    transaction - контекст транзакции хранилища (storage.py), по умолчанию db.py.
+    """
+
+    def __init__(self, interval: float = FLUSH_INTERVAL, max_batch: int = MAX_BATCH, transaction=None):
+        self.interval = interval
+        self.max_batch = max_batch
+        self._transaction = transaction or db.transaction
+        self._cond = threading.Condition()
+        self._queue = deque()   # (seq, fn)
+        self._last_seq = {}     # user_id -> seq последней его записи в очереди
+        self._seq = itertools.count(1)
+        self._committed = 0
+        self._urgent = False
+        self._thread = None
+        self._closing = False
+        self.commits = 0
+        self.writes = 0
+
+    # Постановка в очередь (вызывается из обработчиков)
+
+    def execute(self, user_ids, sql: str, params=()) -> None:
+        self.submit(user_ids, lambda conn: conn.execute(sql, params))
+
+    def submit(self, user_ids, fn) -> None:
+        """fn(conn) выполнится внутри транзакции пачки; user_ids - чьи данные она меняет."""
+        with self._cond:
+            if self._thread is not None and not self._closing:
+                seq = next(self._seq)
+                self._queue.append((seq, fn))
+                for user_id in user_ids:
+                    self._last_seq[user_id] = seq
+                if len(self._queue) >= self.max_batch:
+                    self._cond.notify_all()
+                return
+        # Идет остановка: сначала дописываются уже поставленные записи этих пользователей
+        self.wait(*user_ids)
+        with self._transaction() as conn:
+            fn(conn)
+        with self._cond:
+            self.commits += 1
+            self.writes += 1
+
+    def wait(self, *user_ids: int) -> None:
+        """Дожидается коммита уже поставленных записей этих пользователей."""
+        with self._cond:
+            seq = max((self._last_seq.get(user_id, 0) for user_id in user_ids), default=0)
+            if seq <= self._committed:
+                return
+            self._urgent = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._committed >= seq)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    # Запуск и остановка
+
+    def start(self) -> None:
+        with self._cond:
+            self._closing = False
+            self._thread = threading.Thread(target=self._writer, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Остаток очереди коммитится до выхода потока
+        with self._cond:
+            if self._thread is None:
+                return
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        thread.join()
+        with self._cond:
+            self._thread = None
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    # Запись
+
+    def _writer(self) -> None:
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.interval
+                while not (self._closing or self._urgent or len(self._queue) >= self.max_batch):
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                self._urgent = False
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch))]
+                if not batch and self._closing:
+                    return
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch) -> None:
+        commits = 0
+        try:
+            with self._transaction() as conn:
+                for _, fn in batch:
+                    fn(conn)
+            commits = 1
+        except Exception:
+            # Пачка откатилась целиком - повторяем записи по одной, чтобы
+            # ошибочная потеряла только себя
+            logger.exception("Пачка из %s записей не применена, повторяем по одной", len(batch))
+            for _, fn in batch:
+                try:
+                    with self._transaction() as conn:
+                        fn(conn)
+                    commits += 1
+                except Exception:
+                    logger.exception("Отложенная запись не применена")
+        with self._cond:
+            self.commits += commits
+            self.writes += len(batch)
+            self._committed = batch[-1][0]
+            for user_id in [user_id for user_id, seq in self._last_seq.items() if seq <= self._committed]:
+                del self._last_seq[user_id]
+            self._cond.notify_all()